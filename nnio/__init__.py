@@ -1,16 +1,73 @@
-__version__ = '0.3.1.2'
+__version__ = '0.4.0'
 
-# Base model class
-from .model import Model
+# Classes are imported on first use, so that ``import nnio`` does not load
+# backends, OpenCV and numpy until they are needed
+import importlib
 
-# Models for specific backends
-from .edgetpu import EdgeTPUModel
-from .openvino import OpenVINOModel
-from .onnx import ONNXModel
-from .pytorch import TorchModel
+_CLASSES = {
+    # Base model class
+    'Model': 'model',
 
-# Preprocessing class
-from .preprocessing import Preprocessing
+    # Models for specific backends
+    'EdgeTPUModel': 'edgetpu',
+    'OpenVINOModel': 'openvino',
+    'ONNXModel': 'onnx',
+    'TorchModel': 'pytorch',
 
-# Output classes
-from .output import DetectionBox
+    # Running models concurrently
+    'ModelPool': 'pool',
+    'ProcessPoolModel': 'process_pool',
+    'BatchingModel': 'batching',
+    'CachingModel': 'caching',
+    'Pipeline': 'pipeline',
+
+    # Sharing frames between processes
+    'SharedFrameBuffer': 'frame_buffer',
+
+    # Preprocessing class
+    'Preprocessing': 'preprocessing',
+
+    # Output classes
+    'DetectionBox': 'output',
+    'DetectionBatch': 'output',
+}
+
+_SUBMODULES = [
+    'batching',
+    'benchmark',
+    'caching',
+    'edgetpu',
+    'frame_buffer',
+    'index',
+    'model',
+    'onnx',
+    'openvino',
+    'output',
+    'pipeline',
+    'pool',
+    'process_pool',
+    # Postprocessing of detection models
+    'postprocessing',
+    'preprocessing',
+    # Profiling sinks
+    'profiling',
+    'pytorch',
+    'utils',
+]
+
+__all__ = list(_CLASSES) + ['postprocessing', 'profiling']
+
+def __getattr__(name):
+    if name in _CLASSES:
+        module = importlib.import_module('.' + _CLASSES[name], __name__)
+        value = getattr(module, name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_CLASSES) | set(_SUBMODULES))
@@ -0,0 +1,297 @@
+import collections
+import concurrent.futures
+import queue
+import threading
+import time
+import numpy as np
+
+from . import model as _model
+
+
+class _Request:
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.future = concurrent.futures.Future()
+        self.created = time.perf_counter()
+        # Size of the batch dimension of this request
+        self.size = inputs[0].shape[0] if len(inputs) > 0 else 1
+
+
+class BatchingModel(_model.Model):
+    '''
+    Collects calls from many threads into batches and runs the model once per batch.
+
+    Works with models which accept batches of any size, e.g. :class:`nnio.ONNXModel` and :class:`nnio.TorchModel`.
+    Inputs of every call must have the batch dimension (usually of size 1).
+    If the model has a fixed batch size of 1, calls are run one by one.
+
+    Usage example::
+
+        model = nnio.BatchingModel(
+            nnio.ONNXModel('path/to/model.onnx'),
+            max_batch_size=8,
+            max_wait_ms=5,
+        )
+
+        # Call from many camera threads
+        class_scores = model(preproc(frame))
+
+        print(model.stats())
+    '''
+    def __init__(
+        self,
+        model,
+        max_batch_size=8,
+        max_wait_ms=5,
+        dynamic_batch=None,
+    ):
+        '''
+        :parameter model: :class:`nnio.Model` to run.
+        :parameter max_batch_size: ``int``. Maximum number of rows in one batch,
+            i.e. sum of batch dimensions of the calls. A call with more rows is run alone.
+        :parameter max_wait_ms: ``float``.
+            How long the first call in a batch may wait for other calls, in milliseconds.
+        :parameter dynamic_batch: ``bool`` or ``None``.
+            Whether the model accepts batches of any size.
+            If ``None``, it is found out from ``model.get_input_details()``.
+        '''
+        super().__init__()
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        if dynamic_batch is None:
+            dynamic_batch = self._has_dynamic_batch(model)
+        self.dynamic_batch = dynamic_batch
+
+        # Statistics
+        self._lock = threading.Lock()
+        self._batch_sizes = collections.Counter()
+        self._n_requests = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+        self._requests = queue.Queue()
+        # New calls are not accepted after close or when the worker thread has stopped
+        self._shutdown_lock = threading.Lock()
+        self._closed = False
+        self._worker_error = None
+        # Request which did not fit into the previous batch
+        self._carried = None
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def forward(self, *inputs, return_info=False):
+        r'''
+        Add inputs to the next batch and wait for the result.
+
+        :parameter \*inputs: numpy arrays with batch dimension, Inputs to the model
+        :parameter return_info: bool, If True, will also return info about the batch:
+            ``batch_size``, ``wait_time`` (time in queue) and inference info of the model.
+        :return: output of the model for these inputs.
+        '''
+        result, info = self.forward_async(*inputs).result()
+        if return_info:
+            return result, info
+        else:
+            return result
+
+    def forward_async(self, *inputs):
+        r'''
+        Add inputs to the next batch and return without waiting.
+
+        :parameter \*inputs: numpy arrays with batch dimension, Inputs to the model
+        :return: :class:`concurrent.futures.Future`. Its result is a tuple ``(output, info)``.
+        '''
+        request = _Request(inputs)
+        with self._shutdown_lock:
+            if self._closed:
+                raise RuntimeError('Cannot run new calls after close')
+            if self._worker_error is not None:
+                raise RuntimeError('Worker thread has stopped: {}'.format(self._worker_error))
+            self._requests.put(request)
+        return request.future
+
+    def stats(self):
+        '''
+        :return: ``dict`` with statistics:
+            ``n_requests``, ``n_batches``, ``mean_batch_size``,
+            ``batch_sizes`` (number of batches of every size),
+            ``mean_wait_ms`` and ``max_wait_ms`` (time calls spend waiting for the batch to start).
+        '''
+        with self._lock:
+            n_batches = sum(self._batch_sizes.values())
+            return {
+                'n_requests': self._n_requests,
+                'n_batches': n_batches,
+                'mean_batch_size': self._n_requests / n_batches if n_batches else 0.0,
+                'batch_sizes': dict(sorted(self._batch_sizes.items())),
+                'mean_wait_ms': 1000 * self._total_wait / self._n_requests if self._n_requests else 0.0,
+                'max_wait_ms': 1000 * self._max_wait,
+            }
+
+    def close(self):
+        '''
+        Stop the worker thread after it finishes queued calls.
+        '''
+        with self._shutdown_lock:
+            if not self._closed:
+                self._closed = True
+                self._requests.put(None)
+        self._thread.join()
+
+    def get_preprocessing(self):
+        return self.model.get_preprocessing()
+
+    def get_input_details(self):
+        return self.model.get_input_details()
+
+    def get_output_details(self):
+        return self.model.get_output_details()
+
+    @staticmethod
+    def _has_dynamic_batch(model):
+        '''
+        Check if the first dimension of model inputs is not fixed to 1.
+        '''
+        details = model.get_input_details()
+        if not details:
+            return True
+        for info in details:
+            shape = info['shape']
+            if shape is not None and len(shape) > 0 and shape[0] == 1:
+                return False
+        return True
+
+    def _work(self):
+        try:
+            self._collect_batches()
+        except BaseException as e:
+            with self._shutdown_lock:
+                self._worker_error = e
+            # Fail calls which can not be run anymore
+            requests = [self._carried]
+            while True:
+                try:
+                    requests.append(self._requests.get_nowait())
+                except queue.Empty:
+                    break
+            for request in requests:
+                if request is not None:
+                    request.future.set_exception(RuntimeError('Worker thread has stopped: {}'.format(e)))
+
+    def _collect_batches(self):
+        while True:
+            if self._carried is not None:
+                request, self._carried = self._carried, None
+            else:
+                request = self._requests.get()
+            if request is None:
+                return
+            batch = [request]
+            if self.dynamic_batch:
+                # Wait for more requests
+                size = request.size
+                deadline = request.created + self.max_wait_ms / 1000
+                while size < self.max_batch_size:
+                    timeout = deadline - time.perf_counter()
+                    try:
+                        if timeout > 0:
+                            request = self._requests.get(timeout=timeout)
+                        else:
+                            request = self._requests.get_nowait()
+                    except queue.Empty:
+                        break
+                    if request is None:
+                        # Finish this batch and stop
+                        self._requests.put(None)
+                        break
+                    if size + request.size > self.max_batch_size:
+                        # Start the next batch with it
+                        self._carried = request
+                        break
+                    batch.append(request)
+                    size += request.size
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        try:
+            self._run_batch_unsafe(batch)
+        except BaseException as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            raise
+
+    def _run_batch_unsafe(self, batch):
+        start = time.perf_counter()
+        with self._lock:
+            self._batch_sizes[len(batch)] += 1
+            for request in batch:
+                wait = start - request.created
+                self._n_requests += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+        if self._profiler is not None:
+            for request in batch:
+                self._profiler.record({'queue_wait': int((start - request.created) * 1e9)})
+        if len(batch) == 1:
+            self._run_requests(batch)
+            return
+        try:
+            inputs = [
+                np.concatenate([request.inputs[i] for request in batch])
+                for i in range(len(batch[0].inputs))
+            ]
+        except ValueError:
+            # Inputs have different shapes. Run them one by one
+            self._run_requests(batch)
+            return
+        try:
+            results, info = self.model(*inputs, return_info=True)
+        except BaseException as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        # Split results between requests
+        try:
+            parts = []
+            offset = 0
+            for request in batch:
+                parts.append(self._split(results, slice(offset, offset + request.size)))
+                offset += request.size
+        except BaseException as e:
+            # E.g. the model returned something without the batch dimension
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        for request, result in zip(batch, parts):
+            request.future.set_result((result, self._make_info(info, request, len(batch), start)))
+
+    @staticmethod
+    def _split(results, part):
+        ''' Take rows of one request from outputs of the model. Keeps the type of outputs. '''
+        if isinstance(results, tuple) and hasattr(results, '_fields'):
+            # Named tuple
+            return type(results)(*[res[part] for res in results])
+        if isinstance(results, (list, tuple)):
+            return type(results)(res[part] for res in results)
+        if isinstance(results, dict):
+            return type(results)((key, res[part]) for key, res in results.items())
+        return results[part]
+
+    def _run_requests(self, batch):
+        start = time.perf_counter()
+        for request in batch:
+            try:
+                result, info = self.model(*request.inputs, return_info=True)
+            except BaseException as e:
+                request.future.set_exception(e)
+                continue
+            request.future.set_result((result, self._make_info(info, request, 1, start)))
+
+    @staticmethod
+    def _make_info(model_info, request, batch_size, start):
+        info = dict(model_info)
+        info['batch_size'] = batch_size
+        info['wait_time'] = start - request.created
+        return info
@@ -0,0 +1,1206 @@
+'''
+Benchmarks of nnio components.
+
+Example::
+
+    import nnio.benchmark
+    print(nnio.benchmark.benchmark_import_time())
+    print(nnio.benchmark.benchmark_preprocessing())
+    print(nnio.benchmark.benchmark_postprocessing())
+    print(nnio.benchmark.benchmark_index())
+
+Benchmark suite for all backends can be run from the command line::
+
+    python -m nnio.benchmark --format csv --output results.csv
+'''
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+from .preprocessing import Preprocessing
+
+
+def _time_calls(function, n_calls, *args, **kwargs):
+    '''
+    Call ``function`` ``n_calls`` times.
+
+    :return: mean time of one call in seconds
+    '''
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        function(*args, **kwargs)
+    return (time.perf_counter() - start) / n_calls
+
+
+# Configurations of :class:`nnio.Preprocessing` whose fused output is checked by ``benchmark_preprocessing``.
+# Output types without normalization skip lookup tables and take other code paths
+PREPROCESSING_CHECKS = [
+    dict(resize=(224, 224), dtype=dtype, bgr=bgr, channels_first=channels_first)
+    for dtype in ['uint8', 'float16', 'int8', 'uint16', 'int16', 'int32', 'int64']
+    for bgr in [False, True]
+    for channels_first in [False, True]
+]
+
+
+def _check_preprocessing(preproc, image, atol):
+    '''
+    Compare the fused preprocessing with the step-by-step one.
+
+    :return: maximum difference of outputs.
+    '''
+    fused = preproc(image)
+    reference = preproc._forward_reference(image)
+    assert fused.shape == reference.shape and fused.dtype == reference.dtype
+    max_diff = float(np.abs(fused.astype(np.float64) - reference).max())
+    if max_diff > atol:
+        raise BaseException('Fused preprocessing differs from reference by {}: {}'.format(max_diff, preproc))
+    return max_diff
+
+
+def benchmark_preprocessing(
+    image_size=(1920, 1080),
+    n_calls=20,
+    atol=1e-4,
+    checks=PREPROCESSING_CHECKS,
+    **preprocessing_kwargs,
+):
+    '''
+    Compare the fused preprocessing pipeline with the step-by-step one.
+
+    :parameter image_size: (width, height) of the random test image.
+    :parameter n_calls: ``int``. Number of calls to average over.
+    :parameter atol: ``float``. Maximum allowed difference between outputs.
+    :parameter checks: list of ``dict``. Other arguments of :class:`nnio.Preprocessing`,
+        for which outputs are compared but time is not measured.
+    :parameter preprocessing_kwargs: arguments of :class:`nnio.Preprocessing`.
+        By default imagenet preprocessing to ``(224, 224)`` in ``CHW`` BGR format is used.
+    :return: ``dict`` with mean call times in seconds and maximum output difference.
+    '''
+    if not preprocessing_kwargs:
+        preprocessing_kwargs = dict(
+            resize=(224, 224),
+            imagenet_scaling=True,
+            channels_first=True,
+            batch_dimension=True,
+            bgr=True,
+        )
+    preproc = Preprocessing(**preprocessing_kwargs)
+    image = np.random.randint(0, 256, [image_size[1], image_size[0], 3], dtype=np.uint8)
+
+    # Check that outputs are the same
+    max_diff = _check_preprocessing(preproc, image, atol)
+    for kwargs in checks:
+        max_diff = max(max_diff, _check_preprocessing(Preprocessing(**kwargs), image, atol))
+
+    # Measure time
+    fused_time = _time_calls(preproc, n_calls, image)
+    reference_time = _time_calls(preproc._forward_reference, n_calls, image)
+    return {
+        'fused_time': fused_time,
+        'reference_time': reference_time,
+        'speedup': reference_time / fused_time,
+        'max_diff': max_diff,
+    }
+
+
+def _random_detections(n_boxes, n_classes, n_objects=50, seed=0):
+    '''
+    Random detector output: boxes scattered around ``n_objects`` objects, as real detectors produce.
+
+    :return: tuple ``(boxes, scores)`` of shapes ``[n_boxes, 4]`` and ``[n_boxes, n_classes]``.
+    '''
+    rng = np.random.RandomState(seed)
+    centers = rng.uniform(0.1, 0.9, [n_objects, 2])
+    sizes = rng.uniform(0.05, 0.3, [n_objects, 2])
+    owner = rng.randint(0, n_objects, n_boxes)
+    box_centers = centers[owner] + rng.normal(0, 0.02, [n_boxes, 2])
+    box_sizes = sizes[owner] * rng.uniform(0.8, 1.2, [n_boxes, 2])
+    boxes = np.concatenate([box_centers - box_sizes / 2, box_centers + box_sizes / 2], axis=1)
+    scores = rng.uniform(0, 0.3, [n_boxes, n_classes])
+    object_classes = rng.randint(0, n_classes, n_objects)
+    scores[np.arange(n_boxes), object_classes[owner]] = rng.uniform(0.3, 1.0, n_boxes)
+    return boxes.astype(np.float32), scores.astype(np.float32)
+
+
+def _nms_reference(boxes, scores, iou_threshold):
+    '''
+    Box-by-box NMS in pure Python, the way it is usually written in detector integrations.
+    '''
+    def _iou(a, b):
+        w = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+        h = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+        intersection = w * h
+        union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+        return intersection / union
+    boxes = boxes.tolist()
+    keep = []
+    for i in sorted(range(len(boxes)), key=lambda i: -scores[i]):
+        if all(_iou(boxes[i], boxes[j]) <= iou_threshold for j in keep):
+            keep.append(i)
+    return keep
+
+
+def benchmark_postprocessing(n_boxes=10000, n_classes=80, n_calls=10, iou_threshold=0.5):
+    '''
+    Measure detection postprocessing from :mod:`nnio.postprocessing` on ``n_boxes`` candidate boxes.
+    Vectorized NMS and batched NMS are compared with pure Python implementations.
+
+    :parameter n_boxes: ``int``. Number of candidate boxes.
+    :parameter n_classes: ``int``. Number of classes.
+    :parameter n_calls: ``int``. Number of calls to average over.
+    :parameter iou_threshold: ``float``.
+    :return: ``dict`` with mean call times in seconds.
+    '''
+    from . import postprocessing
+    boxes, class_scores = _random_detections(n_boxes, n_classes)
+    scores = class_scores.max(axis=1)
+    class_ids = class_scores.argmax(axis=1)
+
+    # Check that outputs are the same
+    keep = postprocessing.nms(boxes, scores, iou_threshold)
+    start = time.perf_counter()
+    reference = _nms_reference(boxes, scores, iou_threshold)
+    reference_time = time.perf_counter() - start
+    if keep.tolist() != reference:
+        raise BaseException('Vectorized NMS differs from reference')
+    batched_keep = postprocessing.batched_nms(boxes, scores, class_ids, iou_threshold)
+    start = time.perf_counter()
+    batched_reference = []
+    for class_id in np.unique(class_ids):
+        indices = np.flatnonzero(class_ids == class_id)
+        batched_reference += indices[_nms_reference(boxes[indices], scores[indices], iou_threshold)].tolist()
+    batched_reference_time = time.perf_counter() - start
+    if sorted(batched_keep.tolist()) != sorted(batched_reference):
+        raise BaseException('Batched NMS differs from reference')
+    soft_keep, _ = postprocessing.soft_nms(boxes, scores, iou_threshold, method='hard')
+    if soft_keep.tolist() != reference:
+        raise BaseException('Soft NMS with hard method differs from NMS')
+
+    # Raw YOLO-like output with 3 anchors, big enough to hold n_boxes candidates
+    grid = int(np.ceil(np.sqrt(n_boxes / 3)))
+    yolo_output = np.random.normal(0, 1, [1, grid, grid, 3 * (5 + n_classes)]).astype(np.float32)
+    anchors = [[10, 13], [16, 30], [33, 23]]
+
+    nms_time = _time_calls(postprocessing.nms, n_calls, boxes, scores, iou_threshold)
+    batched_nms_time = _time_calls(postprocessing.batched_nms, n_calls, boxes, scores, class_ids, iou_threshold)
+    return {
+        'nms_time': nms_time,
+        'nms_reference_time': reference_time,
+        'nms_speedup': reference_time / nms_time,
+        'batched_nms_time': batched_nms_time,
+        'batched_nms_reference_time': batched_reference_time,
+        'batched_nms_speedup': batched_reference_time / batched_nms_time,
+        'soft_nms_time': _time_calls(
+            postprocessing.soft_nms, n_calls, boxes, scores),
+        'multiclass_nms_time': _time_calls(
+            postprocessing.multiclass_nms, n_calls, boxes[None], class_scores[None],
+            score_threshold=0.3, iou_threshold=iou_threshold),
+        'top_k_time': _time_calls(
+            postprocessing.top_k, n_calls, class_scores.reshape(1, -1), 1000),
+        'decode_yolo_time': _time_calls(
+            postprocessing.decode_yolo, n_calls, yolo_output, anchors, (grid * 8, grid * 8)),
+        'decode_yolo_v5_time': _time_calls(
+            postprocessing.decode_yolo, n_calls, yolo_output, anchors, (grid * 8, grid * 8), version=5),
+        'n_kept': len(keep),
+    }
+
+
+def _random_embeddings(n_vectors, dim, n_identities=None, noise=0.5, seed=0):
+    '''
+    Random normalized vectors scattered around ``n_identities`` centers, like embeddings of people.
+    '''
+    rng = np.random.RandomState(seed)
+    n_identities = n_identities or max(1, n_vectors // 10)
+    centers = rng.normal(size=[n_identities, dim]).astype(np.float32)
+    vectors = centers[rng.randint(0, n_identities, n_vectors)]
+    vectors += rng.normal(scale=noise, size=[n_vectors, dim]).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def benchmark_index(n_vectors=100000, dim=128, n_queries=200, n_probes=(1, 2, 4, 8, 16, 32), n_lists=None):
+    '''
+    Measure recall and latency of the approximate :class:`nnio.index.IVFIndex`
+    compared with the exact :class:`nnio.index.BruteForceIndex`.
+
+    :parameter n_vectors: ``int``. Number of vectors in the index.
+    :parameter dim: ``int``. Size of vectors.
+    :parameter n_queries: ``int``. Number of queries.
+    :parameter n_probes: values of ``n_probe`` to measure.
+    :parameter n_lists: ``int`` or ``None``. Number of clusters of the IVF index.
+    :return: list of ``dict`` with ``index``, ``n_probe``, ``recall`` (fraction of queries
+        for which the nearest vector is found) and ``latency`` (seconds per query).
+    '''
+    from .index import BruteForceIndex, IVFIndex
+    vectors = _random_embeddings(n_vectors + n_queries, dim)
+    vectors, queries = vectors[:n_vectors], vectors[n_vectors:]
+    exact = BruteForceIndex()
+    approximate = IVFIndex(n_lists=n_lists, min_train_size=n_vectors)
+    for vec in vectors:
+        exact.add(vec)
+        approximate.add(vec)
+
+    def _search_all(index):
+        start = time.perf_counter()
+        ids = np.concatenate([index.search(query[None])[1][:, 0] for query in queries])
+        return ids, (time.perf_counter() - start) / n_queries
+
+    true_ids, latency = _search_all(exact)
+    results = [{'index': 'brute_force', 'n_probe': None, 'recall': 1.0, 'latency': latency}]
+    for n_probe in n_probes:
+        approximate.n_probe = n_probe
+        ids, latency = _search_all(approximate)
+        results.append({
+            'index': 'ivf',
+            'n_probe': n_probe,
+            'recall': float((ids == true_ids).mean()),
+            'latency': latency,
+        })
+    return results
+
+
+# Modules which must not be loaded by ``import nnio``
+HEAVY_MODULES = ['cv2', 'numpy', 'torch', 'onnxruntime', 'openvino', 'tflite_runtime', 'pycoral']
+
+
+def benchmark_import_time(statement='import nnio', n_runs=5, forbidden=HEAVY_MODULES, max_time=None):
+    '''
+    Measure import time with ``python -X importtime`` in fresh interpreters.
+    Can be used as a regression check: raises ``BaseException``
+    if a forbidden module is imported or the import takes longer than ``max_time``.
+
+    :parameter statement: ``str``. Python code to measure.
+    :parameter n_runs: ``int``. Number of interpreters to run. The fastest run is reported.
+    :parameter forbidden: list of top-level modules which the statement must not import.
+    :parameter max_time: ``float`` or ``None``. Maximum allowed import time in seconds.
+    :return: ``dict`` with ``import_time`` (seconds, not counting imports made at interpreter startup)
+        and ``modules`` (top-level modules imported by the statement).
+    '''
+    import subprocess
+
+    def _measure(code):
+        ''' :return: total import time in seconds and set of imported top-level modules '''
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        )
+        # Lines look like "import time: self [us] | cumulative | imported package"
+        total = 0
+        modules = set()
+        for line in process.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            # Top-level imports have no indentation
+            if not name.startswith('  '):
+                total += int(cumulative)
+            modules.add(name.strip().split('.')[0])
+        return total / 1e6, modules
+
+    # Imports made by the interpreter at startup are subtracted
+    startup = [_measure('pass') for _ in range(n_runs)]
+    runs = [_measure(statement) for _ in range(n_runs)]
+    modules = runs[0][1] - startup[0][1]
+    import_time = max(0.0, min(t for t, _ in runs) - min(t for t, _ in startup))
+    bad_modules = sorted(modules & set(forbidden))
+    if bad_modules:
+        raise BaseException('"{}" imports {}'.format(statement, ', '.join(bad_modules)))
+    if max_time is not None and import_time > max_time:
+        raise BaseException('"{}" takes {:.4f} s, more than {} s'.format(statement, import_time, max_time))
+    return {
+        'import_time': import_time,
+        'modules': sorted(modules),
+    }
+
+
+def make_onnx_model(path, shape=(1, 3, 8, 8), n_filters=0):
+    '''
+    Save a tiny float32 onnx model with ``NCHW`` input.
+    Requires ``onnx`` package to be installed.
+
+    :parameter path: ``str``. Where to save the model.
+    :parameter shape: input shape. Dimensions may be strings to make them dynamic, e.g. ``('batch', 3, 64, 64)``.
+    :parameter n_filters: ``int``.
+        If ``0``, the model adds the input to itself.
+        Otherwise, it is a 3x3 convolution with ``n_filters`` output channels followed by ReLU.
+    :return: path to the model.
+    '''
+    import onnx
+    from onnx import helper, numpy_helper
+    shape = list(shape)
+    if n_filters == 0:
+        nodes = [helper.make_node('Add', ['input', 'input'], ['output'])]
+        weights = []
+        out_shape = shape
+    else:
+        nodes = [
+            helper.make_node('Conv', ['input', 'weights', 'bias'], ['conv'], pads=[1, 1, 1, 1]),
+            helper.make_node('Relu', ['conv'], ['output']),
+        ]
+        rng = np.random.default_rng(0)
+        weights = [
+            numpy_helper.from_array(rng.normal(0, 0.1, [n_filters, shape[1], 3, 3]).astype(np.float32), 'weights'),
+            numpy_helper.from_array(np.zeros([n_filters], dtype=np.float32), 'bias'),
+        ]
+        out_shape = [shape[0], n_filters] + shape[2:]
+    graph = helper.make_graph(
+        nodes,
+        'nnio_benchmark',
+        [helper.make_tensor_value_info('input', onnx.TensorProto.FLOAT, shape)],
+        [helper.make_tensor_value_info('output', onnx.TensorProto.FLOAT, out_shape)],
+        weights,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 7
+    onnx.save(model, path)
+    return path
+
+
+def make_tflite_model(path, shape=(1, 8, 8, 3), n_filters=0):
+    '''
+    Save a tiny float32 tflite model with ``NHWC`` input.
+    Requires ``flatbuffers`` package to be installed.
+
+    :parameter path: ``str``. Where to save the model.
+    :parameter shape: input shape.
+    :parameter n_filters: ``int``.
+        If ``0``, the model adds the input to itself.
+        Otherwise, it is a 3x3 convolution with ``n_filters`` output channels followed by ReLU.
+    :return: path to the model.
+    '''
+    import flatbuffers
+    shape = list(shape)
+    builder = flatbuffers.Builder(1024)
+
+    # Fields of tflite schema tables are addressed by their index
+    def _table(fields):
+        offsets = []
+        for i, kind, value in fields:
+            if kind == 'offset':
+                offsets.append((i, value))
+        builder.StartObject(max(i for i, _, _ in fields) + 1)
+        for i, kind, value in fields:
+            if kind == 'offset':
+                builder.PrependUOffsetTRelativeSlot(i, value, 0)
+            elif kind == 'int8':
+                builder.PrependInt8Slot(i, value, -1)
+            elif kind == 'uint8':
+                builder.PrependUint8Slot(i, value, 255)
+            elif kind == 'int32':
+                builder.PrependInt32Slot(i, value, -1)
+            elif kind == 'uint32':
+                builder.PrependUint32Slot(i, value, 0xFFFFFFFF)
+        return builder.EndObject()
+
+    def _int_vector(values):
+        builder.StartVector(4, len(values), 4)
+        for value in reversed(values):
+            builder.PrependInt32(value)
+        return builder.EndVector()
+
+    def _table_vector(tables):
+        builder.StartVector(4, len(tables), 4)
+        for table in reversed(tables):
+            builder.PrependUOffsetTRelative(table)
+        return builder.EndVector()
+
+    def _byte_vector(data):
+        builder.StartVector(1, len(data), 16)
+        for byte in reversed(data):
+            builder.PrependUint8(byte)
+        return builder.EndVector()
+
+    # Buffers. The first one must be empty
+    buffers_data = [b'']
+    if n_filters == 0:
+        out_shape = shape
+        # Tensors: (name, shape, buffer)
+        tensors = [('input', shape, 0), ('output', out_shape, 0)]
+        # Builtin operator ADD
+        op_code, op_inputs, op_outputs, op_options = 0, [0, 0], [1], None
+    else:
+        rng = np.random.default_rng(0)
+        weights = rng.normal(0, 0.1, [n_filters, 3, 3, shape[3]]).astype(np.float32)
+        buffers_data += [weights.tobytes(), np.zeros([n_filters], dtype=np.float32).tobytes()]
+        out_shape = shape[:3] + [n_filters]
+        tensors = [
+            ('input', shape, 0),
+            ('weights', list(weights.shape), 1),
+            ('bias', [n_filters], 2),
+            ('output', out_shape, 0),
+        ]
+        # Builtin operator CONV_2D with SAME padding, stride 1 and ReLU
+        op_code, op_inputs, op_outputs = 3, [0, 1, 2], [3]
+        op_options = _table([
+            (0, 'int8', 0),
+            (1, 'int32', 1),
+            (2, 'int32', 1),
+            (3, 'int8', 1),
+        ])
+
+    tensor_tables = []
+    for name, tensor_shape, buffer in tensors:
+        name = builder.CreateString(name)
+        tensor_shape = _int_vector(tensor_shape)
+        tensor_tables.append(_table([
+            (0, 'offset', tensor_shape),
+            (1, 'int8', 0), # FLOAT32
+            (2, 'uint32', buffer),
+            (3, 'offset', name),
+        ]))
+    operator_fields = [
+        (0, 'uint32', 0),
+        (1, 'offset', _int_vector(op_inputs)),
+        (2, 'offset', _int_vector(op_outputs)),
+    ]
+    if op_options is not None:
+        # Conv2DOptions in the BuiltinOptions union
+        operator_fields += [(3, 'uint8', 1), (4, 'offset', op_options)]
+    operator = _table(operator_fields)
+    subgraph = _table([
+        (0, 'offset', _table_vector(tensor_tables)),
+        (1, 'offset', _int_vector([0])),
+        (2, 'offset', _int_vector([len(tensors) - 1])),
+        (3, 'offset', _table_vector([operator])),
+    ])
+    operator_code = _table([
+        (0, 'int8', op_code),
+        (2, 'int32', 1),
+        (3, 'int32', op_code),
+    ])
+    buffer_tables = []
+    for data in buffers_data:
+        if data:
+            buffer_tables.append(_table([(0, 'offset', _byte_vector(data))]))
+        else:
+            builder.StartObject(1)
+            buffer_tables.append(builder.EndObject())
+    model = _table([
+        (0, 'uint32', 3),
+        (1, 'offset', _table_vector([operator_code])),
+        (2, 'offset', _table_vector([subgraph])),
+        (4, 'offset', _table_vector(buffer_tables)),
+    ])
+    builder.Finish(model, file_identifier=b'TFL3')
+    with open(path, 'wb') as f:
+        f.write(builder.Output())
+    return path
+
+
+def make_torch_model(path, n_channels=3, n_filters=0):
+    '''
+    Save a tiny torchscript model with ``NCHW`` input of any size.
+    Requires ``torch`` to be installed.
+
+    :parameter path: ``str``. Where to save the model.
+    :parameter n_channels: ``int``. Number of input channels.
+    :parameter n_filters: ``int``.
+        If ``0``, the model adds the input to itself.
+        Otherwise, it is a 3x3 convolution with ``n_filters`` output channels followed by ReLU.
+    :return: path to the model.
+    '''
+    import torch
+    if n_filters == 0:
+        class _Add(torch.nn.Module):
+            def forward(self, x):
+                return x + x
+        module = _Add()
+    else:
+        torch.manual_seed(0)
+        module = torch.nn.Sequential(
+            torch.nn.Conv2d(n_channels, n_filters, 3, padding=1),
+            torch.nn.ReLU(),
+        )
+    module.eval()
+    traced = torch.jit.trace(module, torch.zeros(1, n_channels, 8, 8))
+    torch.jit.save(traced, path)
+    return path
+
+
+def _direct_call(model, inputs):
+    '''
+    :return: function which runs the backend of the model directly, bypassing ``model.forward``.
+    '''
+    from .onnx import ONNXModel
+    from .edgetpu import EdgeTPUModel
+    from .openvino import OpenVINOModel
+    if isinstance(model, ONNXModel):
+        output_names = [info.name for info in model.sess.get_outputs()]
+        feed = {info.name: inp for info, inp in zip(model.sess.get_inputs(), inputs)}
+        return lambda: model.sess.run(output_names, feed)
+    if isinstance(model, EdgeTPUModel):
+        interpreter = model.interpreter
+        input_indices = [info['index'] for info in interpreter.get_input_details()]
+        output_indices = [info['index'] for info in interpreter.get_output_details()]
+        def _call():
+            for index, inp in zip(input_indices, inputs):
+                interpreter.set_tensor(index, inp)
+            interpreter.invoke()
+            return [interpreter.get_tensor(index) for index in output_indices]
+        return _call
+    if isinstance(model, OpenVINOModel):
+        feed = {list(model.net.input_info.keys())[0]: inputs[0]}
+        return lambda: model.net.infer(feed)
+    raise BaseException('Direct call is not supported for {}'.format(type(model).__name__))
+
+
+def benchmark_call_overhead(model, *inputs, n_calls=1000):
+    '''
+    Measure the Python overhead which ``model.forward`` adds over the direct backend call.
+    Use a tiny model (e.g. from :func:`make_onnx_model`) so that inference time does not dominate.
+
+    :parameter model: :class:`nnio.ONNXModel`, :class:`nnio.EdgeTPUModel` or :class:`nnio.OpenVINOModel`.
+    :parameter inputs: numpy arrays, inputs to the model.
+    :parameter n_calls: ``int``. Number of calls to average over.
+    :return: ``dict`` with mean call times in seconds.
+    '''
+    direct = _direct_call(model, inputs)
+    # Warmup
+    direct()
+    model(*inputs)
+    direct_time = _time_calls(direct, n_calls)
+    forward_time = _time_calls(model, n_calls, *inputs)
+    return {
+        'forward_time': forward_time,
+        'direct_time': direct_time,
+        'overhead': forward_time - direct_time,
+    }
+
+
+def benchmark_torch_overhead(input_shape=(1, 3, 224, 224), n_calls=1000, **model_kwargs):
+    '''
+    Compare the time of :class:`nnio.TorchModel` call with the way it used to convert data:
+    ``torch.tensor`` (which copies inputs) and ``torch.no_grad``.
+    A torchscript model which adds the input to itself is used, so that inference time does not dominate.
+
+    :parameter input_shape: shape of the ``float32`` input.
+    :parameter n_calls: ``int``. Number of calls to average over.
+    :parameter model_kwargs: arguments of :class:`nnio.TorchModel`.
+    :return: ``dict`` with mean call times in seconds.
+    '''
+    import torch
+    from .pytorch import TorchModel
+    with tempfile.TemporaryDirectory() as workdir:
+        model = TorchModel(make_torch_model(os.path.join(workdir, 'model.pt'), input_shape[1]), **model_kwargs)
+    inputs = np.random.uniform(0, 1, input_shape).astype(np.float32)
+
+    def _reference():
+        with torch.no_grad():
+            return model.model(torch.tensor(inputs, device=model.device)).cpu().numpy()
+
+    # Warmup
+    _reference()
+    model(inputs)
+    reference_time = _time_calls(_reference, n_calls)
+    forward_time = _time_calls(model, n_calls, inputs)
+    return {
+        'forward_time': forward_time,
+        'reference_time': reference_time,
+        'saved_time': reference_time - forward_time,
+    }
+
+
+# Settings compared by benchmark_onnx_options
+ONNX_SETTINGS = {
+    'default': {},
+    'no_optimization': {'graph_optimization_level': 'disable'},
+    'basic_optimization': {'graph_optimization_level': 'basic'},
+    'one_thread': {'intra_op_num_threads': 1},
+    'parallel': {'execution_mode': 'parallel'},
+    'no_arena': {'enable_cpu_mem_arena': False},
+    'cached': {'cache_optimized': True},
+}
+
+
+def benchmark_onnx_options(model_path=None, input_shape=(1, 3, 224, 224), n_filters=32, settings=None, n_warmup=10, n_runs=100):
+    '''
+    Measure startup time and latency of :class:`nnio.ONNXModel` with different session options.
+    Settings with ``cache_optimized`` are started twice: the first start fills the cache
+    and the second one loads the optimized model from it.
+
+    :parameter model_path: ``str``. Path to the model. By default a synthetic model is generated.
+    :parameter input_shape: input shape of the synthetic model.
+    :parameter n_filters: ``int``. Number of filters in the synthetic model.
+    :parameter settings: ``dict`` of arguments of :class:`nnio.ONNXModel` by setting name.
+        By default ``nnio.benchmark.ONNX_SETTINGS``.
+    :parameter n_warmup: ``int``. Number of calls which are not measured.
+    :parameter n_runs: ``int``. Number of measured calls.
+    :return: list of ``dict`` with ``setting``, ``startup_time``, ``cached_startup_time`` (or ``None``)
+        and ``latency`` (mean, seconds).
+    '''
+    # Import time of onnxruntime is not counted in startup time
+    import onnxruntime # pylint: disable=unused-import
+    from . import utils
+    from .onnx import ONNXModel
+    settings = settings or ONNX_SETTINGS
+    results = []
+    old_cache_dir = utils.CACHE_DIR
+    with tempfile.TemporaryDirectory() as workdir:
+        utils.set_cache_dir(os.path.join(workdir, 'cache'))
+        try:
+            if model_path is None:
+                model_path = make_onnx_model(os.path.join(workdir, 'model.onnx'), input_shape, n_filters)
+            for name, kwargs in settings.items():
+                start = time.perf_counter()
+                model = ONNXModel(model_path, **kwargs)
+                startup_time = time.perf_counter() - start
+                cached_startup_time = None
+                if kwargs.get('cache_optimized'):
+                    del model
+                    start = time.perf_counter()
+                    model = ONNXModel(model_path, **kwargs)
+                    cached_startup_time = time.perf_counter() - start
+                shape, dtype = _input_spec(model)
+                inputs = _random_input(shape, dtype)
+                results.append({
+                    'setting': name,
+                    'startup_time': startup_time,
+                    'cached_startup_time': cached_startup_time,
+                    'latency': benchmark_latency(model, inputs, n_warmup=n_warmup, n_runs=n_runs)['mean'],
+                })
+                del model
+        finally:
+            utils.set_cache_dir(old_cache_dir)
+    return results
+
+
+def benchmark_openvino_cache(model_xml=None, model_bin='', input_shape=(1, 3, 224, 224), n_filters=32, device='CPU', **model_kwargs):
+    '''
+    Measure startup time of :class:`nnio.OpenVINOModel` without ``cache_compiled``,
+    on the first start with it (which exports the compiled network)
+    and on the second one (which imports it).
+
+    :parameter model_xml: ``str``. Path to the model. By default a synthetic ONNX model is generated.
+    :parameter model_bin: ``str``. Path to the weights of the model.
+    :parameter input_shape: input shape of the synthetic model.
+    :parameter n_filters: ``int``. Number of filters in the synthetic model.
+    :parameter device: ``str``. Device to load the model to.
+    :parameter model_kwargs: other arguments of :class:`nnio.OpenVINOModel`.
+    :return: ``dict`` with ``startup_time``, ``export_startup_time`` and ``cached_startup_time`` in seconds.
+    '''
+    # Import time of openvino is not counted in startup time
+    import openvino.inference_engine # pylint: disable=unused-import
+    from . import utils
+    from .openvino import OpenVINOModel
+    results = {}
+    old_cache_dir = utils.CACHE_DIR
+    with tempfile.TemporaryDirectory() as workdir:
+        utils.set_cache_dir(os.path.join(workdir, 'cache'))
+        try:
+            if model_xml is None:
+                model_xml = make_onnx_model(os.path.join(workdir, 'model.onnx'), input_shape, n_filters)
+            for name, cache_compiled in [
+                ('startup_time', False),
+                ('export_startup_time', True),
+                ('cached_startup_time', True),
+            ]:
+                start = time.perf_counter()
+                model = OpenVINOModel(model_bin, model_xml, device=device, cache_compiled=cache_compiled, **model_kwargs)
+                results[name] = time.perf_counter() - start
+                del model
+        finally:
+            utils.set_cache_dir(old_cache_dir)
+    return results
+
+
+def benchmark_async_throughput(model, inputs, n_calls=100):
+    '''
+    Compare throughput of blocking ``model.forward`` with ``model.forward_async``,
+    which keeps several inferences in flight (e.g. :class:`nnio.OpenVINOModel` with ``num_requests > 1``).
+
+    :parameter model: model with ``forward_async`` method.
+    :parameter inputs: numpy array, input to the model.
+    :parameter n_calls: ``int``. Number of inferences to run.
+    :return: ``dict`` with throughputs in inferences per second.
+    '''
+    # Warmup
+    model(inputs)
+    model.forward_async(inputs).result()
+    sync_time = _time_calls(model, n_calls, inputs)
+    start = time.perf_counter()
+    futures = [model.forward_async(inputs) for _ in range(n_calls)]
+    for future in futures:
+        future.result()
+    async_time = (time.perf_counter() - start) / n_calls
+    return {
+        'sync_throughput': 1 / sync_time,
+        'async_throughput': 1 / async_time,
+    }
+
+
+# Backends available in the benchmark suite:
+# input layout and whether synthetic models accept any batch size
+BACKENDS = {
+    'onnx': {'layout': 'NCHW', 'dynamic_batch': True},
+    'tflite': {'layout': 'NHWC', 'dynamic_batch': False},
+    'torch': {'layout': 'NCHW', 'dynamic_batch': True},
+    'openvino': {'layout': 'NCHW', 'dynamic_batch': False},
+}
+
+
+def _model_factory(backend, model_path, weights_path=None):
+    '''
+    :return: function which takes a device name and creates a model of the backend.
+    '''
+    if backend == 'onnx':
+        from .onnx import ONNXModel
+        return lambda device: ONNXModel(model_path)
+    if backend == 'tflite':
+        from .edgetpu import EdgeTPUModel
+        return lambda device: EdgeTPUModel(model_path, device=device)
+    if backend == 'torch':
+        from .pytorch import TorchModel
+        return lambda device: TorchModel(model_path, device=device.lower())
+    if backend == 'openvino':
+        from .openvino import OpenVINOModel
+        return lambda device: OpenVINOModel(weights_path or '', model_path, device=device)
+    raise BaseException('Unknown backend {}. Available: {}'.format(backend, list(BACKENDS)))
+
+
+def _synthetic_model(backend, workdir, input_size, n_filters):
+    '''
+    Save a synthetic model for the backend into ``workdir``.
+
+    :return: path to the model and its input shape.
+    '''
+    if BACKENDS[backend]['layout'] == 'NHWC':
+        shape = [1, input_size, input_size, 3]
+    else:
+        shape = [1, 3, input_size, input_size]
+    if backend == 'onnx':
+        path = make_onnx_model(os.path.join(workdir, 'model.onnx'), ['batch'] + shape[1:], n_filters)
+    elif backend == 'tflite':
+        path = make_tflite_model(os.path.join(workdir, 'model.tflite'), shape, n_filters)
+    elif backend == 'torch':
+        path = make_torch_model(os.path.join(workdir, 'model.pt'), shape[1], n_filters)
+    else:
+        # OpenVINO reads onnx models with fixed input shape
+        path = make_onnx_model(os.path.join(workdir, 'model_fixed.onnx'), shape, n_filters)
+    return path, shape
+
+
+def _input_spec(model, input_shape=None):
+    '''
+    :return: input shape and dtype of the model.
+    '''
+    details = model.get_input_details()
+    dtype = 'float32'
+    if details:
+        from .onnx import ONNXModel
+        dtype_str = str(details[0]['dtype'])
+        dtype = ONNXModel.DTYPES.get(dtype_str, dtype)
+        for name in ['float16', 'float32', 'float64', 'uint8', 'int8', 'int32', 'int64']:
+            if name in dtype_str:
+                dtype = name
+        if input_shape is None:
+            # Dynamic dimensions become 1
+            input_shape = [
+                dim if isinstance(dim, (int, np.integer)) and dim > 0 else 1
+                for dim in details[0]['shape']
+            ]
+    if input_shape is None:
+        raise BaseException('Cannot find out input shape of the model. Please specify it')
+    return [int(dim) for dim in input_shape], dtype
+
+
+def _random_input(shape, dtype):
+    if 'float' in dtype:
+        return np.random.rand(*shape).astype(dtype)
+    return np.random.randint(0, 100, shape).astype(dtype)
+
+
+def benchmark_latency(model, *inputs, n_warmup=10, n_runs=100):
+    '''
+    Measure latency of the model calls.
+
+    :parameter model: :class:`nnio.Model`.
+    :parameter inputs: numpy arrays, inputs to the model.
+    :parameter n_warmup: ``int``. Number of calls which are not measured.
+    :parameter n_runs: ``int``. Number of measured calls.
+    :return: ``dict`` with ``mean``, ``p50``, ``p90`` and ``p99`` latency in seconds.
+    '''
+    for _ in range(n_warmup):
+        model(*inputs)
+    latencies = []
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        model(*inputs)
+        latencies.append(time.perf_counter() - start)
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {
+        'mean': float(np.mean(latencies)),
+        'p50': float(p50),
+        'p90': float(p90),
+        'p99': float(p99),
+    }
+
+
+def benchmark_throughput(model_factory, *inputs, concurrency=1, n_runs=100):
+    '''
+    Measure throughput of several copies of the model working at the same time.
+    Copies are run by :class:`nnio.ModelPool`.
+
+    :parameter model_factory: function which takes a device name and returns :class:`nnio.Model`.
+    :parameter inputs: numpy arrays, inputs to the model.
+    :parameter concurrency: ``int``. Number of model copies.
+    :parameter n_runs: ``int``. Number of calls.
+    :return: number of calls per second.
+    '''
+    from .pool import ModelPool
+    pool = ModelPool(model_factory, n_replicas=concurrency)
+    try:
+        # Warmup every copy
+        list(pool.map([inputs] * concurrency))
+        start = time.perf_counter()
+        for _ in pool.map([inputs] * n_runs):
+            pass
+        return n_runs / (time.perf_counter() - start)
+    finally:
+        pool.close()
+
+
+class _PythonNMSModel:
+    '''
+    Model which spends its time in python code holding the GIL, like parsing of detector outputs.
+    '''
+    def __init__(self, device, iou_threshold=0.5):
+        self.iou_threshold = iou_threshold
+
+    def __call__(self, boxes, scores, return_info=False):
+        start = time.perf_counter()
+        keep = np.array(_nms_reference(boxes, scores, self.iou_threshold))
+        if return_info:
+            return keep, {'inference_time': time.perf_counter() - start}
+        return keep
+
+    def get_preprocessing(self):
+        return None
+
+    def get_input_details(self):
+        return None
+
+    def get_output_details(self):
+        return None
+
+
+def benchmark_process_pool(model_factory=_PythonNMSModel, inputs=None, n_workers=(1, 2, 4), n_runs=200):
+    '''
+    Compare throughput of :class:`nnio.ModelPool` (threads) and :class:`nnio.ProcessPoolModel` (processes)
+    with the same number of model copies.
+
+    :parameter model_factory: picklable function which takes a device name and returns :class:`nnio.Model`.
+        By default a model which runs NMS in pure python.
+    :parameter inputs: tuple of numpy arrays, inputs to the model.
+        By default 2000 random detections.
+    :parameter n_workers: list of ``int``. Numbers of model copies to try.
+    :parameter n_runs: ``int``. Number of calls.
+    :return: list of ``dict`` with ``n_workers``, ``thread_throughput`` and ``process_throughput``
+        in calls per second.
+    '''
+    from .process_pool import ProcessPoolModel
+    if inputs is None:
+        boxes, scores = _random_detections(2000, 1)
+        inputs = (boxes, scores[:, 0])
+    results = []
+    for n in n_workers:
+        pool = ProcessPoolModel(model_factory, n_workers=n)
+        try:
+            # Warmup every process
+            list(pool.map([inputs] * n))
+            start = time.perf_counter()
+            for _ in pool.map([inputs] * n_runs):
+                pass
+            process_throughput = n_runs / (time.perf_counter() - start)
+        finally:
+            pool.close()
+        results.append({
+            'n_workers': n,
+            'thread_throughput': benchmark_throughput(model_factory, *inputs, concurrency=n, n_runs=n_runs),
+            'process_throughput': process_throughput,
+        })
+    return results
+
+
+def _queue_frame_reader(frames, n_frames, results):
+    latencies = []
+    for _ in range(n_frames):
+        timestamp, frame = frames.get()
+        latencies.append(time.time() - timestamp)
+    results.send(latencies)
+
+
+def _buffer_frame_reader(buffer, n_frames, results):
+    latencies = []
+    for frame in buffer.reader(start=0):
+        latencies.append(time.time() - frame.timestamp)
+        if len(latencies) == n_frames:
+            break
+    results.send(latencies)
+
+
+def benchmark_frame_buffer(shape=(1080, 1920, 3), n_frames=100, interval=0.02, n_slots=8):
+    '''
+    Compare passing frames to another process through :class:`multiprocessing.Queue` (pickling)
+    and through :class:`nnio.SharedFrameBuffer`.
+
+    :parameter shape: shape of a frame.
+    :parameter n_frames: ``int``. Number of frames to pass.
+    :parameter interval: ``float``. Seconds between frames, e.g. ``0.02`` for a 50 fps camera.
+    :parameter n_slots: ``int``. Number of slots in the frame buffer.
+    :return: ``dict`` with mean ``queue_write_time``, ``queue_latency``,
+        ``buffer_write_time`` and ``buffer_latency`` in seconds.
+        Latency is the time from writing a frame until the reader gets it.
+    '''
+    import multiprocessing
+    from .frame_buffer import SharedFrameBuffer
+    context = multiprocessing.get_context('spawn')
+    frame = np.random.RandomState(0).randint(0, 256, shape).astype(np.uint8)
+    results = {}
+
+    def run(name, reader, channel, write):
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=reader, args=(channel, n_frames, sender))
+        process.start()
+        # Give the reader time to start
+        time.sleep(1.0)
+        write_time = 0.0
+        for _ in range(n_frames):
+            start = time.perf_counter()
+            write()
+            write_time += time.perf_counter() - start
+            time.sleep(interval)
+        latencies = receiver.recv()
+        process.join()
+        results[name + '_write_time'] = write_time / n_frames
+        results[name + '_latency'] = float(np.mean(latencies))
+
+    frames = context.Queue()
+    run('queue', _queue_frame_reader, frames, lambda: frames.put((time.time(), frame)))
+    buffer = SharedFrameBuffer(shape=shape, n_slots=n_slots)
+    try:
+        run('buffer', _buffer_frame_reader, buffer, lambda: buffer.write(frame))
+    finally:
+        buffer.close()
+        buffer.unlink()
+    return results
+
+
+def _peak_rss():
+    ''' Peak resident set size of the process in bytes '''
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_benchmarks(
+    backends=None,
+    model_path=None,
+    weights_path=None,
+    input_shape=None,
+    input_size=64,
+    n_filters=16,
+    n_warmup=10,
+    n_runs=100,
+    concurrency=(1, 2, 4),
+    batch_sizes=(1, 4, 8),
+    device='CPU',
+    isolate=True,
+):
+    '''
+    Run the benchmark suite.
+    If ``model_path`` is not specified, a synthetic model is generated for every backend,
+    so the suite works offline.
+
+    :parameter backends: list of backend names from ``nnio.benchmark.BACKENDS``.
+        By default all backends are tried and those which are not installed are skipped.
+    :parameter model_path: ``str``. Path to the model. Only one backend may be used with it.
+    :parameter weights_path: ``str``. Path to the openvino ``.bin`` file.
+    :parameter input_shape: input shape of the model. By default taken from the model details.
+    :parameter input_size: ``int``. Image size of the synthetic models.
+    :parameter n_filters: ``int``. Number of convolution filters in the synthetic models.
+    :parameter n_warmup: ``int``. Number of calls which are not measured.
+    :parameter n_runs: ``int``. Number of measured calls.
+    :parameter concurrency: numbers of model copies running at the same time.
+    :parameter batch_sizes: batch sizes to measure. Used only for models which accept any batch size.
+    :parameter device: ``str``. Device to put the models on.
+    :parameter isolate: ``bool``. Run every backend in a new process.
+        Otherwise ``peak_rss`` of a backend includes memory used by the backends before it.
+    :return: list of ``dict`` records with keys
+        ``backend``, ``metric``, ``concurrency``, ``batch_size``, ``value``, ``unit``.
+        ``peak_rss`` is the peak memory of the process after loading one model and measuring its latency.
+    '''
+    if backends is None:
+        if model_path is not None:
+            raise BaseException('Specify the backend of the model')
+        backends = list(BACKENDS)
+    if model_path is not None and len(backends) != 1:
+        raise BaseException('Only one backend may be used with model_path')
+
+    records = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for backend in backends:
+            args = (
+                backend, workdir, model_path, weights_path, input_shape, input_size, n_filters,
+                n_warmup, n_runs, concurrency, batch_sizes, device,
+            )
+            try:
+                if isolate:
+                    import concurrent.futures
+                    import multiprocessing
+                    with concurrent.futures.ProcessPoolExecutor(
+                            1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                        records += executor.submit(_benchmark_backend, *args).result()
+                else:
+                    records += _benchmark_backend(*args)
+            except ImportError as e:
+                print('Skipping {}: {}'.format(backend, e), file=sys.stderr)
+    return records
+
+
+def _benchmark_backend(
+    backend, workdir, model_path, weights_path, input_shape, input_size, n_filters,
+    n_warmup, n_runs, concurrency, batch_sizes, device,
+):
+    '''
+    Run the benchmark suite for one backend. See :func:`run_benchmarks`.
+
+    :return: list of records.
+    '''
+    records = []
+
+    def _record(metric, value, unit, concurrency=1, batch_size=1):
+        records.append({
+            'backend': backend,
+            'metric': metric,
+            'concurrency': concurrency,
+            'batch_size': batch_size,
+            'value': value,
+            'unit': unit,
+        })
+
+    # Keep messages printed while loading models out of the results
+    with contextlib.redirect_stdout(sys.stderr):
+        if model_path is None:
+            path, shape = _synthetic_model(backend, workdir, input_size, n_filters)
+            dynamic_batch = BACKENDS[backend]['dynamic_batch']
+        else:
+            path, shape, dynamic_batch = model_path, input_shape, False
+        factory = _model_factory(backend, path, weights_path)
+        model = factory(device)
+        shape, dtype = _input_spec(model, shape)
+        inputs = _random_input(shape, dtype)
+
+        # Latency
+        latency = benchmark_latency(model, inputs, n_warmup=n_warmup, n_runs=n_runs)
+        for name, value in latency.items():
+            _record('latency_' + name, value, 's')
+        _record('peak_rss', _peak_rss(), 'bytes')
+
+        # Throughput with several model copies
+        for n_copies in concurrency:
+            value = benchmark_throughput(
+                lambda _: factory(device), inputs,
+                concurrency=n_copies, n_runs=n_runs)
+            _record('throughput', value, 'samples/s', concurrency=n_copies)
+
+        # Throughput with batches
+        if dynamic_batch:
+            for batch_size in batch_sizes:
+                batch = _random_input([batch_size] + shape[1:], dtype)
+                value = benchmark_latency(model, batch, n_warmup=n_warmup, n_runs=n_runs)['mean']
+                _record('batch_throughput', batch_size / value, 'samples/s', batch_size=batch_size)
+
+        # Preprocessing of a full HD frame to the model input
+        if len(shape) == 4:
+            channels_first = BACKENDS[backend]['layout'] == 'NCHW'
+            height, width = (shape[2], shape[3]) if channels_first else (shape[1], shape[2])
+            preproc = Preprocessing(
+                resize=(width, height),
+                dtype=dtype,
+                divide_by_255='float' in dtype or None,
+                channels_first=channels_first,
+                batch_dimension=True,
+            )
+            image = np.random.randint(0, 256, [1080, 1920, 3], dtype=np.uint8)
+            _record('preprocessing_time', _time_calls(preproc, n_runs, image), 's')
+    return records
+
+
+def write_records(records, file, output_format='json'):
+    '''
+    Write benchmark records.
+
+    :parameter records: list of ``dict`` from :func:`run_benchmarks`.
+    :parameter file: file object.
+    :parameter output_format: ``'json'`` or ``'csv'``.
+    '''
+    if output_format == 'json':
+        json.dump(records, file, indent=2)
+        file.write('\n')
+    elif output_format == 'csv':
+        writer = csv.DictWriter(
+            file, ['backend', 'metric', 'concurrency', 'batch_size', 'value', 'unit'])
+        writer.writeheader()
+        writer.writerows(records)
+    else:
+        raise BaseException('Unknown output format: {}'.format(output_format))
+
+
+def main(argv=None):
+    '''
+    Command line interface of the benchmark suite::
+
+        python -m nnio.benchmark --backends onnx tflite --format csv --output results.csv
+    '''
+    parser = argparse.ArgumentParser(
+        prog='python -m nnio.benchmark',
+        description='Benchmark nnio backends. Without --model, synthetic models are generated.')
+    parser.add_argument('--backends', nargs='+', choices=list(BACKENDS),
+                        help='backends to benchmark (default: all installed)')
+    parser.add_argument('--model', help='path to the model (use with one backend)')
+    parser.add_argument('--weights', help='path to the openvino .bin file')
+    parser.add_argument('--input-shape', type=int, nargs='+', help='input shape of the model')
+    parser.add_argument('--input-size', type=int, default=64, help='image size of synthetic models')
+    parser.add_argument('--filters', type=int, default=16, help='number of filters in synthetic models')
+    parser.add_argument('--warmup', type=int, default=10, help='number of warmup calls')
+    parser.add_argument('--runs', type=int, default=100, help='number of measured calls')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4],
+                        help='numbers of model copies running at the same time')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8],
+                        help='batch sizes for models which accept any batch size')
+    parser.add_argument('--device', default='CPU', help='device to put models on')
+    parser.add_argument('--format', choices=['json', 'csv'], default='json', help='output format')
+    parser.add_argument('--output', help='output file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    records = run_benchmarks(
+        backends=args.backends,
+        model_path=args.model,
+        weights_path=args.weights,
+        input_shape=args.input_shape,
+        input_size=args.input_size,
+        n_filters=args.filters,
+        n_warmup=args.warmup,
+        n_runs=args.runs,
+        concurrency=args.concurrency,
+        batch_sizes=args.batch_sizes,
+        device=args.device,
+    )
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            write_records(records, f, args.format)
+    else:
+        write_records(records, sys.stdout, args.format)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+import collections
+import copy
+import hashlib
+import sys
+import threading
+import time
+import numpy as np
+
+from . import model as _model
+
+
+class _Entry:
+    def __init__(self, signature, thumbnail, outputs, n_bytes):
+        self.signature = signature
+        self.thumbnail = thumbnail
+        self.outputs = outputs
+        self.n_bytes = n_bytes
+        self.created = time.monotonic()
+
+
+def _signature(inputs):
+    return tuple((inp.shape, inp.dtype.str) for inp in inputs)
+
+
+def _thumbnail(array, size):
+    '''
+    Downsample array by averaging blocks, so that no dimension is larger than ``size``.
+    '''
+    array = np.asarray(array)
+    steps = [max(1, dim // size) for dim in array.shape]
+    # Crop dimensions to multiples of the block size
+    array = array[tuple(slice(0, dim // step * step) for dim, step in zip(array.shape, steps))]
+    shape = []
+    for dim, step in zip(array.shape, steps):
+        shape += [dim // step, step]
+    blocks = array.reshape(shape).astype(np.float32, copy=False)
+    return blocks.mean(axis=tuple(range(1, 2 * array.ndim, 2)), dtype=np.float32).ravel()
+
+
+def _copy_outputs(outputs):
+    if isinstance(outputs, np.ndarray):
+        return outputs.copy()
+    if type(outputs) in (list, tuple):
+        return type(outputs)(_copy_outputs(out) for out in outputs)
+    if type(outputs) is dict:
+        return {key: _copy_outputs(out) for key, out in outputs.items()}
+    return copy.deepcopy(outputs)
+
+
+def _size_of(outputs):
+    ''' Approximate memory size of outputs in bytes '''
+    if isinstance(outputs, np.ndarray):
+        return outputs.nbytes
+    if isinstance(outputs, (list, tuple)):
+        return sys.getsizeof(outputs) + sum(_size_of(out) for out in outputs)
+    if isinstance(outputs, dict):
+        return sys.getsizeof(outputs) + sum(_size_of(out) for out in outputs.values())
+    if hasattr(outputs, '__dict__'):
+        return sys.getsizeof(outputs) + _size_of(vars(outputs))
+    return sys.getsizeof(outputs)
+
+
+class CachingModel(_model.Model):
+    '''
+    Returns saved outputs of the model for inputs which it has already seen.
+    Useful for fixed cameras, which give long runs of nearly identical frames.
+
+    With ``threshold=0``, only exactly equal inputs are matched, using a hash of their data.
+    Otherwise inputs are downsampled to small thumbnails, and an input is matched
+    to a saved one if the mean absolute difference of their thumbnails is at most ``threshold``.
+    Saved outputs are evicted in least recently used order when they take more than ``max_bytes``.
+
+    Usage example::
+
+        model = nnio.CachingModel(
+            nnio.ONNXModel('path/to/model.onnx'),
+            # Inputs are scaled to [0, 1]
+            threshold=0.01,
+        )
+        for frame in frames:
+            class_scores = model(preproc(frame))
+
+        # Tune the threshold for the camera
+        print(model.stats())
+    '''
+    def __init__(
+        self,
+        model,
+        threshold=0.0,
+        thumbnail_size=16,
+        max_bytes=64 * 2**20,
+        max_age=None,
+    ):
+        '''
+        :parameter model: :class:`nnio.Model` or any function of numpy arrays.
+        :parameter threshold: ``float``. Maximum mean absolute difference of thumbnails
+            for an input to be treated as seen, in units of input values.
+            If ``0``, inputs must be exactly equal.
+        :parameter thumbnail_size: ``int``. Maximum size of every dimension of thumbnails.
+        :parameter max_bytes: ``int``. Maximum memory size of saved outputs.
+        :parameter max_age: ``float`` or ``None``. Saved outputs older than this number of seconds are not used.
+        '''
+        super().__init__()
+        self.model = model
+        self.threshold = threshold
+        self.thumbnail_size = thumbnail_size
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        # Entries from least to most recently used
+        self._entries = collections.OrderedDict()
+        self._n_bytes = 0
+        self._next_key = 0
+        # Keys and stacked thumbnails of entries with the last seen input signature.
+        # Rebuilt when entries change
+        self._stacked = None
+
+        # Statistics
+        self._n_calls = 0
+        self._n_hits = 0
+        self._model_time = 0.0
+        self._lookup_time = 0.0
+        self._saved_time = 0.0
+
+    def forward(self, *inputs, return_info=False):
+        r'''
+        Return saved outputs for seen inputs or run the model.
+
+        :parameter \*inputs: numpy arrays, Inputs to the model
+        :parameter return_info: bool, If True, will also return ``cache_hit``, ``lookup_time``
+            and inference info of the model (if it is run).
+        :return: output of the model.
+        '''
+        start = time.perf_counter()
+        signature = _signature(inputs)
+        if self.threshold == 0:
+            thumbnail = None
+            key = self._hash(signature, inputs)
+        else:
+            thumbnail = np.concatenate([_thumbnail(inp, self.thumbnail_size) for inp in inputs])
+            key = None
+        with self._lock:
+            entry = self._find(key, signature, thumbnail)
+            lookup_time = time.perf_counter() - start
+            self._n_calls += 1
+            self._lookup_time += lookup_time
+            if entry is not None:
+                self._n_hits += 1
+                n_misses = self._n_calls - self._n_hits
+                if n_misses:
+                    self._saved_time += self._model_time / n_misses
+                self._saved_time -= lookup_time
+                outputs = entry.outputs
+        spans = {'lookup': int(lookup_time * 1e9)}
+        if entry is not None:
+            return self._finish(_copy_outputs(outputs), spans, return_info, {'cache_hit': True})
+
+        model_start = time.perf_counter()
+        outputs, info = self._run_model(inputs)
+        model_time = time.perf_counter() - model_start
+        n_bytes = _size_of(outputs) + (thumbnail.nbytes if thumbnail is not None else 0)
+        saved = _copy_outputs(outputs)
+        with self._lock:
+            self._model_time += model_time
+            self._add(key, _Entry(signature, thumbnail, saved, n_bytes))
+        extra_info = dict(info or {})
+        extra_info['cache_hit'] = False
+        return self._finish(outputs, spans, return_info, extra_info)
+
+    def stats(self):
+        '''
+        :return: ``dict`` with statistics:
+            ``n_calls``, ``n_hits``, ``hit_rate``,
+            ``saved_time`` (estimated seconds saved by cache hits, minus time of lookups),
+            ``lookup_time`` (total seconds spent on fingerprints and lookups),
+            ``n_entries`` and ``n_bytes`` (memory size of saved outputs).
+        '''
+        with self._lock:
+            return {
+                'n_calls': self._n_calls,
+                'n_hits': self._n_hits,
+                'hit_rate': self._n_hits / self._n_calls if self._n_calls else 0.0,
+                'saved_time': self._saved_time,
+                'lookup_time': self._lookup_time,
+                'n_entries': len(self._entries),
+                'n_bytes': self._n_bytes,
+            }
+
+    def clear(self):
+        '''
+        Remove all saved outputs. Statistics are kept.
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._n_bytes = 0
+            self._stacked = None
+
+    def get_preprocessing(self):
+        return self.model.get_preprocessing()
+
+    def get_input_details(self):
+        return self.model.get_input_details()
+
+    def get_output_details(self):
+        return self.model.get_output_details()
+
+    def _run_model(self, inputs):
+        if isinstance(self.model, _model.Model):
+            return self.model(*inputs, return_info=True)
+        return self.model(*inputs), None
+
+    @staticmethod
+    def _hash(signature, inputs):
+        digest = hashlib.blake2b(repr(signature).encode(), digest_size=16)
+        for inp in inputs:
+            digest.update(np.ascontiguousarray(inp).data)
+        return digest.digest()
+
+    def _find(self, key, signature, thumbnail):
+        '''
+        :return: matching entry or ``None``. Must be called with the lock held.
+        '''
+        if key is not None:
+            entry = self._entries.get(key)
+        else:
+            if self._stacked is None or self._stacked[0] != signature:
+                # Entries with other input shapes never match
+                keys = [key for key, entry in self._entries.items() if entry.signature == signature]
+                thumbnails = np.stack([self._entries[key].thumbnail for key in keys]) if keys else None
+                self._stacked = (signature, keys, thumbnails)
+            _, keys, thumbnails = self._stacked
+            if not keys:
+                return None
+            distances = np.abs(thumbnails - thumbnail).mean(axis=1)
+            i = np.argmin(distances)
+            if distances[i] > self.threshold:
+                return None
+            key = keys[i]
+            entry = self._entries[key]
+        if entry is None:
+            return None
+        if self.max_age is not None and time.monotonic() - entry.created > self.max_age:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _add(self, key, entry):
+        ''' Must be called with the lock held '''
+        if entry.n_bytes > self.max_bytes:
+            return
+        if key is None:
+            key = self._next_key
+            self._next_key += 1
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._n_bytes += entry.n_bytes
+        while self._n_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        self._stacked = None
+
+    def _remove(self, key):
+        ''' Must be called with the lock held '''
+        entry = self._entries.pop(key)
+        self._n_bytes -= entry.n_bytes
+        self._stacked = None
@@ -37,33 +37,73 @@ class EdgeTPUModel(_model.Model):
         assert device == 'CPU' or device.split(':')[0] == 'TPU' or device[0] == ':'
         self.interpreter = self._make_interpreter(model_path, device)
         self.interpreter.allocate_tensors()
+        # Resolve tensor indices once
+        self._input_indices = [inp['index'] for inp in self.interpreter.get_input_details()]
+        self._output_indices = [out['index'] for out in self.interpreter.get_output_details()]
 
     def forward(self, *inputs, return_info=False):
         assert len(inputs) == self.n_inputs
-        start = time.time()
+        start = time.perf_counter_ns()
         # Put input tensors into model
         for i in range(self.n_inputs):
             tensor = self._input_tensor(i)
             tensor[:, :, :, :] = inputs[i]
             del tensor
-        before_invoke = time.time()
+        before_invoke = time.perf_counter_ns()
+        # Call model
+        results, spans = self._invoke()
+        spans['input'] = before_invoke - start
+        # Return results
+        return self._finish(results, spans, return_info, {'assign_time': spans['input'] / 1e9})
+
+    def input_buffer(self, i=0):
+        '''
+        Returns the interpreter's own input tensor as a numpy array.
+        Data written into it is used by the next :meth:`invoke` call without copying.
+
+        Usage example::
+
+            preproc(image, out=model.input_buffer(0))
+            class_scores = model.invoke()
+
+        The interpreter refuses to run while references to its buffers exist,
+        so do not keep the returned array (or the result of ``preproc``) alive when calling :meth:`invoke`.
+
+        :parameter i: ``int``. Index of the input tensor.
+        :return: numpy array of the input tensor shape and dtype.
+        '''
+        return self._input_tensor(i)
+
+    def invoke(self, return_info=False):
+        '''
+        Run the model on the data previously written into :meth:`input_buffer`.
+
+        :parameter return_info: bool, If True, will return inference time
+        :return: numpy array or list of numpy arrays.
+        '''
+        results, spans = self._invoke()
+        return self._finish(results, spans, return_info)
+
+    def _invoke(self):
+        '''
+        Run the model and get its outputs.
+
+        :return: results and durations of stages in nanoseconds.
+        '''
+        start = time.perf_counter_ns()
         # Call model
         self.interpreter.invoke()
-        after_invoke = time.time()
+        after_invoke = time.perf_counter_ns()
         # Get results from the model
         results = [self._output_tensor(i) for i in range(self.n_outputs)]
         # Process output a little
         if self.n_outputs == 1:
             results = results[0]
-        # Return results
-        if return_info:
-            info = {
-                'assign_time': before_invoke - start,
-                'invoke_time': after_invoke - before_invoke,
-            }
-            return results, info
-        else:
-            return results
+        spans = {
+            'invoke': after_invoke - start,
+            'output': time.perf_counter_ns() - after_invoke,
+        }
+        return results, spans
 
     def get_input_details(self):
         return [
@@ -128,22 +168,19 @@ class EdgeTPUModel(_model.Model):
         '''
         Returns input tensor view as function returning numpy array
         '''
-        tensor_index = self.interpreter.get_input_details()[i]['index']
-        return self.interpreter.tensor(tensor_index)()
+        return self.interpreter.tensor(self._input_indices[i])()
 
     def _output_tensor(self, i=0):
         """Returns output tensor view."""
-        tensor_index = self.interpreter.get_output_details()[i]['index']
-        tensor = self.interpreter.get_tensor(tensor_index)
-        return tensor
+        return self.interpreter.get_tensor(self._output_indices[i])
 
     @property
     def n_inputs(self):
         ''' number of input tensors '''
-        return len(self.interpreter.get_input_details())
+        return len(self._input_indices)
 
     @property
     def n_outputs(self):
         ''' number of output tensors '''
-        return len(self.interpreter.get_output_details())
+        return len(self._output_indices)
 
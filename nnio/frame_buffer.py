@@ -0,0 +1,301 @@
+import collections
+import time
+import numpy as np
+
+# Header of the shared memory block
+_HEADER = np.dtype([
+    ('magic', '<u8'),
+    ('n_slots', '<i8'),
+    ('ndim', '<i8'),
+    ('shape', '<i8', (8,)),
+    ('dtype', 'S8'),
+    # Sequence number of the last written frame, -1 if nothing is written
+    ('latest', '<i8'),
+    # Nonzero when the writer has finished the stream
+    ('finished', '<i8'),
+])
+# State of every slot. Sequence number is -1 while the slot is empty or being written
+_SLOT = np.dtype([('seq', '<i8'), ('timestamp', '<f8')])
+_MAGIC = 0x6e6e696f66726d31
+# Frames are aligned to this number of bytes
+ALIGNMENT = 64
+
+Frame = collections.namedtuple('Frame', ['seq', 'timestamp', 'image'])
+Frame.__doc__ = '''
+Frame read from :class:`nnio.SharedFrameBuffer`: sequence number, timestamp and image.
+'''
+
+
+def _align(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _attach_shared_memory(name):
+    '''
+    Open existing shared memory and keep it out of the resource tracker.
+    Otherwise the memory is removed when this process exits, though other processes still use it.
+    '''
+    from multiprocessing import resource_tracker, shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no ``track`` argument
+        pass
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, 'shared_memory') # pylint: disable=protected-access
+    return shm
+
+
+class SharedFrameBuffer:
+    '''
+    Ring buffer of fixed-shape frames in shared memory.
+    One process writes frames (e.g. from a camera) and any number of processes read them
+    without copying and without pickling.
+
+    Every written frame gets a sequence number. The writer overwrites the oldest slot,
+    so a reader which holds a frame for too long may see it changed.
+    Readers either get every frame in order (skipping frames they were too slow for)
+    or only the latest frame (see :meth:`reader`).
+
+    Usage example::
+
+        # Camera process
+        buffer = nnio.SharedFrameBuffer(shape=(1080, 1920, 3), n_slots=8)
+        # Pass buffer.name (or the buffer itself) to other processes
+        while True:
+            buffer.write(camera.read())
+
+        # Detector process
+        buffer = nnio.SharedFrameBuffer(name)
+        for frame in buffer.reader(latest_only=True):
+            boxes = model(preproc(frame.image))
+            if not buffer.is_valid(frame.seq):
+                # The writer has overwritten the frame while it was processed
+                ...
+    '''
+    def __init__(self, name=None, shape=None, n_slots=8, dtype='uint8'):
+        '''
+        :parameter name: ``str``. Name of the shared memory.
+            If ``shape`` is not specified, attach to an existing buffer with this name.
+        :parameter shape: shape of a frame, e.g. ``(1080, 1920, 3)``.
+            If specified, a new buffer is created.
+        :parameter n_slots: ``int``. Number of frames in the buffer. Only used when creating a buffer.
+        :parameter dtype: type of frames. Only used when creating a buffer.
+        '''
+        from multiprocessing import shared_memory
+        create = shape is not None
+        if create:
+            shape = tuple(int(d) for d in shape)
+            dtype = np.dtype(dtype)
+            if len(shape) > _HEADER['shape'].shape[0]:
+                raise BaseException('Frames can have at most {} dimensions'.format(_HEADER['shape'].shape[0]))
+            if n_slots < 2:
+                raise BaseException('SharedFrameBuffer needs at least 2 slots')
+            frame_bytes = int(np.prod(shape)) * dtype.itemsize
+            size = _align(_HEADER.itemsize) + _align(n_slots * _SLOT.itemsize) + n_slots * _align(frame_bytes)
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            header = np.ndarray((), _HEADER, buffer=self._shm.buf)
+            header['n_slots'] = n_slots
+            header['ndim'] = len(shape)
+            header['shape'][:len(shape)] = shape
+            header['dtype'] = dtype.str.encode()
+            header['latest'] = -1
+            header['finished'] = 0
+        else:
+            if name is None:
+                raise BaseException('Either name or shape of SharedFrameBuffer must be specified')
+            self._shm = _attach_shared_memory(name)
+            header = np.ndarray((), _HEADER, buffer=self._shm.buf)
+            if header['magic'] != _MAGIC:
+                raise BaseException('Shared memory {} is not a SharedFrameBuffer'.format(name))
+        self._header = header
+        self.n_slots = int(header['n_slots'])
+        self.shape = tuple(int(d) for d in header['shape'][:int(header['ndim'])])
+        self.dtype = np.dtype(header['dtype'][()].decode())
+
+        offset = _align(_HEADER.itemsize)
+        self._slots = np.ndarray([self.n_slots], _SLOT, buffer=self._shm.buf, offset=offset)
+        offset += _align(self.n_slots * _SLOT.itemsize)
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self._frames = np.ndarray(
+            (self.n_slots,) + self.shape, self.dtype, buffer=self._shm.buf, offset=offset,
+            strides=(_align(frame_bytes),) + np.empty(self.shape, self.dtype).strides,
+        )
+        if create:
+            self._slots['seq'] = -1
+            # Readers may attach only after the buffer is initialized
+            self._header['magic'] = _MAGIC
+        # Frames given to readers are read-only
+        self._frames_view = self._frames.view()
+        self._frames_view.flags.writeable = False
+
+    @property
+    def name(self):
+        ''' name of the shared memory. Use it to attach to the buffer in other processes. '''
+        return self._shm.name
+
+    @property
+    def latest_seq(self):
+        ''' sequence number of the last written frame, ``-1`` if nothing is written yet '''
+        return int(self._header['latest'])
+
+    @property
+    def finished(self):
+        ''' ``True`` if the writer has called :meth:`finish` '''
+        return bool(self._header['finished'])
+
+    def write(self, frame, timestamp=None):
+        '''
+        Write a frame to the oldest slot. Only one process may write to the buffer.
+
+        :parameter frame: numpy array of the buffer's shape.
+        :parameter timestamp: ``float``. By default ``time.time()``.
+        :return: sequence number of the frame.
+        '''
+        seq = int(self._header['latest']) + 1
+        slot = seq % self.n_slots
+        # Readers see that the slot is being written
+        self._slots['seq'][slot] = -1
+        self._frames[slot] = frame
+        self._slots['timestamp'][slot] = time.time() if timestamp is None else timestamp
+        self._slots['seq'][slot] = seq
+        self._header['latest'] = seq
+        return seq
+
+    def finish(self):
+        '''
+        Tell readers that no more frames will be written. Their iterators stop after the last frame.
+        '''
+        self._header['finished'] = 1
+
+    def read(self, seq=None, copy=False):
+        '''
+        Read a frame.
+
+        :parameter seq: ``int``. Sequence number of the frame. By default the latest frame.
+        :parameter copy: ``bool``. If ``False``, ``image`` is a read-only view of the shared memory,
+            which is valid until the writer reuses the slot (see :meth:`is_valid`).
+        :return: :class:`nnio.frame_buffer.Frame` or ``None``
+            if the frame is not written yet or is already overwritten.
+        '''
+        if seq is None:
+            seq = self.latest_seq
+        if seq < 0:
+            return None
+        slot = seq % self.n_slots
+        if self._slots['seq'][slot] != seq:
+            return None
+        timestamp = float(self._slots['timestamp'][slot])
+        image = self._frames_view[slot]
+        if copy:
+            image = image.copy()
+        # Check that the writer has not started to overwrite the slot meanwhile
+        if self._slots['seq'][slot] != seq:
+            return None
+        return Frame(seq, timestamp, image)
+
+    def is_valid(self, seq):
+        '''
+        :return: ``True`` if the frame with this sequence number is still in the buffer.
+        '''
+        return seq >= 0 and self._slots['seq'][seq % self.n_slots] == seq
+
+    def reader(self, latest_only=False, timeout=None, copy=False, start=None, poll_interval=0.001):
+        '''
+        Create an iterator over new frames.
+
+        :parameter latest_only: ``bool``. If ``True``, every read returns the newest frame,
+            skipping the frames written since the previous read.
+            This is for real-time consumers which must not fall behind.
+            Otherwise frames are read in order, and only frames which are overwritten are skipped.
+        :parameter timeout: ``float``. Seconds to wait for a new frame before iteration stops.
+            By default wait until the writer calls :meth:`finish`.
+        :parameter copy: ``bool``. Whether to copy images (see :meth:`read`).
+        :parameter start: ``int``. Sequence number of the first frame to read.
+            By default the first frame written after the reader is created.
+        :parameter poll_interval: ``float``. Seconds between checks for a new frame.
+        :return: :class:`nnio.frame_buffer.FrameReader`.
+        '''
+        return FrameReader(self, latest_only, timeout, copy, start, poll_interval)
+
+    def close(self):
+        '''
+        Close access to the shared memory from this object.
+        Frames read without copying must not be used after this.
+        '''
+        self._header = self._slots = self._frames = self._frames_view = None
+        self._shm.close()
+
+    def unlink(self):
+        '''
+        Remove the shared memory. Call it in the process which created the buffer, after :meth:`close`.
+        '''
+        from multiprocessing import resource_tracker
+        # Readers which share the resource tracker with this process (e.g. its spawned children)
+        # have unregistered the memory, and unlink would unregister it again
+        resource_tracker.register(self._shm._name, 'shared_memory') # pylint: disable=protected-access
+        self._shm.unlink()
+
+    def __reduce__(self):
+        # Other processes attach to the same memory
+        return (SharedFrameBuffer, (self.name,))
+
+    def __str__(self):
+        return 'nnio.SharedFrameBuffer(name={}, shape={}, dtype={}, n_slots={}, latest_seq={})'.format(
+            self.name, self.shape, self.dtype, self.n_slots, self.latest_seq,
+        )
+
+
+class FrameReader:
+    '''
+    Iterator over frames of :class:`nnio.SharedFrameBuffer`. Created by :meth:`nnio.SharedFrameBuffer.reader`.
+    '''
+    def __init__(self, buffer, latest_only=False, timeout=None, copy=False, start=None, poll_interval=0.001):
+        self.buffer = buffer
+        self.latest_only = latest_only
+        self.timeout = timeout
+        self.copy = copy
+        self.poll_interval = poll_interval
+        # Sequence number of the next frame to read
+        self.next_seq = buffer.latest_seq + 1 if start is None else start
+        # Number of frames skipped by this reader
+        self.n_dropped = 0
+
+    def read(self, timeout=-1):
+        '''
+        Wait for a new frame and read it.
+
+        :parameter timeout: ``float`` or ``None``. Seconds to wait. By default the reader's timeout.
+        :return: :class:`nnio.frame_buffer.Frame` or ``None``
+            if there is no new frame after the timeout or the writer has finished.
+        '''
+        if timeout == -1:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            latest = self.buffer.latest_seq
+            if latest >= self.next_seq:
+                if self.latest_only:
+                    seq = latest
+                else:
+                    # Oldest frame which is still in the buffer
+                    seq = max(self.next_seq, latest - self.buffer.n_slots + 1)
+                frame = self.buffer.read(seq, self.copy)
+                if frame is None:
+                    # Overwritten while reading. Try a newer frame
+                    continue
+                self.n_dropped += seq - self.next_seq
+                self.next_seq = seq + 1
+                return frame
+            if self.buffer.finished:
+                return None
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def __iter__(self):
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
@@ -0,0 +1,469 @@
+'''
+Nearest neighbour indices of normalized vectors, used by :class:`nnio.utils.HumanDataBase`.
+
+Distance between vectors is ``1 - cosine similarity``.
+Every vector gets an integer id, which stays the same until the vector is removed.
+Ids are given in increasing order and are never reused.
+
+Vectors are kept in a storage: :class:`ArrayStorage` keeps them in memory,
+:class:`FileStorage` keeps them in memory-mapped files, which can be shared between processes.
+
+Example::
+
+    db = nnio.utils.HumanDataBase(index=nnio.index.IVFIndex(n_probe=8))
+'''
+import json
+import os
+import tempfile
+import numpy as np
+
+# States of rows of the index
+EMPTY = 0
+ALIVE = 1
+REMOVED = 2
+
+
+def _smallest(distances, ids, k):
+    '''
+    Select ``k`` smallest distances in every row. Equal distances are ordered by id.
+
+    :return: tuple ``(distances, ids)`` of shape ``[N, k]``, padded with ``inf`` and ``-1``.
+    '''
+    n_queries, n = distances.shape
+    if k < n:
+        part = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        distances = np.take_along_axis(distances, part, axis=1)
+        ids = np.take_along_axis(ids, part, axis=1) if ids.ndim == 2 else ids[part]
+    elif ids.ndim == 1:
+        ids = np.broadcast_to(ids, distances.shape)
+    order = np.lexsort((ids, distances), axis=1)
+    distances = np.take_along_axis(distances, order, axis=1)
+    ids = np.take_along_axis(ids, order, axis=1)
+    if k > n:
+        distances = np.concatenate([distances, np.full([n_queries, k - n], np.inf, dtype=distances.dtype)], axis=1)
+        ids = np.concatenate([ids, np.full([n_queries, k - n], -1, dtype=ids.dtype)], axis=1)
+    return distances, ids
+
+
+class ArrayStorage:
+    '''
+    Keeps arrays of an index in memory.
+    '''
+    def open(self, name):
+        '''
+        :return: existing array or ``None``.
+        '''
+        return None
+
+    def create(self, name, shape, dtype):
+        '''
+        :return: new array filled with zeros.
+        '''
+        return np.zeros(shape, dtype=dtype)
+
+    def resize(self, name, array, n_rows):
+        '''
+        Change the number of rows of an array, keeping its data.
+
+        :return: resized array.
+        '''
+        resized = np.zeros([n_rows] + list(array.shape[1:]), dtype=array.dtype)
+        resized[:len(array)] = array[:n_rows]
+        return resized
+
+    def flush(self, *arrays):
+        ''' Write changes of arrays to disk '''
+
+
+class FileStorage:
+    '''
+    Keeps arrays of an index in memory-mapped files of a directory.
+    Opening takes the same time for any number of vectors, as data is read from disk only when accessed.
+
+    One process may write to the directory, while other processes open it with ``read_only=True``.
+    Changes of existing rows are seen by readers immediately. New rows are found with
+    :meth:`nnio.utils.HumanDataBase.refresh`.
+    '''
+    META_FILE = 'meta.json'
+
+    def __init__(self, directory, read_only=False):
+        '''
+        :parameter directory: ``str``. Directory with files. It is created if needed.
+        :parameter read_only: ``bool``. Open arrays without write access.
+        '''
+        self.directory = directory
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+        self._meta = None
+        self._meta_path = os.path.join(directory, self.META_FILE)
+
+    def open(self, name):
+        if name not in self._read_meta():
+            # The array may have been created by another process
+            self._meta = None
+        meta = self._read_meta().get(name)
+        if meta is None:
+            return None
+        dtype = np.dtype(meta['dtype'])
+        row_shape = tuple(meta['row_shape'])
+        row_size = dtype.itemsize * int(np.prod(row_shape))
+        path = self._path(name)
+        return np.memmap(
+            path,
+            dtype=dtype,
+            mode='r' if self.read_only else 'r+',
+            shape=(os.path.getsize(path) // row_size,) + row_shape,
+        )
+
+    def create(self, name, shape, dtype):
+        if self.read_only:
+            raise BaseException('Cannot create {}: storage is read-only'.format(name))
+        dtype = np.dtype(dtype)
+        with open(self._path(name), 'wb') as f:
+            f.truncate(dtype.itemsize * int(np.prod(shape)))
+        meta = dict(self._read_meta())
+        meta[name] = {'dtype': dtype.str, 'row_shape': list(shape[1:])}
+        self._write_meta(meta)
+        return self.open(name)
+
+    def resize(self, name, array, n_rows):
+        array.flush()
+        with open(self._path(name), 'r+b') as f:
+            f.truncate(array.dtype.itemsize * int(np.prod(array.shape[1:])) * n_rows)
+        return self.open(name)
+
+    def flush(self, *arrays):
+        for array in arrays:
+            if isinstance(array, np.memmap) and not self.read_only:
+                array.flush()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + '.bin')
+
+    def _read_meta(self):
+        if self._meta is None:
+            if not os.path.exists(self._meta_path):
+                return {}
+            with open(self._meta_path) as f:
+                self._meta = json.load(f)
+        return self._meta
+
+    def _write_meta(self, meta):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.meta_', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self._meta_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._meta = meta
+
+
+class BruteForceIndex:
+    '''
+    Exact index. Queries are compared with all vectors using one matrix multiplication.
+    '''
+    # Number of rows allocated for the first vector. Capacity doubles when the matrix is full
+    INITIAL_CAPACITY = 64
+    # Number of rows compared at once in closest_pair()
+    BLOCK_SIZE = 1024
+
+    def __init__(self):
+        self._storage = ArrayStorage()
+        # Row i holds vector with id i. Only the first self._size rows are used
+        self._matrix = None
+        self._state = np.zeros([0], dtype=np.uint8)
+        self._size = 0
+        self._n_alive = 0
+
+    def __len__(self):
+        return self._n_alive
+
+    def ids(self):
+        '''
+        :return: ids of all vectors in increasing order.
+        '''
+        return np.flatnonzero(self._state[:self._size] == ALIVE)
+
+    def get(self, ids):
+        '''
+        :parameter ids: ``int`` or array of ids.
+        :return: vector or array of vectors.
+        '''
+        return self._matrix[ids]
+
+    def add(self, vec):
+        '''
+        :parameter vec: normalized vector.
+        :return: ``int`` id of the vector.
+        '''
+        vec_id = self._size
+        if self._matrix is None:
+            self._matrix = self._storage.create('vectors', [self.INITIAL_CAPACITY, len(vec)], np.float32)
+            self._state = self._storage.create('state', [self.INITIAL_CAPACITY], np.uint8)
+        elif vec_id == len(self._matrix):
+            self._grow()
+        self._matrix[vec_id] = vec
+        self._state[vec_id] = ALIVE
+        self._size += 1
+        self._n_alive += 1
+        return vec_id
+
+    def update(self, vec_id, vec):
+        '''
+        Replace vector, e.g. with an updated running mean.
+        '''
+        self._matrix[vec_id] = vec
+
+    def remove(self, vec_id):
+        self._state[vec_id] = REMOVED
+        self._n_alive -= 1
+
+    def attach(self, storage, size=0):
+        '''
+        Keep vectors in the storage, e.g. :class:`FileStorage`.
+        Vectors of the index are dropped.
+
+        :parameter storage: storage of arrays.
+        :parameter size: ``int``. Vectors which the storage already has with ids below ``size`` are added.
+        '''
+        self._storage = storage
+        self._matrix = None
+        self._state = np.zeros([0], dtype=np.uint8)
+        self._size = 0
+        self._n_alive = 0
+        self.extend(size)
+
+    def extend(self, size):
+        '''
+        Add vectors with ids below ``size``, which were written to the storage by another process.
+        '''
+        if size > len(self._state):
+            self._matrix = self._storage.open('vectors')
+            self._state = self._storage.open('state')
+            if self._state is None or size > len(self._state):
+                raise BaseException('Storage has less than {} vectors'.format(size))
+        self._size = size
+        self._n_alive = int(np.count_nonzero(self._state[:size] == ALIVE))
+
+    def flush(self):
+        ''' Write changes to the storage '''
+        self._storage.flush(self._matrix, self._state)
+
+    def search(self, queries, k=1):
+        '''
+        Find ``k`` closest vectors for every query.
+
+        :parameter queries: normalized vectors of shape ``[N, D]``.
+        :parameter k: ``int``.
+        :return: tuple ``(distances, ids)`` of shape ``[N, k]``, sorted by distance.
+            If the index has fewer than ``k`` vectors, the rest is padded with ``inf`` and ``-1``.
+        '''
+        distances = 1 - queries @ self._matrix[:self._size].T
+        distances[:, self._state[:self._size] != ALIVE] = np.inf
+        return _smallest(distances, np.arange(self._size), k)
+
+    def closest_pair(self):
+        '''
+        Find two closest vectors.
+
+        :return: tuple ``(distance, id1, id2)`` with ``id1 < id2``, or ``None`` if there are less than two vectors.
+        '''
+        return self._closest_pair(self.ids())
+
+    def _closest_pair(self, ids):
+        ''' Find two closest vectors among ids given in increasing order '''
+        if len(ids) < 2:
+            return None
+        vectors = self._matrix[ids]
+        best = None
+        for start in range(0, len(ids) - 1, self.BLOCK_SIZE):
+            stop = min(start + self.BLOCK_SIZE, len(ids) - 1)
+            distances = 1 - vectors[start:stop] @ vectors.T
+            # Only pairs i < j
+            distances[np.tril(np.ones(distances.shape, dtype=bool), start)] = np.inf
+            i, j = np.unravel_index(np.argmin(distances), distances.shape)
+            if best is None or distances[i, j] < best[0]:
+                best = (distances[i, j], int(ids[start + i]), int(ids[j]))
+        return best
+
+    def _grow(self):
+        self._matrix = self._storage.resize('vectors', self._matrix, 2 * len(self._matrix))
+        self._state = self._storage.resize('state', self._state, 2 * len(self._state))
+
+
+class IVFIndex(BruteForceIndex):
+    '''
+    Approximate inverted file index.
+    Vectors are split into clusters by k-means. A query is compared only with vectors
+    of ``n_probe`` clusters whose centroids are the closest to it.
+
+    Until the index has ``min_train_size`` vectors, it works as :class:`BruteForceIndex`.
+    Clusters are trained again every time the number of vectors grows ``retrain_growth`` times.
+    '''
+    # Number of vectors assigned to clusters at once
+    ASSIGN_BLOCK_SIZE = 4096
+
+    def __init__(
+        self,
+        n_lists=None,
+        n_probe=8,
+        min_train_size=1024,
+        retrain_growth=4.0,
+        n_iterations=10,
+        seed=0,
+    ):
+        '''
+        :parameter n_lists: ``int`` or ``None``. Number of clusters.
+            By default the square root of the number of vectors at training time.
+        :parameter n_probe: ``int``. Number of clusters searched for every query.
+            More clusters give higher recall and higher latency.
+        :parameter min_train_size: ``int``. Number of vectors needed to train clusters.
+        :parameter retrain_growth: ``float``.
+            Clusters are trained again when the number of vectors grows this number of times.
+        :parameter n_iterations: ``int``. Number of k-means iterations.
+        :parameter seed: ``int``. Random seed of k-means.
+        '''
+        super().__init__()
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_train_size = min_train_size
+        self.retrain_growth = retrain_growth
+        self.n_iterations = n_iterations
+        self.seed = seed
+        self._centroids = None
+        self._trained_size = 0
+        # Cluster of every id, -1 for removed vectors
+        self._assignment = np.zeros([0], dtype=np.int64)
+        # Ids in every cluster, and their arrays cached for search
+        self._lists = []
+        self._list_arrays = []
+
+    def add(self, vec):
+        vec_id = super().add(vec)
+        if self._centroids is not None:
+            self._assign(vec_id, self._nearest_centroid(vec))
+        if self._n_alive >= max(self.min_train_size, self.retrain_growth * self._trained_size):
+            self.train()
+        return vec_id
+
+    def update(self, vec_id, vec):
+        super().update(vec_id, vec)
+        if self._centroids is not None:
+            centroid = self._nearest_centroid(vec)
+            if centroid != self._assignment[vec_id]:
+                self._unassign(vec_id)
+                self._assign(vec_id, centroid)
+
+    def remove(self, vec_id):
+        super().remove(vec_id)
+        if self._centroids is not None:
+            self._unassign(vec_id)
+
+    def attach(self, storage, size=0):
+        self._centroids = None
+        self._trained_size = 0
+        super().attach(storage, size)
+
+    def extend(self, size):
+        old_size = self._size
+        super().extend(size)
+        if self._centroids is not None:
+            if len(self._assignment) < len(self._matrix):
+                padding = np.full(len(self._matrix) - len(self._assignment), -1, dtype=np.int64)
+                self._assignment = np.concatenate([self._assignment, padding])
+            for vec_id in range(old_size, size):
+                if self._state[vec_id] == ALIVE:
+                    self._assign(vec_id, self._nearest_centroid(self._matrix[vec_id]))
+        if self._n_alive >= max(self.min_train_size, self.retrain_growth * self._trained_size):
+            self.train()
+
+    def search(self, queries, k=1):
+        if self._centroids is None:
+            return super().search(queries, k)
+        n_probe = min(self.n_probe, len(self._centroids))
+        probes = np.argpartition(-(queries @ self._centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+        all_distances = []
+        all_ids = []
+        for query, query_probes in zip(queries, probes):
+            ids = np.concatenate([self._list_array(c) for c in query_probes])
+            # Vectors may have been removed by another process
+            ids = ids[self._state[ids] == ALIVE]
+            distances, ids = _smallest((1 - self._matrix[ids] @ query)[None], ids, k)
+            all_distances.append(distances)
+            all_ids.append(ids)
+        return np.concatenate(all_distances), np.concatenate(all_ids)
+
+    def closest_pair(self):
+        '''
+        Find two closest vectors. Only vectors of the same cluster are compared.
+        '''
+        if self._centroids is None:
+            return super().closest_pair()
+        best = None
+        for c in range(len(self._lists)):
+            pair = self._closest_pair(np.sort(self._list_array(c)))
+            if pair is not None and (best is None or pair < best):
+                best = pair
+        return best
+
+    def train(self):
+        '''
+        Find clusters with spherical k-means and assign all vectors to them.
+        '''
+        ids = self.ids()
+        vectors = self._matrix[ids]
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(ids))))
+        n_lists = min(n_lists, len(ids))
+        rng = np.random.RandomState(self.seed)
+        centroids = vectors[rng.choice(len(ids), n_lists, replace=False)]
+        for _ in range(self.n_iterations):
+            assignment = self._nearest_centroids(vectors, centroids)
+            # Sum vectors of every cluster
+            order = np.argsort(assignment, kind='stable')
+            clusters, starts = np.unique(assignment[order], return_index=True)
+            sums = np.add.reduceat(vectors[order], starts, axis=0)
+            centroids = centroids.copy()
+            centroids[clusters] = sums / np.linalg.norm(sums, axis=1, keepdims=True)
+        self._centroids = centroids
+        self._trained_size = len(ids)
+
+        assignment = self._nearest_centroids(vectors, centroids)
+        self._assignment = np.full(len(self._matrix), -1, dtype=np.int64)
+        self._assignment[ids] = assignment
+        self._lists = [[] for _ in range(n_lists)]
+        for vec_id, c in zip(ids.tolist(), assignment.tolist()):
+            self._lists[c].append(vec_id)
+        self._list_arrays = [None] * n_lists
+
+    def _nearest_centroid(self, vec):
+        return int(np.argmax(self._centroids @ vec))
+
+    def _nearest_centroids(self, vectors, centroids):
+        return np.concatenate([
+            np.argmax(vectors[start:start + self.ASSIGN_BLOCK_SIZE] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), self.ASSIGN_BLOCK_SIZE)
+        ])
+
+    def _assign(self, vec_id, c):
+        self._assignment[vec_id] = c
+        self._lists[c].append(vec_id)
+        self._list_arrays[c] = None
+
+    def _unassign(self, vec_id):
+        c = self._assignment[vec_id]
+        self._lists[c].remove(vec_id)
+        self._list_arrays[c] = None
+        self._assignment[vec_id] = -1
+
+    def _list_array(self, c):
+        if self._list_arrays[c] is None:
+            self._list_arrays[c] = np.array(self._lists[c], dtype=np.int64)
+        return self._list_arrays[c]
+
+    def _grow(self):
+        super()._grow()
+        if self._centroids is not None:
+            self._assignment = np.concatenate([self._assignment, np.full_like(self._assignment, -1)])
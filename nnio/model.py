@@ -1,7 +1,12 @@
 import abc
 
+from . import profiling as _profiling
+
 
 class Model(abc.ABC):
+    # Profiler of this model. ``None`` if profiling is disabled
+    _profiler = None
+
     def __init__(self):
         pass
 
@@ -32,3 +37,39 @@ class Model(abc.ABC):
         """
         :return: human-readable model output details.
         """
+
+    def enable_profiling(self, *sinks, name=None):
+        """
+        Send durations of processing stages to sinks from :mod:`nnio.profiling`.
+
+        :parameter sinks: sinks, e.g. :class:`nnio.profiling.HistogramSink`.
+            If not specified, a new ``HistogramSink`` is used.
+        :parameter name: ``str``. Name of the model in the sinks. By default the class name.
+        :return: :class:`nnio.profiling.Profiler` object.
+        """
+        if len(sinks) == 0:
+            sinks = [_profiling.HistogramSink()]
+        self._profiler = _profiling.Profiler(name or type(self).__name__, sinks)
+        return self._profiler
+
+    def disable_profiling(self):
+        """
+        Stop sending durations to sinks.
+        """
+        self._profiler = None
+
+    def _finish(self, results, spans, return_info, extra_info=None):
+        """
+        Record stage durations and return the results of ``forward``.
+
+        :parameter spans: ``dict``. Durations in nanoseconds by stage name.
+        :parameter extra_info: ``dict``. Additional values for the info.
+        """
+        if self._profiler is not None:
+            self._profiler.record(spans)
+        if return_info:
+            info = _profiling.spans_to_info(spans)
+            if extra_info:
+                info.update(extra_info)
+            return results, info
+        return results
@@ -1,4 +1,8 @@
+import os
+import platform
+import tempfile
 import time
+import warnings
 
 from . import model as _model
 from . import utils as _utils
@@ -27,50 +31,115 @@ class ONNXModel(_model.Model):
         class_scores = model(image)
 
 
+    Session options may be tuned, e.g. for a many-core CPU server::
+
+        model = nnio.ONNXModel(
+            'path/to/model.onnx',
+            intra_op_num_threads=4,
+            cache_optimized=True,
+        )
+
+    With ``cache_optimized=True``, the graph optimized by onnxruntime is saved in the cache directory
+    (see :func:`nnio.utils.set_cache_dir`), and later processes load it without optimizing again.
+
     Using this class requires onnxruntime to be installed. See :ref:`installation`.
     '''
+    # Values of graph_optimization_level and names of onnxruntime.GraphOptimizationLevel
+    OPTIMIZATION_LEVELS = {
+        'disable': 'ORT_DISABLE_ALL',
+        'basic': 'ORT_ENABLE_BASIC',
+        'extended': 'ORT_ENABLE_EXTENDED',
+        'all': 'ORT_ENABLE_ALL',
+    }
+    # Highest level of optimizations saved to the cache.
+    # Optimizations of level 'all' depend on the processor and are applied when the cached model is loaded
+    CACHED_OPTIMIZATION_LEVEL = 'extended'
+    # Numpy types of onnx tensor types
+    DTYPES = {
+        'tensor(float)': 'float32',
+        'tensor(double)': 'float64',
+        'tensor(float16)': 'float16',
+        'tensor(uint8)': 'uint8',
+        'tensor(int8)': 'int8',
+        'tensor(int32)': 'int32',
+        'tensor(int64)': 'int64',
+        'tensor(bool)': 'bool',
+    }
+    # Values of execution_mode and names of onnxruntime.ExecutionMode
+    EXECUTION_MODES = {
+        'sequential': 'ORT_SEQUENTIAL',
+        'parallel': 'ORT_PARALLEL',
+    }
+
     def __init__(
         self,
         model_path: str,
+        providers: list=None,
+        graph_optimization_level: str='all',
+        intra_op_num_threads: int=None,
+        inter_op_num_threads: int=None,
+        execution_mode: str='sequential',
+        enable_cpu_mem_arena: bool=True,
+        cache_optimized: bool=False,
     ):
         '''
 
         :parameter model_path: URL or path to the .onnx model
+        :parameter providers: list of onnxruntime execution providers in order of priority,
+            e.g. ``['CUDAExecutionProvider', 'CPUExecutionProvider']``. By default all available providers.
+        :parameter graph_optimization_level: ``'disable'``, ``'basic'``, ``'extended'`` or ``'all'``.
+        :parameter intra_op_num_threads: ``int``. Number of threads used inside operators.
+            By default the number of physical cores.
+        :parameter inter_op_num_threads: ``int``. Number of threads running operators in parallel.
+            Used only with ``execution_mode='parallel'``.
+        :parameter execution_mode: ``'sequential'`` or ``'parallel'``.
+            ``'parallel'`` helps models with many independent branches.
+        :parameter enable_cpu_mem_arena: ``bool``. Keep CPU memory allocated between calls.
+            Turn it off to save memory when input sizes change a lot.
+        :parameter cache_optimized: ``bool``. Save the optimized model to the cache directory
+            and load it on later starts. The cache key includes digest of the model, options above,
+            onnxruntime version and processor architecture.
+            Only optimizations up to ``'extended'`` are saved, because level ``'all'``
+            depends on the processor. The rest are applied on every start.
         '''
         super().__init__()
+        if graph_optimization_level not in self.OPTIMIZATION_LEVELS:
+            raise BaseException('graph_optimization_level must be one of {}'.format(list(self.OPTIMIZATION_LEVELS)))
+        if execution_mode not in self.EXECUTION_MODES:
+            raise BaseException('execution_mode must be one of {}'.format(list(self.EXECUTION_MODES)))
         # Download file from internet
         if _utils.is_url(model_path):
             model_path = _utils.file_from_url(model_path, 'models')
+        self.options = {
+            'providers': providers,
+            'graph_optimization_level': graph_optimization_level,
+            'intra_op_num_threads': intra_op_num_threads,
+            'inter_op_num_threads': inter_op_num_threads,
+            'execution_mode': execution_mode,
+            'enable_cpu_mem_arena': enable_cpu_mem_arena,
+        }
         # Load model and create inference session
-        self.sess = self._make_interpreter(model_path)
+        if cache_optimized:
+            self.sess = self._make_cached_interpreter(model_path, **self.options)
+        else:
+            self.sess = self._make_interpreter(model_path, **self.options)
+        # Resolve input and output names once
+        self._input_names = [info.name for info in self.sess.get_inputs()]
+        self._output_names = [info.name for info in self.sess.get_outputs()]
 
     def forward(self, *inputs, return_info=False):
-        assert len(inputs) == len(self.get_input_details())
-        # List output names
-        outputs = [
-            info['name']
-            for info in self.get_output_details()
-        ]
+        assert len(inputs) == len(self._input_names)
         # Convert input to a dict
-        inputs = {
-            info['name']: inp
-            for (info, inp) in zip(self.get_input_details(), inputs)
-        }
+        inputs = dict(zip(self._input_names, inputs))
         # Run network and measure time
-        start = time.time()
-        results = self.sess.run(outputs, inputs)
-        end = time.time()
+        start = time.perf_counter_ns()
+        results = self.sess.run(self._output_names, inputs)
+        end = time.perf_counter_ns()
         # Process output a little
-        if len(outputs) == 1:
+        if len(self._output_names) == 1:
             results = results[0]
         # Return results
-        if return_info:
-            info = {
-                'invoke_time': end - start,
-            }
-            return results, info
-        else:
-            return results
+        return self._finish(results, {'invoke': end - start}, return_info)
 
     def get_input_details(self):
         return [
@@ -92,9 +161,96 @@ class ONNXModel(_model.Model):
             for info in self.sess.get_outputs()
         ]
 
-    @staticmethod
-    def _make_interpreter(model_path):
+    @classmethod
+    def _make_interpreter(
+        cls,
+        model_path,
+        providers=None,
+        graph_optimization_level='all',
+        intra_op_num_threads=None,
+        inter_op_num_threads=None,
+        execution_mode='sequential',
+        enable_cpu_mem_arena=True,
+        optimized_model_path=None,
+    ):
         'Load model and create inference session'
         import onnxruntime as rt
-        sess = rt.InferenceSession(model_path)
+        options = rt.SessionOptions()
+        options.graph_optimization_level = getattr(
+            rt.GraphOptimizationLevel, cls.OPTIMIZATION_LEVELS[graph_optimization_level])
+        if intra_op_num_threads is not None:
+            options.intra_op_num_threads = intra_op_num_threads
+        if inter_op_num_threads is not None:
+            options.inter_op_num_threads = inter_op_num_threads
+        options.execution_mode = getattr(rt.ExecutionMode, cls.EXECUTION_MODES[execution_mode])
+        options.enable_cpu_mem_arena = enable_cpu_mem_arena
+        if optimized_model_path is not None:
+            options.optimized_model_filepath = optimized_model_path
+        sess = rt.InferenceSession(
+            model_path,
+            sess_options=options,
+            providers=providers or rt.get_available_providers(),
+        )
         return sess
+
+    @classmethod
+    def _make_cached_interpreter(cls, model_path, **options):
+        '''
+        Load the optimized model from the cache, or optimize the model and save it to the cache.
+        '''
+        import onnxruntime as rt
+        levels = list(cls.OPTIMIZATION_LEVELS)
+        # Level of optimizations saved to the cache
+        saved_level = levels[min(
+            levels.index(options['graph_optimization_level']),
+            levels.index(cls.CACHED_OPTIMIZATION_LEVEL),
+        )]
+        key = dict(options, graph_optimization_level=saved_level)
+        key['model_sha256'] = _utils.file_sha256(model_path)
+        key['onnxruntime'] = rt.__version__
+        key['providers'] = options['providers'] or rt.get_available_providers()
+        key['machine'] = platform.machine()
+        cached_path = _utils.cache_file_path('onnx_optimized', key, '.onnx')
+        if os.path.exists(cached_path):
+            try:
+                # Optimizations above the saved level are applied now
+                sess = cls._make_interpreter(cached_path, **options)
+                # Mark file as recently used
+                os.utime(cached_path)
+                return sess
+            except Exception as e:
+                warnings.warn('Cannot load optimized model {}: {}'.format(cached_path, e))
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cached_path), prefix=_utils.TEMP_PREFIX, suffix='.onnx')
+        os.close(fd)
+        try:
+            session_options = dict(options, graph_optimization_level=saved_level)
+            cls._make_interpreter(model_path, optimized_model_path=tmp_path, **session_options)
+            os.replace(tmp_path, cached_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        try:
+            sess = cls._make_interpreter(cached_path, **options)
+            # Check the new file once, so that later loads are fast
+            cls._check_session(sess)
+            return sess
+        except Exception as e:
+            warnings.warn('Cannot load optimized model {}: {}'.format(cached_path, e))
+            os.remove(cached_path)
+        return cls._make_interpreter(model_path, **options)
+
+    @classmethod
+    def _check_session(cls, sess):
+        '''
+        Run the session once on zeros. Dynamic dimensions are set to 1.
+        Sessions with inputs of other types are not checked.
+        '''
+        import numpy as np
+        inputs = {}
+        for info in sess.get_inputs():
+            if info.type not in cls.DTYPES:
+                return
+            shape = [dim if isinstance(dim, int) and dim > 0 else 1 for dim in info.shape]
+            inputs[info.name] = np.zeros(shape, cls.DTYPES[info.type])
+        sess.run(None, inputs)
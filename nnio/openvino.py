@@ -1,3 +1,7 @@
+import concurrent.futures
+import os
+import queue
+import tempfile
 import time
 
 from . import model as _model
@@ -8,6 +12,10 @@ class OpenVINOModel(_model.Model):
     '''
     This class works with OpenVINO models on CPU, Intel GPU and Intel Movidius Myriad.
 
+    Loading a network to a device may take seconds. With ``cache_compiled=True``,
+    the loaded network is exported to the cache directory (see :func:`nnio.utils.set_cache_dir`)
+    and imported on later starts, which is much faster.
+
     Using this class requires some libraries to be installed. See :ref:`installation`.
     '''
     def __init__(
@@ -15,6 +23,9 @@ class OpenVINOModel(_model.Model):
         model_bin: str,
         model_xml: str,
         device='CPU',
+        num_requests=1,
+        config=None,
+        cache_compiled=False,
     ):
         '''
         :parameter model_bin: URL or path to the openvino binary model file
@@ -24,6 +35,15 @@ class OpenVINOModel(_model.Model):
             ``CPU``, ``GPU``, ``MYRIAD``
             If there are multiple devices in your system, you can use indeces:
             ``MYRIAD:0`` but it is not recommended since Intel automatically chooses a free device.
+        :parameter num_requests: ``int``.
+            Number of infer requests. This is how many :meth:`forward_async` calls can run on the device at the same time.
+        :parameter config: ``dict`` or ``None``. Configuration of the device plugin,
+            e.g. ``{'CPU_THREADS_NUM': '4'}``.
+        :parameter cache_compiled: ``bool``. Export the loaded network to the cache directory
+            and import it on later starts. The cache key includes digests of the model files,
+            device, ``config`` and openvino version. If the cached network cannot be imported,
+            the model is loaded as usual and exported again.
+            Ignored for devices which do not support export.
         '''
         super().__init__()
 
@@ -34,7 +54,19 @@ class OpenVINOModel(_model.Model):
             model_xml = _utils.file_from_url(model_xml, 'models')
 
         # Create interpreter
-        self.ie, self.net, self.device = self._make_interpreter(model_xml, model_bin, device)
+        self.ie, self.net, self.device = self._make_interpreter(
+            model_xml, model_bin, device, num_requests, config, cache_compiled)
+        # Find name of the input to the model
+        self._input_name = list(self.net.input_info.keys())[0]
+        # Ids of infer requests which are not running
+        self._idle_requests = queue.Queue()
+        # Call running on every infer request: future, start time and whether it is forward_async.
+        # Blocking ``infer()`` calls the completion callback and breaks it for later ``async_infer()``,
+        # so forward also uses ``async_infer()`` and waits for the callback
+        self._calls = [None] * len(self.net.requests)
+        for request_id, request in enumerate(self.net.requests):
+            request.set_completion_callback(self._on_complete, request_id)
+            self._idle_requests.put(request_id)
 
     def forward(self, inputs, return_info=False):
         r'''
@@ -42,15 +74,24 @@ class OpenVINOModel(_model.Model):
         :parameter return_info: bool, If True, will return inference time
         :return: numpy array or list of numpy arrays.
         '''
-        # Find name of the input to the model
-        input_name = list(self.net.input_info.keys())[0]
         # Call model
-        start = time.time()
-        out = self.net.infer({input_name: inputs})
-        end = time.time()
-        # Process output a little
-        if len(out.keys()) == 1:
-            out = out[list(out.keys())[0]]
+        request_id = self._idle_requests.get()
+        try:
+            request = self.net.requests[request_id]
+            done = concurrent.futures.Future()
+            start = time.perf_counter_ns()
+            self._start(request_id, inputs, done, start, False)
+            status = done.result()
+            if status != 0:
+                raise BaseException('Inference failed with status {}'.format(status))
+            after_invoke = time.perf_counter_ns()
+            out = self._get_outputs(request)
+            spans = {
+                'invoke': after_invoke - start,
+                'output': time.perf_counter_ns() - after_invoke,
+            }
+        finally:
+            self._idle_requests.put(request_id)
         # Measure temperature
         temperature = None
         if self.device.startswith('MYRIAD.'):
@@ -58,18 +99,86 @@ class OpenVINOModel(_model.Model):
             if _utils.LOG_TEMPERATURE:
                 _utils.log_temperature(self.device, temperature)
         # Return results
-        if return_info:
-            info = {
-                'invoke_time': end - start,
-            }
-            if temperature is not None:
-                info['temperature'] = temperature
-            return out, info
-        else:
-            return out
+        extra_info = None
+        if temperature is not None:
+            extra_info = {'temperature': temperature}
+        return self._finish(out, spans, return_info, extra_info)
+
+    def forward_async(self, inputs):
+        r'''
+        Start inference and return without waiting for the result.
+        Up to ``num_requests`` inferences run on the device at the same time,
+        so the next inputs can be preprocessed while the device is busy.
+        If all infer requests are busy, waits until one of them is finished.
+
+        Usage example::
+
+            model = nnio.OpenVINOModel(model_bin, model_xml, num_requests=4)
+            futures = [model.forward_async(preproc(frame)) for frame in frames]
+            results = [future.result() for future in futures]
+
+        :parameter inputs: numpy array, input to the model
+        :return: :class:`concurrent.futures.Future`.
+            Its ``result()`` is numpy array or dict of numpy arrays, same as in :meth:`forward`.
+        '''
+        future = concurrent.futures.Future()
+        request_id = self._idle_requests.get()
+        try:
+            self._start(request_id, inputs, future, time.perf_counter_ns(), True)
+        except BaseException:
+            self._idle_requests.put(request_id)
+            raise
+        return future
+
+    def _start(self, request_id, inputs, future, start, is_async):
+        self._calls[request_id] = (future, start, is_async)
+        try:
+            self.net.requests[request_id].async_infer({self._input_name: inputs})
+        except BaseException:
+            self._calls[request_id] = None
+            raise
+
+    def _on_complete(self, status, request_id):
+        '''
+        Completion callback of infer requests.
+        Finishes the future of :meth:`forward_async` or passes the status to :meth:`forward`.
+        '''
+        future, start, is_async = self._calls[request_id]
+        self._calls[request_id] = None
+        if not is_async:
+            # forward reads outputs and returns the request itself
+            future.set_result(status)
+            return
+        try:
+            if status != 0:
+                raise BaseException('Inference failed with status {}'.format(status))
+            if self._profiler is not None:
+                self._profiler.record({'invoke': time.perf_counter_ns() - start})
+            future.set_result(self._get_outputs(self.net.requests[request_id]))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            # Only calls of forward_async return the request here
+            self._idle_requests.put(request_id)
+
+    @staticmethod
+    def _get_outputs(request):
+        '''
+        Copy outputs of the finished infer request.
+
+        :return: numpy array or dict of numpy arrays.
+        '''
+        out = {
+            name: blob.buffer.copy()
+            for name, blob in request.output_blobs.items()
+        }
+        # Process output a little
+        if len(out) == 1:
+            out = out[list(out.keys())[0]]
+        return out
 
     @staticmethod
-    def _make_interpreter(model_xml, model_bin, device):
+    def _make_interpreter(model_xml, model_bin, device, num_requests=1, config=None, cache_compiled=False):
         'Load model and create openvino interpreter'
         try:
             from openvino.inference_engine import IECore
@@ -92,8 +201,49 @@ class OpenVINOModel(_model.Model):
             if len(myriads) <= idx:
                 raise BaseException('Cannot find out which device is {}\nAvailable devices: {}'.format(device, ie.available_devices))
             device = myriads[idx]
+        config = config or {}
+        cached_path = None
+        if cache_compiled and OpenVINOModel._supports_export(ie, device):
+            key = {
+                'model_xml_sha256': _utils.file_sha256(model_xml),
+                'model_bin_sha256': _utils.file_sha256(model_bin) if os.path.exists(model_bin) else None,
+                # Names of MYRIAD devices contain the port, which may change
+                'device': device.split('.')[0],
+                'config': config,
+                'openvino': ie.get_versions(device)[device.split('.')[0]].build_number,
+            }
+            cached_path = _utils.cache_file_path('openvino_compiled', key, '.blob')
+            if os.path.exists(cached_path):
+                try:
+                    print('Importing compiled model to:', device)
+                    net = ie.import_network(cached_path, device, config, num_requests=num_requests)
+                    # Mark file as recently used
+                    os.utime(cached_path)
+                    return ie, net, device
+                except Exception as e:
+                    print('Cannot import compiled model {}: {}'.format(cached_path, e))
         # Load model on device
         net = ie.read_network(model_xml, model_bin)
         print('Loading model to:', device)
-        net = ie.load_network(net, device)
+        net = ie.load_network(net, device, config, num_requests=num_requests)
+        if cached_path is not None:
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cached_path), prefix=_utils.TEMP_PREFIX, suffix='.blob')
+                os.close(fd)
+                net.export(tmp_path)
+                os.replace(tmp_path, cached_path)
+            except Exception as e:
+                # The network is loaded already, so it is used without caching
+                print('Cannot export compiled model {}: {}'.format(cached_path, e))
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
         return ie, net, device
+
+    @staticmethod
+    def _supports_export(ie, device):
+        ''' Check if the device plugin can export and import compiled networks '''
+        try:
+            return bool(ie.get_metric(device, 'IMPORT_EXPORT_SUPPORT'))
+        except Exception:
+            return False
@@ -1,7 +1,13 @@
-import cv2
+import numpy as np
+
+from . import utils as _utils
+
+cv2 = _utils.LazyModule('cv2')
 
 
 class DetectionBox:
+    __slots__ = ['x_min', 'y_min', 'x_max', 'y_max', 'label', 'score']
+
     def __init__(
         self,
         x_min,
@@ -12,7 +18,7 @@ class DetectionBox:
         score=1.0,
     ):
         '''
-        
+
         :parameter x_min: ``float`` in range ``[0, 1]``.
             Relative x (width) coordinate of top-left corner.
         :parameter y_min: ``float`` in range ``[0, 1]``.
@@ -91,3 +97,211 @@ class DetectionBox:
             self.score
         )
         return s
+
+
+class DetectionBatch:
+    '''
+    Many detection boxes stored as numpy arrays.
+    Filtering, rescaling and IoU are computed for all boxes at once.
+
+    Indexing with ``int`` returns :class:`nnio.DetectionBox`.
+    Indexing with slice, boolean mask or index array returns a new ``DetectionBatch``.
+
+    Usage example::
+
+        batch = nnio.DetectionBatch(boxes, scores, label_ids, labels=['person', 'car'])
+        batch = batch.filter_by_score(0.5)
+        image = batch.draw(image)
+        for box in batch:
+            print(box)
+    '''
+    def __init__(
+        self,
+        boxes,
+        scores=None,
+        label_ids=None,
+        labels=None,
+    ):
+        '''
+        :parameter boxes: array of shape ``[N, 4]``.
+            Relative coordinates ``x_min, y_min, x_max, y_max`` in range ``[0, 1]``.
+        :parameter scores: array of shape ``[N]`` or ``None``. Detection scores. ``1.0`` by default.
+        :parameter label_ids: array of shape ``[N]`` or ``None``.
+            Indices in ``labels``. ``-1`` means no label.
+        :parameter labels: list of ``str`` or ``None``. Label table shared by all boxes.
+        '''
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        n = len(self.boxes)
+        if scores is None:
+            scores = np.ones(n, dtype=np.float32)
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(n)
+        if label_ids is None:
+            label_ids = np.full(n, -1, dtype=np.int32)
+        self.label_ids = np.asarray(label_ids, dtype=np.int32).reshape(n)
+        self.labels = labels
+
+    @classmethod
+    def from_boxes(cls, boxes, labels=None):
+        '''
+        Make batch from a list of :class:`nnio.DetectionBox`.
+
+        :parameter boxes: list of :class:`nnio.DetectionBox`.
+        :parameter labels: list of ``str`` or ``None``.
+            Label table. By default it is made of the labels of boxes in order of appearance.
+        '''
+        if labels is None:
+            labels = []
+            for box in boxes:
+                if box.label is not None and box.label not in labels:
+                    labels.append(box.label)
+        label_index = {label: i for i, label in enumerate(labels)}
+        return cls(
+            [[box.x_min, box.y_min, box.x_max, box.y_max] for box in boxes],
+            [box.score for box in boxes],
+            [label_index[box.label] if box.label is not None else -1 for box in boxes],
+            labels,
+        )
+
+    def to_boxes(self):
+        '''
+        :return: list of :class:`nnio.DetectionBox`.
+        '''
+        return list(self)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            x_min, y_min, x_max, y_max = self.boxes[index].tolist()
+            return DetectionBox(
+                x_min, y_min, x_max, y_max,
+                label=self._label(self.label_ids[index]),
+                score=float(self.scores[index]),
+            )
+        return DetectionBatch(
+            self.boxes[index],
+            self.scores[index],
+            self.label_ids[index],
+            self.labels,
+        )
+
+    def filter_by_score(self, threshold):
+        '''
+        :parameter threshold: ``float``. Minimal score.
+        :return: ``DetectionBatch`` with boxes which have score not less than ``threshold``.
+        '''
+        return self[self.scores >= threshold]
+
+    def rescale(self, scale_x=1.0, scale_y=1.0, offset_x=0.0, offset_y=0.0):
+        '''
+        Change coordinates as ``x * scale_x + offset_x``, ``y * scale_y + offset_y``.
+
+        :return: new ``DetectionBatch``.
+        '''
+        boxes = self.boxes * np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        boxes += np.array([offset_x, offset_y, offset_x, offset_y], dtype=np.float32)
+        return DetectionBatch(boxes, self.scores, self.label_ids, self.labels)
+
+    def to_source(self, transform, clip=True):
+        '''
+        Map boxes from the preprocessed image to the source image.
+
+        :parameter transform: :class:`nnio.preprocessing.ResizeTransform`,
+            returned by :meth:`nnio.Preprocessing.get_transform`.
+        :parameter clip: ``bool``. Clip boxes to the source image.
+        :return: new ``DetectionBatch`` with coordinates relative to the source image.
+        '''
+        boxes = transform.to_source(self.boxes, relative=True, clip=clip)
+        return DetectionBatch(boxes, self.scores, self.label_ids, self.labels)
+
+    def areas(self):
+        '''
+        :return: array of shape ``[N]`` with areas of boxes.
+        '''
+        return box_areas(self.boxes)
+
+    def iou(self, other=None):
+        '''
+        Intersection over union between boxes.
+
+        :parameter other: ``DetectionBatch`` or ``None``. If ``None``, compare with itself.
+        :return: array of shape ``[N, M]``.
+        '''
+        other_boxes = self.boxes if other is None else other.boxes
+        return box_iou(self.boxes, other_boxes)
+
+    def draw(
+        self,
+        image,
+        color=(255,0,0),
+        stroke_width=2,
+        text_color=(255,0,0),
+        text_width=2,
+    ):
+        '''
+        Draws all detection boxes on an image.
+        Parameters are the same as in :meth:`nnio.DetectionBox.draw`.
+
+        :return: Image with the boxes drawn on it.
+        '''
+        # Box corners in pixels for all boxes at once
+        size = np.array([image.shape[1], image.shape[0]] * 2, dtype=np.float32)
+        corners = (self.boxes * size).astype(np.int32).tolist()
+        for (x_min, y_min, x_max, y_max), label_id in zip(corners, self.label_ids.tolist()):
+            # pylint: disable=no-member
+            image = cv2.rectangle(
+                image,
+                (x_min, y_min),
+                (x_max, y_max),
+                color, stroke_width)
+            label = self._label(label_id)
+            if label is not None:
+                # pylint: disable=no-member
+                image = cv2.putText(
+                    image,
+                    label,
+                    (x_min, y_min + 20 + stroke_width),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    1, text_color, text_width, cv2.LINE_AA
+                )
+        return image
+
+    def _label(self, label_id):
+        if label_id < 0 or self.labels is None:
+            return None
+        return self.labels[label_id]
+
+    def __str__(self):
+        return 'nnio.DetectionBatch(n_boxes={}, labels={})'.format(len(self), self.labels)
+
+
+def box_areas(boxes):
+    '''
+    :parameter boxes: array of shape ``[..., 4]`` with ``x_min, y_min, x_max, y_max``.
+    :return: array of shape ``[...]`` with areas of boxes.
+    '''
+    return (
+        np.clip(boxes[..., 2] - boxes[..., 0], 0, None)
+        * np.clip(boxes[..., 3] - boxes[..., 1], 0, None)
+    )
+
+
+def box_iou(boxes1, boxes2):
+    '''
+    Intersection over union between every pair of boxes.
+
+    :parameter boxes1: array of shape ``[..., N, 4]`` with ``x_min, y_min, x_max, y_max``.
+    :parameter boxes2: array of shape ``[..., M, 4]``.
+    :return: array of shape ``[..., N, M]``.
+    '''
+    top_left = np.maximum(boxes1[..., :, None, :2], boxes2[..., None, :, :2])
+    bottom_right = np.minimum(boxes1[..., :, None, 2:], boxes2[..., None, :, 2:])
+    wh = np.clip(bottom_right - top_left, 0, None)
+    intersection = wh[..., 0] * wh[..., 1]
+    union = box_areas(boxes1)[..., :, None] + box_areas(boxes2)[..., None, :] - intersection
+    return intersection / np.maximum(union, np.finfo(np.float32).eps)
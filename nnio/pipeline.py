@@ -0,0 +1,256 @@
+import queue
+import threading
+import time
+
+from . import utils as _utils
+
+cv2 = _utils.LazyModule('cv2')
+
+# Drop policies
+DROP_POLICIES = [None, 'oldest', 'newest']
+
+# Marks the end of the stream
+_END = object()
+
+
+class _Failure:
+    ''' Exception raised in one of the stages '''
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class _Stage:
+    ''' Pipeline stage statistics '''
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+        self.n_items = 0
+        self.busy_time = 0.0
+
+
+class Pipeline:
+    '''
+    Runs reading of frames, preprocessing, inference and postprocessing concurrently.
+    Each stage works in its own thread and passes frames to the next stage through a bounded queue.
+    Results are yielded in the order of frames.
+
+    Usage example::
+
+        pipeline = nnio.Pipeline(
+            'path/to/video.mp4',
+            preproc=model.get_preprocessing(),
+            model=model,
+        )
+        for frame, boxes in pipeline:
+            for box in boxes:
+                box.draw(frame)
+
+        # Find out which stage is the bottleneck
+        print(pipeline.stats())
+    '''
+    def __init__(
+        self,
+        source,
+        preproc=None,
+        model=None,
+        postprocess=None,
+        queue_size=2,
+        drop_policy=None,
+    ):
+        '''
+        :parameter source: where to take frames from.
+            ``cv2.VideoCapture``, path or URL of a video, camera index or any iterable of RGB numpy images.
+            Frames from ``cv2.VideoCapture`` are converted to RGB.
+        :parameter preproc: function applied to every frame, e.g. :class:`nnio.Preprocessing`.
+        :parameter model: function applied to the preprocessed frame, e.g. :class:`nnio.Model`.
+            If ``preproc`` returns a tuple, it is passed as several inputs.
+        :parameter postprocess: function applied to the model output.
+        :parameter queue_size: ``int``. Size of the queues between stages.
+        :parameter drop_policy: what to do with a new frame when the first queue is full.
+            ``None`` - wait until there is space (no frames are lost).
+            ``'oldest'`` - drop the oldest queued frame, so that results stay fresh.
+            ``'newest'`` - drop the new frame.
+        '''
+        if drop_policy not in DROP_POLICIES:
+            raise BaseException('drop_policy must be one of {}'.format(DROP_POLICIES))
+        self.source = source
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self._stages = [
+            _Stage(name, function)
+            for name, function in [
+                ('preprocessing', preproc),
+                ('model', self._call_model(model) if model is not None else None),
+                ('postprocessing', postprocess),
+            ]
+            if function is not None
+        ]
+        self._reader = _Stage('reading', None)
+        self._n_dropped = 0
+        self._start_time = None
+        self._stop = threading.Event()
+
+    def __iter__(self):
+        return self.run()
+
+    def run(self):
+        '''
+        Start all stages.
+
+        :return: generator of tuples ``(frame, result)``.
+            ``result`` is the output of the last stage.
+        '''
+        self._stop.clear()
+        self._start_time = time.perf_counter()
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self._stages) + 1)]
+        threads = [threading.Thread(target=self._read, args=(queues[0],), daemon=True)]
+        for i, stage in enumerate(self._stages):
+            threads.append(threading.Thread(
+                target=self._run_stage,
+                args=(stage, queues[i], queues[i + 1]),
+                daemon=True,
+            ))
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.exception
+                yield item
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+    def stats(self):
+        '''
+        :return: ``dict`` with statistics for every stage:
+            ``n_items``, ``busy_time`` (seconds), ``throughput`` (items per busy second)
+            and ``utilization`` (fraction of time the stage was busy).
+            Also ``n_dropped`` - number of frames dropped according to ``drop_policy``.
+            The stage with the highest utilization is the bottleneck.
+        '''
+        elapsed = time.perf_counter() - self._start_time if self._start_time else 0.0
+        stats = {}
+        for stage in [self._reader] + self._stages:
+            stats[stage.name] = {
+                'n_items': stage.n_items,
+                'busy_time': stage.busy_time,
+                'throughput': stage.n_items / stage.busy_time if stage.busy_time > 0 else 0.0,
+                'utilization': stage.busy_time / elapsed if elapsed > 0 else 0.0,
+            }
+        stats['n_dropped'] = self._n_dropped
+        return stats
+
+    @staticmethod
+    def _call_model(model):
+        def _call(inputs):
+            if isinstance(inputs, tuple):
+                return model(*inputs)
+            return model(inputs)
+        return _call
+
+    def _frames(self):
+        ''' Generator of RGB frames from the source '''
+        if isinstance(self.source, (str, int)):
+            # pylint: disable=no-member
+            capture = cv2.VideoCapture(self.source)
+            if not capture.isOpened():
+                raise BaseException('Cannot open {}'.format(self.source))
+            try:
+                yield from self._capture_frames(capture)
+            finally:
+                capture.release()
+        elif isinstance(self.source, cv2.VideoCapture): # pylint: disable=no-member
+            yield from self._capture_frames(self.source)
+        else:
+            yield from self.source
+
+    @staticmethod
+    def _capture_frames(capture):
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            # pylint: disable=no-member
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def _read(self, out_queue):
+        frames = self._frames()
+        try:
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                try:
+                    frame = next(frames)
+                except StopIteration:
+                    break
+                self._reader.busy_time += time.perf_counter() - start
+                self._reader.n_items += 1
+                self._put_frame(out_queue, (frame, frame))
+        except BaseException as e:
+            self._put(out_queue, _Failure(e))
+            return
+        finally:
+            # Release video capture
+            frames.close()
+        self._put(out_queue, _END)
+
+    def _put_frame(self, out_queue, item):
+        ''' Put a new frame into the first queue according to the drop policy '''
+        if self.drop_policy is None:
+            self._put(out_queue, item)
+            return
+        while not self._stop.is_set():
+            try:
+                out_queue.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+            if self.drop_policy == 'newest':
+                self._n_dropped += 1
+                return
+            try:
+                out_queue.get_nowait()
+                self._n_dropped += 1
+            except queue.Empty:
+                pass
+
+    def _run_stage(self, stage, in_queue, out_queue):
+        while True:
+            item = self._get(in_queue)
+            if item is None:
+                return
+            if item is _END or isinstance(item, _Failure):
+                self._put(out_queue, item)
+                return
+            frame, data = item
+            start = time.perf_counter()
+            try:
+                data = stage.function(data)
+            except BaseException as e:
+                self._put(out_queue, _Failure(e))
+                return
+            stage.busy_time += time.perf_counter() - start
+            stage.n_items += 1
+            self._put(out_queue, (frame, data))
+
+    def _get(self, in_queue):
+        ''' Get item from the queue. Returns ``None`` if the pipeline is stopped. '''
+        while not self._stop.is_set():
+            try:
+                return in_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _put(self, out_queue, item):
+        ''' Put item into the queue unless the pipeline is stopped. '''
+        while not self._stop.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
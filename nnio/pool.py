@@ -0,0 +1,189 @@
+import collections
+import concurrent.futures
+import queue
+import threading
+import time
+
+from . import model as _model
+
+
+class _Replica:
+    '''
+    One model instance with its own worker thread.
+    '''
+    def __init__(self, model, device):
+        self.model = model
+        self.device = device
+        self.tasks = queue.Queue()
+        self.pending = 0
+        self.n_calls = 0
+        self.busy_time = 0.0
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            future, inputs, kwargs, on_done = task
+            if future.set_running_or_notify_cancel():
+                start = time.perf_counter()
+                try:
+                    result = self.model(*inputs, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+                self.busy_time += time.perf_counter() - start
+                self.n_calls += 1
+            on_done(self)
+
+
+class ModelPool(_model.Model):
+    '''
+    Runs several copies of one model, each on its own device, and spreads calls between them.
+    Every call goes to the copy with the fewest unfinished calls.
+
+    Usage example::
+
+        pool = nnio.ModelPool(
+            lambda device: nnio.EdgeTPUModel('path/to/model_quant_edgetpu.tflite', device=device),
+            devices=['TPU:0', 'TPU:1', 'TPU:2'],
+        )
+
+        # Process a stream of images. Results come in the same order
+        for class_scores in pool.map(preproc(frame) for frame in frames):
+            ...
+
+        print(pool.utilization())
+        pool.close()
+    '''
+    def __init__(
+        self,
+        model_factory,
+        devices=None,
+        n_replicas=None,
+    ):
+        '''
+        :parameter model_factory: function which takes a device name and returns :class:`nnio.Model`.
+        :parameter devices: list of ``str``.
+            Devices to put models on, e.g. ``['TPU:0', 'TPU:1']``.
+            The same device may be listed several times.
+        :parameter n_replicas: ``int``.
+            If ``devices`` is not specified, create this number of models on ``CPU``.
+        '''
+        super().__init__()
+        if devices is None:
+            if n_replicas is None:
+                raise BaseException('Either devices or n_replicas must be specified')
+            devices = ['CPU'] * n_replicas
+        if len(devices) == 0:
+            raise BaseException('ModelPool needs at least one device')
+        self._lock = threading.Lock()
+        self._closed = False
+        self._start_time = time.perf_counter()
+        self._replicas = [
+            _Replica(model_factory(device), device)
+            for device in devices
+        ]
+
+    def forward(self, *inputs, **kwargs):
+        r'''
+        Run the model on the least busy device and wait for the result.
+
+        :parameter \*inputs: numpy arrays, Inputs to the model
+        :parameter kwargs: passed to ``forward`` of the model, e.g. ``return_info``.
+        :return: output of the model.
+        '''
+        return self.forward_async(*inputs, **kwargs).result()
+
+    def forward_async(self, *inputs, **kwargs):
+        r'''
+        Send the inputs to the least busy device and return without waiting.
+
+        :parameter \*inputs: numpy arrays, Inputs to the model
+        :parameter kwargs: passed to ``forward`` of the model, e.g. ``return_info``.
+        :return: :class:`concurrent.futures.Future` with output of the model.
+        '''
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Cannot run new calls after close')
+            replica = min(self._replicas, key=lambda r: r.pending)
+            replica.pending += 1
+            # Put under the lock, so that close() comes after it
+            replica.tasks.put((future, inputs, kwargs, self._on_done))
+        return future
+
+    def map(self, inputs, max_in_flight=None):
+        '''
+        Run the model on a stream of inputs using all devices.
+        Results are yielded in the order of inputs.
+
+        :parameter inputs: iterable of numpy arrays or of tuples of numpy arrays (for models with several inputs).
+        :parameter max_in_flight: ``int``.
+            Maximum number of inputs sent to devices and not yet yielded.
+            By default twice the number of devices.
+        :return: generator of model outputs.
+        '''
+        max_in_flight = max_in_flight or 2 * len(self._replicas)
+        in_flight = collections.deque()
+        for inp in inputs:
+            if not isinstance(inp, tuple):
+                inp = (inp,)
+            in_flight.append(self.forward_async(*inp))
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+    def utilization(self):
+        '''
+        :return: list of ``dict`` with statistics for every device:
+            ``device``, ``n_calls``, ``pending`` (calls in queue or running),
+            ``busy_time`` (seconds spent in the model)
+            and ``utilization`` (fraction of time spent in the model since the pool was created).
+        '''
+        elapsed = time.perf_counter() - self._start_time
+        return [
+            {
+                'device': replica.device,
+                'n_calls': replica.n_calls,
+                'pending': replica.pending,
+                'busy_time': replica.busy_time,
+                'utilization': replica.busy_time / elapsed,
+            }
+            for replica in self._replicas
+        ]
+
+    def close(self):
+        '''
+        Stop worker threads after they finish queued calls.
+        New calls raise ``RuntimeError``.
+        '''
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                for replica in self._replicas:
+                    replica.tasks.put(None)
+        for replica in self._replicas:
+            replica.thread.join()
+
+    def get_preprocessing(self):
+        return self._replicas[0].model.get_preprocessing()
+
+    def get_input_details(self):
+        return self._replicas[0].model.get_input_details()
+
+    def get_output_details(self):
+        return self._replicas[0].model.get_output_details()
+
+    @property
+    def models(self):
+        ''' list of models in the pool '''
+        return [replica.model for replica in self._replicas]
+
+    def _on_done(self, replica):
+        with self._lock:
+            replica.pending -= 1
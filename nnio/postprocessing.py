@@ -0,0 +1,324 @@
+'''
+Postprocessing of detection models.
+
+Functions work on whole numpy tensors with the batch dimension ``[B, N, ...]``,
+so no Python loop goes over individual boxes.
+Boxes are in relative ``x_min, y_min, x_max, y_max`` format unless specified otherwise.
+
+Example for an SSD model::
+
+    priors = nnio.postprocessing.ssd_priors([(19, 19), (10, 10), (5, 5)], [0.2, 0.4, 0.6, 0.8])
+    loc, conf = model(preproc(image))
+    boxes = nnio.postprocessing.decode_ssd(loc, priors)
+    detections = nnio.postprocessing.multiclass_nms(
+        boxes, conf[..., 1:],
+        score_threshold=0.5,
+        iou_threshold=0.45,
+        labels=labels,
+    )
+    image = detections[0].draw(image)
+'''
+import numpy as np
+
+from .output import DetectionBatch, box_areas
+
+
+def sigmoid(x):
+    ''' Logistic function '''
+    with np.errstate(over='ignore'):
+        return 1 / (1 + np.exp(-x))
+
+
+def top_k(scores, k, axis=-1):
+    '''
+    Select ``k`` largest scores along the axis without sorting the whole array.
+
+    :parameter scores: numpy array, e.g. of shape ``[B, N]``.
+    :parameter k: ``int``. Number of scores to select.
+        If it is larger than the size of the axis, all scores are selected.
+    :parameter axis: ``int``. Axis to select along.
+    :return: tuple ``(values, indices)``. Both are sorted by score in descending order.
+    '''
+    n = scores.shape[axis]
+    if k >= n:
+        indices = np.argsort(-scores, axis=axis, kind='stable')
+        return np.take_along_axis(scores, indices, axis=axis), indices
+    indices = np.argpartition(-scores, k - 1, axis=axis)
+    indices = np.take(indices, np.arange(k), axis=axis)
+    values = np.take_along_axis(scores, indices, axis=axis)
+    order = np.argsort(-values, axis=axis, kind='stable')
+    return (
+        np.take_along_axis(values, order, axis=axis),
+        np.take_along_axis(indices, order, axis=axis),
+    )
+
+
+def nms(boxes, scores, iou_threshold=0.5, max_outputs=None):
+    '''
+    Greedy non-maximum suppression.
+    Each kept box is compared with all remaining boxes at once.
+
+    :parameter boxes: numpy array of shape ``[N, 4]``.
+    :parameter scores: numpy array of shape ``[N]``.
+    :parameter iou_threshold: ``float``. Boxes which overlap a kept box more than this are removed.
+    :parameter max_outputs: ``int`` or ``None``. Maximum number of boxes to keep.
+    :return: indices of kept boxes, sorted by score in descending order.
+    '''
+    boxes = np.asarray(boxes, dtype=np.float32)
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    areas = box_areas(boxes)
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        if max_outputs is not None and len(keep) >= max_outputs:
+            break
+        rest = order[1:]
+        top_left = np.maximum(boxes[i, :2], boxes[rest, :2])
+        bottom_right = np.minimum(boxes[i, 2:], boxes[rest, 2:])
+        wh = np.clip(bottom_right - top_left, 0, None)
+        intersection = wh[:, 0] * wh[:, 1]
+        iou = intersection / np.maximum(areas[i] + areas[rest] - intersection, np.finfo(np.float32).eps)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def batched_nms(boxes, scores, class_ids, iou_threshold=0.5, max_outputs=None):
+    '''
+    Non-maximum suppression which compares only boxes of the same class.
+    All classes are processed in one pass: boxes of different classes are shifted apart so that they never overlap.
+
+    :parameter boxes: numpy array of shape ``[N, 4]``.
+    :parameter scores: numpy array of shape ``[N]``.
+    :parameter class_ids: integer numpy array of shape ``[N]``.
+    :parameter iou_threshold: ``float``.
+    :parameter max_outputs: ``int`` or ``None``. Maximum number of boxes to keep in total.
+    :return: indices of kept boxes, sorted by score in descending order.
+    '''
+    boxes = np.asarray(boxes, dtype=np.float32)
+    if len(boxes) == 0:
+        return np.zeros([0], dtype=np.int64)
+    shift = float(boxes.max() - boxes.min()) + 1
+    offsets = (np.asarray(class_ids, dtype=np.float32) * shift)[:, None]
+    return nms(boxes + offsets, scores, iou_threshold, max_outputs)
+
+
+def soft_nms(boxes, scores, iou_threshold=0.3, sigma=0.5, score_threshold=0.001, method='gaussian'):
+    '''
+    Soft non-maximum suppression (Bodla et al., 2017).
+    Instead of removing overlapping boxes, their scores are decreased.
+
+    :parameter boxes: numpy array of shape ``[N, 4]``.
+    :parameter scores: numpy array of shape ``[N]``.
+    :parameter iou_threshold: ``float``. Used by the ``'linear'`` method.
+    :parameter sigma: ``float``. Used by the ``'gaussian'`` method.
+    :parameter score_threshold: ``float``. Boxes with lower scores are removed.
+    :parameter method: ``'gaussian'``, ``'linear'`` or ``'hard'`` (usual NMS).
+    :return: tuple ``(indices, scores)`` of kept boxes with their new scores,
+        sorted by the new score in descending order.
+    '''
+    if method not in ['gaussian', 'linear', 'hard']:
+        raise BaseException('Unknown soft NMS method: {}'.format(method))
+    boxes = np.asarray(boxes, dtype=np.float32)
+    scores = np.array(scores, dtype=np.float32)
+    remaining = np.flatnonzero(scores >= score_threshold)
+    areas = box_areas(boxes)
+    keep = []
+    keep_scores = []
+    while remaining.size > 0:
+        best = np.argmax(scores[remaining])
+        i = remaining[best]
+        keep.append(i)
+        keep_scores.append(scores[i])
+        rest = np.delete(remaining, best)
+        top_left = np.maximum(boxes[i, :2], boxes[rest, :2])
+        bottom_right = np.minimum(boxes[i, 2:], boxes[rest, 2:])
+        wh = np.clip(bottom_right - top_left, 0, None)
+        intersection = wh[:, 0] * wh[:, 1]
+        iou = intersection / np.maximum(areas[i] + areas[rest] - intersection, np.finfo(np.float32).eps)
+        if method == 'gaussian':
+            scores[rest] *= np.exp(-iou * iou / sigma)
+        elif method == 'linear':
+            scores[rest] *= np.where(iou > iou_threshold, 1 - iou, 1)
+        else:
+            scores[rest] *= iou <= iou_threshold
+        remaining = rest[scores[rest] >= score_threshold]
+    return np.array(keep, dtype=np.int64), np.array(keep_scores, dtype=np.float32)
+
+
+def multiclass_nms(
+    boxes,
+    scores,
+    score_threshold=0.5,
+    iou_threshold=0.5,
+    max_detections=100,
+    pre_nms_top_k=1000,
+    class_agnostic=False,
+    labels=None,
+):
+    '''
+    Select detections for every image of a batch.
+
+    :parameter boxes: numpy array of shape ``[B, N, 4]`` or ``[N, 4]``.
+    :parameter scores: numpy array of shape ``[B, N, C]`` or ``[N, C]``. Scores of ``C`` classes for every box.
+    :parameter score_threshold: ``float``. Candidates with lower scores are dropped before NMS.
+    :parameter iou_threshold: ``float``.
+    :parameter max_detections: ``int``. Maximum number of detections per image.
+    :parameter pre_nms_top_k: ``int`` or ``None``. Only this number of best candidates go to NMS.
+    :parameter class_agnostic: ``bool``. If ``True``, boxes of different classes suppress each other.
+    :parameter labels: list of ``str`` or ``None``. Names of the classes.
+    :return: list of :class:`nnio.DetectionBatch`, one for every image.
+        If inputs have no batch dimension, a single :class:`nnio.DetectionBatch`.
+    '''
+    boxes = np.asarray(boxes)
+    scores = np.asarray(scores)
+    if boxes.ndim == 2:
+        return multiclass_nms(
+            boxes[None], scores[None], score_threshold, iou_threshold,
+            max_detections, pre_nms_top_k, class_agnostic, labels)[0]
+    results = []
+    for image_boxes, image_scores in zip(boxes, scores):
+        # Candidates are pairs (box, class) with high enough score
+        box_ids, class_ids = np.nonzero(image_scores >= score_threshold)
+        candidate_scores = image_scores[box_ids, class_ids]
+        if pre_nms_top_k is not None and len(candidate_scores) > pre_nms_top_k:
+            _, best = top_k(candidate_scores, pre_nms_top_k)
+            box_ids, class_ids, candidate_scores = box_ids[best], class_ids[best], candidate_scores[best]
+        candidate_boxes = image_boxes[box_ids]
+        if class_agnostic:
+            keep = nms(candidate_boxes, candidate_scores, iou_threshold, max_detections)
+        else:
+            keep = batched_nms(candidate_boxes, candidate_scores, class_ids, iou_threshold, max_detections)
+        results.append(DetectionBatch(
+            candidate_boxes[keep],
+            candidate_scores[keep],
+            class_ids[keep],
+            labels,
+        ))
+    return results
+
+
+def ssd_priors(feature_map_sizes, scales, aspect_ratios=(1.0, 2.0, 0.5), extra_prior=True, clip=True):
+    '''
+    Make prior (anchor) boxes of an SSD model.
+
+    :parameter feature_map_sizes: list of ``(height, width)`` or ``int`` for every feature map.
+    :parameter scales: list of relative prior sizes. One for every feature map and one more
+        which is used for the extra prior of the last feature map.
+    :parameter aspect_ratios: list of width / height ratios of priors.
+    :parameter extra_prior: ``bool``. Add a square prior of size ``sqrt(scale[k] * scale[k+1])`` to every cell.
+    :parameter clip: ``bool``. Clip prior sizes to ``[0, 1]``.
+    :return: numpy array of shape ``[N, 4]`` with ``center_x, center_y, width, height`` of priors.
+        Priors go by feature map, then by cell in row-major order, then by aspect ratio.
+    '''
+    if len(scales) != len(feature_map_sizes) + 1:
+        raise BaseException('scales must have one element more than feature_map_sizes')
+    ratios = np.sqrt(np.asarray(aspect_ratios, dtype=np.float32))
+    priors = []
+    for k, size in enumerate(feature_map_sizes):
+        height, width = (size, size) if isinstance(size, int) else size
+        # Sizes of priors in one cell
+        sizes = [np.stack([scales[k] * ratios, scales[k] / ratios], axis=1)]
+        if extra_prior:
+            extra = np.sqrt(scales[k] * scales[k + 1])
+            sizes.append(np.array([[extra, extra]], dtype=np.float32))
+        sizes = np.concatenate(sizes)
+        # Centers of cells
+        cy, cx = np.meshgrid(
+            (np.arange(height, dtype=np.float32) + 0.5) / height,
+            (np.arange(width, dtype=np.float32) + 0.5) / width,
+            indexing='ij',
+        )
+        centers = np.stack([cx, cy], axis=-1).reshape(-1, 1, 2)
+        layer = np.concatenate(np.broadcast_arrays(centers, sizes[None]), axis=-1)
+        priors.append(layer.reshape(-1, 4))
+    priors = np.concatenate(priors).astype(np.float32)
+    if clip:
+        np.clip(priors, 0, 1, out=priors)
+    return priors
+
+
+def decode_ssd(loc, priors, variances=(0.1, 0.2), loc_order='xywh'):
+    '''
+    Decode box offsets predicted by an SSD model.
+
+    :parameter loc: numpy array of shape ``[..., N, 4]``. Predicted offsets from priors.
+    :parameter priors: numpy array of shape ``[N, 4]`` with ``center_x, center_y, width, height``,
+        e.g. from :func:`ssd_priors`.
+    :parameter variances: ``(center variance, size variance)``.
+        Models from Tensorflow Object Detection API use ``(0.1, 0.2)`` too (scale factors ``10, 5``).
+    :parameter loc_order: ``'xywh'`` (Caffe, PyTorch models) or ``'yxhw'`` (Tensorflow models).
+    :return: numpy array of shape ``[..., N, 4]`` with boxes.
+    '''
+    if loc_order not in ['xywh', 'yxhw']:
+        raise BaseException('loc_order must be "xywh" or "yxhw"')
+    loc = np.asarray(loc, dtype=np.float32)
+    if loc_order == 'yxhw':
+        loc = loc[..., [1, 0, 3, 2]]
+    priors = np.asarray(priors, dtype=np.float32)
+    centers = priors[:, :2] + loc[..., :2] * variances[0] * priors[:, 2:]
+    half_sizes = 0.5 * priors[:, 2:] * np.exp(loc[..., 2:] * variances[1])
+    return np.concatenate([centers - half_sizes, centers + half_sizes], axis=-1)
+
+
+def decode_yolo(output, anchors, input_size, channels_first=False, apply_sigmoid=True, version=3):
+    '''
+    Decode one output of a YOLOv3 or YOLOv5 style model.
+    For models with several outputs, decode each of them and concatenate results along axis 1.
+
+    :parameter output: numpy array of shape ``[B, H, W, A * (5 + C)]``
+        (or ``[B, A * (5 + C), H, W]`` if ``channels_first``),
+        where ``A`` is the number of anchors and ``C`` is the number of classes.
+        Values for every anchor are ``x, y, w, h, objectness, class scores``.
+    :parameter anchors: array of shape ``[A, 2]``. Widths and heights of anchors in pixels of the input image.
+    :parameter input_size: ``(width, height)`` of the input image.
+    :parameter channels_first: ``bool``.
+    :parameter apply_sigmoid: ``bool``. Apply sigmoid to ``x, y``, objectness and class scores
+        (and to ``w, h`` if ``version=5``).
+        Set to ``False`` if the model does it itself.
+    :parameter version: ``3`` or ``5``. Formula of box decoding.
+        YOLOv3: ``center = sigmoid(xy) + grid``, ``size = exp(wh) * anchor``.
+        YOLOv5: ``center = 2 * sigmoid(xy) - 0.5 + grid``, ``size = (2 * sigmoid(wh))^2 * anchor``.
+    :return: tuple ``(boxes, scores)`` of shapes ``[B, H * W * A, 4]`` and ``[B, H * W * A, C]``.
+        Scores are objectness multiplied by class scores.
+    '''
+    if version not in [3, 5]:
+        raise BaseException('Unknown YOLO version: {}'.format(version))
+    output = np.asarray(output, dtype=np.float32)
+    if channels_first:
+        output = output.transpose(0, 2, 3, 1)
+    anchors = np.asarray(anchors, dtype=np.float32)
+    batch_size, height, width, channels = output.shape
+    n_anchors = len(anchors)
+    output = output.reshape(batch_size, height, width, n_anchors, channels // n_anchors)
+    if apply_sigmoid:
+        xy = sigmoid(output[..., 0:2])
+        wh = sigmoid(output[..., 2:4]) if version == 5 else output[..., 2:4]
+        objectness = sigmoid(output[..., 4:5])
+        class_scores = sigmoid(output[..., 5:])
+    else:
+        xy = output[..., 0:2]
+        wh = output[..., 2:4]
+        objectness = output[..., 4:5]
+        class_scores = output[..., 5:]
+    # Offsets of grid cells
+    grid_y, grid_x = np.meshgrid(
+        np.arange(height, dtype=np.float32),
+        np.arange(width, dtype=np.float32),
+        indexing='ij',
+    )
+    grid = np.stack([grid_x, grid_y], axis=-1)[:, :, None, :]
+    if version == 5:
+        xy = 2 * xy - 0.5
+        sizes = np.square(2 * wh)
+    else:
+        with np.errstate(over='ignore'):
+            sizes = np.exp(wh)
+    centers = (xy + grid) / np.array([width, height], dtype=np.float32)
+    half_sizes = 0.5 * sizes * anchors / np.asarray(input_size, dtype=np.float32)
+    boxes = np.concatenate([centers - half_sizes, centers + half_sizes], axis=-1)
+    scores = objectness * class_scores
+    return (
+        boxes.reshape(batch_size, -1, 4),
+        scores.reshape(batch_size, -1, scores.shape[-1]),
+    )
@@ -1,10 +1,13 @@
-import cv2
+import concurrent.futures
 import numpy as np
-import os
+import threading
+import time
 
 from . import model as _model
 from . import utils as _utils
 
+cv2 = _utils.LazyModule('cv2')
+
 class Preprocessing(_model.Model):
     '''
     This class provides functionality of the image preprocessing.
@@ -46,6 +49,7 @@ class Preprocessing(_model.Model):
         channels_first=False,
         batch_dimension=False,
         bgr=False,
+        reduced_decode=False,
     ):
         '''
         :parameter resize: ``None`` or ``tuple``.
@@ -74,6 +78,9 @@ class Preprocessing(_model.Model):
         :parameter bgr: ``bool``.
             If ``True``, change channels to BRG order.
             If ``False``, keep the RGB order.
+        :parameter reduced_decode: ``bool``.
+            If ``True``, jpeg images read from files or urls, which are at least twice as large as ``resize``,
+            are decoded at reduced resolution. This is much faster, but the result differs slightly.
         '''
         self.resize = resize
         self.dtype = dtype or 'uint8'
@@ -94,6 +101,7 @@ class Preprocessing(_model.Model):
         self.channels_first = channels_first
         self.batch_dimension = batch_dimension
         self.bgr = bgr
+        self.reduced_decode = reduced_decode
 
         if imagenet_scaling:
             if (
@@ -126,7 +134,51 @@ class Preprocessing(_model.Model):
             if self._means is not None:
                 self._means = self._means * 255
 
-    def forward(self, image, return_original=False):
+        # Letterbox canvases of every thread
+        self._canvases = threading.local()
+        # Thread pools of forward_batch by number of threads. Created on first use
+        self._executors = {}
+        self._executors_lock = threading.Lock()
+
+        # Compile the fused pipeline
+        self._compile()
+
+    def _compile(self):
+        '''
+        Prepare lookup tables for the fused preprocessing pipeline.
+
+        Normalization is only ever applied to ``uint8`` images,
+        so shifting, scaling, grayscale averaging and type conversion
+        can be precomputed for each of the 256 possible channel values.
+        The BGR flip is folded in by choosing which source channel feeds each table.
+        '''
+        self._fused = False
+        self._luts = None
+        self._luts_hwc = None
+        dtype = np.dtype(self.dtype)
+        # Source channel for every output channel
+        self._src_channels = [2, 1, 0] if self.bgr else [0, 1, 2]
+        normalized = self._means is not None or self._scales is not None
+        if dtype in (np.float32, np.float64):
+            # Per-channel tables: value -> (value - mean) * scale
+            values = np.arange(256, dtype=np.float64)[:, None].repeat(3, axis=1)
+            if self._means is not None:
+                values = values - np.broadcast_to(self._means, (1, 1, 3))[0]
+            if self._scales is not None:
+                values = values * np.broadcast_to(self._scales, (1, 1, 3))[0]
+            if self.to_gray is not None:
+                # Grayscale is the mean of normalized channels
+                values = values / 3
+            # Shape [3, 256]. Row c is applied to source channel self._src_channels[c]
+            self._luts = np.ascontiguousarray(values.T.astype(dtype))
+            # Shape [1, 256, 3] for three-channel lookup
+            self._luts_hwc = np.ascontiguousarray(self._luts.T[None])
+            self._fused = True
+        elif not normalized and self.to_gray is None:
+            # Integer output without normalization: resize and flip only
+            self._fused = True
+
+    def forward(self, image, return_original=False, out=None, return_transform=False):
         '''
         Preprocess the image.
 
@@ -135,15 +187,254 @@ class Preprocessing(_model.Model):
             If ``str``, it will be concerned as image path.
         :parameter return_original: ``bool``.
             If ``True``, will return tuple of ``(preprocessed_image, original_image)``
+        :parameter out: ``None`` or np.ndarray.
+            If specified, the result will be written into this array and it will be returned.
+            It must be C-contiguous and its shape and dtype must match the output of the preprocessing.
+        :parameter return_transform: ``bool``.
+            If ``True``, will also return :class:`nnio.preprocessing.ResizeTransform`
+            which maps coordinates on the preprocessed image back to the original image.
+            It is the last element of the returned tuple.
         '''
         # Read image
-        if isinstance(image, str):
-            image = self._read_image(image)
+        start = time.perf_counter_ns()
+        source = image
+        image = self._load_image(image)
+        loaded = time.perf_counter_ns()
         if return_original:
             orig_image = image.copy()
+
+        if out is None and not self._is_fused(image):
+            # Nothing to write into, return the step-by-step result as it is
+            result = self._forward_reference(image)
+        else:
+            if out is None:
+                out = np.empty(self._output_shape(*self._target_size(image)), dtype=self.dtype)
+            else:
+                self._check_out(out, self._output_shape(*self._target_size(image)))
+            self._forward_into(image, out[0] if self.batch_dimension else out)
+            result = out
+
+        if self._profiler is not None:
+            self._record_spans(source, start, loaded)
+
+        outputs = [result]
+        if return_original:
+            outputs.append(orig_image)
+        if return_transform:
+            outputs.append(self.get_transform((image.shape[1], image.shape[0])))
+        if len(outputs) == 1:
+            return result
+        return tuple(outputs)
+
+    def forward_batch(self, images, out=None, n_threads=None, executor=None):
+        '''
+        Preprocess a batch of images in parallel.
+
+        Images are read, resized and normalized on a thread pool
+        and written directly into slices of one output array.
+        Parameter ``batch_dimension`` is ignored: the output always has the batch dimension.
+
+        Example::
+
+            batch = preproc.forward_batch(['path/to/image1.png', image_rgb])
+            results = model(batch)
+
+        :parameter images: list of np.ndarray of type ``uint8`` or ``str``.
+            RGB images or paths to them.
+            If ``resize`` is not specified, all images must have the same size.
+        :parameter out: ``None`` or np.ndarray.
+            If specified, the results will be written into this array and it will be returned.
+        :parameter n_threads: ``int`` or ``None``.
+            Number of threads. By default chosen by :class:`concurrent.futures.ThreadPoolExecutor`.
+            Thread pools are kept between calls, so that threads and their letterbox canvases are reused.
+        :parameter executor: ``None`` or :class:`concurrent.futures.Executor`.
+            If specified, it is used instead of the thread pool of this object and ``n_threads`` is ignored.
+        :return: np.ndarray of shape ``[B, ...]``.
+        '''
+        images = list(images)
+        if len(images) == 0:
+            raise BaseException('Cannot preprocess an empty batch')
+        # Find out output size
+        if self.resize is None:
+            images[0] = self._load_image(images[0])
+        shape = self._output_shape(*self._target_size(images[0]), batch_size=len(images))
+        if out is None:
+            out = np.empty(shape, dtype=self.dtype)
+        else:
+            self._check_out(out, shape)
+
+        def _process(i):
+            start = time.perf_counter_ns()
+            image = self._load_image(images[i])
+            loaded = time.perf_counter_ns()
+            self._forward_into(image, out[i])
+            if self._profiler is not None:
+                self._record_spans(images[i], start, loaded)
+
+        if executor is None:
+            executor = self._get_executor(n_threads)
+        # Iterate over results to raise exceptions
+        for _ in executor.map(_process, range(len(images))):
+            pass
+        return out
+
+    def close(self):
+        '''
+        Stop threads started by :meth:`forward_batch`. They are started again if needed.
+        '''
+        with self._executors_lock:
+            executors = list(self._executors.values())
+            self._executors.clear()
+        for executor in executors:
+            executor.shutdown()
+
+    def _get_executor(self, n_threads):
+        with self._executors_lock:
+            if n_threads not in self._executors:
+                self._executors[n_threads] = concurrent.futures.ThreadPoolExecutor(
+                    n_threads, thread_name_prefix='nnio-preprocessing')
+            return self._executors[n_threads]
+
+    def _record_spans(self, source, start, loaded):
+        '''
+        Send durations of reading and preprocessing to the profiler.
+        '''
+        spans = {}
+        if isinstance(source, str):
+            stage = 'download' if _utils.is_url(source) else 'read'
+            spans[stage] = loaded - start
+        spans['preprocessing'] = time.perf_counter_ns() - loaded
+        self._profiler.record(spans)
+
+    def _load_image(self, image):
+        '''
+        Read image if it is a path and check its type.
+        '''
+        if isinstance(image, str):
+            image = self._read_image(image)
         if str(image.dtype) != 'uint8':
             raise BaseException('Input image data type for preprocessor must be uint8')
+        return image
 
+    def _is_fused(self, image):
+        '''
+        :return: ``True`` if image can go through the fused pipeline
+        '''
+        return self._fused and image.ndim == 3 and image.shape[2] == 3
+
+    def _target_size(self, image):
+        '''
+        :return: ``(height, width)`` of the preprocessed image
+        '''
+        if self.resize is not None:
+            return self.resize[1], self.resize[0]
+        return image.shape[0], image.shape[1]
+
+    def _output_shape(self, height, width, batch_size=None):
+        '''
+        :parameter batch_size: ``int`` or ``None``.
+            If ``None``, batch dimension is added according to ``batch_dimension`` parameter.
+        :return: shape of the preprocessed image of size ``(height, width)``
+        '''
+        if self.to_gray is None:
+            channels = 3
+        elif self.to_gray > 0:
+            channels = self.to_gray
+        else:
+            channels = None
+        if channels is None:
+            shape = [height, width]
+        elif self.channels_first:
+            shape = [channels, height, width]
+        else:
+            shape = [height, width, channels]
+        if batch_size is not None:
+            shape = [batch_size] + shape
+        elif self.batch_dimension:
+            shape = [1] + shape
+        return tuple(shape)
+
+    def _check_out(self, out, shape):
+        '''
+        Check that output array is suitable for the result of the given shape.
+        '''
+        if tuple(out.shape) != shape or out.dtype != np.dtype(self.dtype):
+            raise BaseException(
+                'Output array must have shape {} and dtype {}, got {} and {}'.format(
+                    shape, self.dtype, tuple(out.shape), out.dtype))
+        if not out.flags.c_contiguous:
+            raise BaseException('Output array must be C-contiguous')
+
+    def _forward_into(self, image, out):
+        '''
+        Preprocess image and write it into ``out``. ``out`` has no batch dimension.
+        '''
+        if self._is_fused(image):
+            self._forward_fused(image, out)
+        else:
+            result = self._forward_reference(image)
+            out[...] = result[0] if self.batch_dimension else result
+
+    def _forward_fused(self, image, out):
+        '''
+        Single-pass preprocessing of an RGB ``uint8`` image.
+
+        Image is resized in ``uint8`` and then written to the output buffer
+        through lookup tables, which apply normalization and type conversion at once.
+
+        :parameter out: np.ndarray without batch dimension.
+        '''
+        # Resize image. Channel order does not matter for resizing
+        if self.resize is not None:
+            image = self._resize_image(image, self.resize, self.padding)
+
+        # pylint: disable=no-member
+        if self._luts is None:
+            # Integer output. Only copy with channels reordered
+            if self.channels_first:
+                out[:] = image.transpose([2, 0, 1])[self._src_channels]
+            elif self.bgr and out.dtype == np.uint8:
+                cv2.cvtColor(image, cv2.COLOR_RGB2BGR, dst=out)
+            elif self.bgr:
+                # OpenCV writes to ``dst`` only if it has the type of the result
+                out[:] = image[:, :, ::-1]
+            else:
+                out[:] = image
+        elif self.to_gray is not None:
+            # Sum of per-channel tables gives mean of normalized channels
+            planes = cv2.split(image)
+            if self.to_gray > 0:
+                gray = out[0] if self.channels_first else out[:, :, 0]
+            else:
+                gray = out
+            src = self._src_channels
+            if self.channels_first or self.to_gray <= 0:
+                # Output plane is contiguous
+                cv2.LUT(planes[src[0]], self._luts[0], dst=gray)
+            else:
+                gray[:] = cv2.LUT(planes[src[0]], self._luts[0])
+            gray += cv2.LUT(planes[src[1]], self._luts[1])
+            gray += cv2.LUT(planes[src[2]], self._luts[2])
+            if self.to_gray > 1:
+                if self.channels_first:
+                    out[1:] = gray
+                else:
+                    out[:, :, 1:] = gray[:, :, None]
+        elif self.channels_first:
+            # Each output plane is looked up from its source channel
+            planes = cv2.split(image)
+            for c, src in enumerate(self._src_channels):
+                cv2.LUT(planes[src], self._luts[c], dst=out[c])
+        else:
+            if self.bgr:
+                image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+            cv2.LUT(image, self._luts_hwc, dst=out)
+        return out
+
+    def _forward_reference(self, image):
+        '''
+        Step-by-step preprocessing. Used for images which are not handled by the fused pipeline.
+        '''
         # Convert colors
         if self.bgr:
             image = image[:, :, ::-1]
@@ -173,38 +464,98 @@ class Preprocessing(_model.Model):
         # Change datatype
         image = image.astype(self.dtype)
 
-        if return_original:
-            return image.copy(), orig_image
-        else:
-            return image.copy()
+        return image.copy()
 
-    @staticmethod
-    def _read_image(path):
+    def _read_image(self, path):
         ''' Read image from file or url '''
-        # Download image if path is url
-        is_url = _utils.is_url(path)
-        if is_url:
-            path = _utils.file_from_url(path, 'temp', use_cached=False)
-        # Read image
         # pylint: disable=no-member
-        image = cv2.imread(path)
-        # Delete temporary file
-        if is_url:
-            os.remove(path)
+        if _utils.is_url(path):
+            # Download image into memory
+            data = np.frombuffer(_utils.fetch_bytes(path), dtype=np.uint8)
+        elif self.reduced_decode:
+            data = np.fromfile(path, dtype=np.uint8)
+        else:
+            data = None
+        # Decode image
+        if data is None:
+            image = cv2.imread(path)
+        else:
+            image = cv2.imdecode(data, self._decode_flag(data))
         # Throw exception
         if image is None:
             raise BaseException('Cannot read ' + path)
         # Convert from BGR to RGB
-        image = image[:, :, ::-1]
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         return image
 
+    def _decode_flag(self, data):
+        '''
+        Choose ``cv2.imdecode`` flag.
+        If ``reduced_decode`` is enabled, jpeg images much larger than ``resize``
+        are decoded at 1/2, 1/4 or 1/8 resolution, but not smaller than ``resize``.
+        '''
+        # pylint: disable=no-member
+        if not self.reduced_decode or self.resize is None:
+            return cv2.IMREAD_COLOR
+        size = _jpeg_size(data)
+        if size is None:
+            return cv2.IMREAD_COLOR
+        width, height = size
+        for factor, flag in [
+            (8, cv2.IMREAD_REDUCED_COLOR_8),
+            (4, cv2.IMREAD_REDUCED_COLOR_4),
+            (2, cv2.IMREAD_REDUCED_COLOR_2),
+        ]:
+            if width // factor >= self.resize[0] and height // factor >= self.resize[1]:
+                return flag
+        return cv2.IMREAD_COLOR
+
+    def get_transform(self, image_size):
+        '''
+        Get transform between the source image and the preprocessed image.
+
+        :parameter image_size: ``(width, height)`` of the source image.
+        :return: :class:`nnio.preprocessing.ResizeTransform`.
+        '''
+        width, height = image_size
+        if self.resize is None:
+            return ResizeTransform(1.0, 1.0, 0, 0, image_size, image_size)
+        if not self.padding:
+            return ResizeTransform(
+                self.resize[0] / width, self.resize[1] / height,
+                0, 0, image_size, self.resize)
+        new_size, start_0, start_1 = self._letterbox_geometry(width, height, self.resize)
+        return ResizeTransform(
+            new_size[0] / width, new_size[1] / height,
+            start_1, start_0, image_size, self.resize)
+
     @staticmethod
-    def _resize_image(image, resize, padding=False):
+    def _letterbox_geometry(width, height, resize):
+        '''
+        :return: size of the resized image ``(width, height)``
+            and its offset ``(rows, columns)`` on the padded canvas
+        '''
+        # Resize saving the aspect ratio
+        ratio_0 = width / resize[0]
+        ratio_1 = height / resize[1]
+        ratio = max(ratio_0, ratio_1)
+        new_size = (
+            int(width / ratio),
+            int(height / ratio)
+        )
+        start_0 = (resize[1] - new_size[1]) // 2
+        start_1 = (resize[0] - new_size[0]) // 2
+        return new_size, start_0, start_1
+
+    def _resize_image(self, image, resize, padding=False):
         ''' Resize image
-        
-        :parameter image: np.ndarray of type ``uint8`` or ``str``
+
+        With ``padding``, image is resized into a canvas which is kept between calls.
+        Padding of the canvas is filled with zeros only when the geometry changes.
+        The returned canvas is overwritten by the next call from the same thread.
+
+        :parameter image: np.ndarray of type ``uint8``
             RGB image
-            If ``str``, it will be concerned as image path.
         :parameter resize: ``None`` or ``tuple``.
             (width, height) - the new size of image
         :parameter padding: ``bool``.
@@ -213,35 +564,45 @@ class Preprocessing(_model.Model):
         '''
         if not padding:
             # pylint: disable=no-member
-            image = cv2.resize(image, resize)
-        else:
-            # Resize saving the aspect ratio
-            ratio_0 = image.shape[1] / resize[0]
-            ratio_1 = image.shape[0] / resize[1]
-            ratio = max(ratio_0, ratio_1)
-            new_size = (
-                int(image.shape[1] / ratio),
-                int(image.shape[0] / ratio)
-            )
-            # pylint: disable=no-member
-            image = cv2.resize(image, new_size)
+            return cv2.resize(image, resize)
+        new_size, start_0, start_1 = self._letterbox_geometry(image.shape[1], image.shape[0], resize)
+        # Canvas of this thread
+        shape = (resize[1], resize[0]) + image.shape[2:]
+        geometry = (shape, image.dtype, new_size)
+        if getattr(self._canvases, 'geometry', None) != geometry:
             # Pad with zeros
-            padding = np.zeros([resize[1], resize[0], 3],
-                               dtype=image.dtype)
-            start_0 = (padding.shape[0] - image.shape[0]) // 2
-            start_1 = (padding.shape[1] - image.shape[1]) // 2
-            padding[
-                start_0: start_0 + image.shape[0],
-                start_1: start_1 + image.shape[1],
-            ] = image
-            image = padding.copy()
-        return image
+            self._canvases.canvas = np.zeros(shape, dtype=image.dtype)
+            self._canvases.geometry = geometry
+        canvas = self._canvases.canvas
+        # Resize directly into the canvas
+        # pylint: disable=no-member
+        cv2.resize(
+            image, new_size,
+            dst=canvas[
+                start_0: start_0 + new_size[1],
+                start_1: start_1 + new_size[0],
+            ])
+        return canvas
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Canvases and threads are not shared between processes
+        del state['_canvases']
+        del state['_executors']
+        del state['_executors_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._canvases = threading.local()
+        self._executors = {}
+        self._executors_lock = threading.Lock()
 
     def __str__(self):
         '''
         :return: full description of the ``Preprocessing`` object
         '''
-        s = 'nnio.Preprocessing(resize={}, dtype={}, divide_by_255={}, means={}, stds={}, scales={}, to_gray={}, padding={}, channels_first={}, batch_dimension={}, bgr={})'
+        s = 'nnio.Preprocessing(resize={}, dtype={}, divide_by_255={}, means={}, stds={}, scales={}, to_gray={}, padding={}, channels_first={}, batch_dimension={}, bgr={}, reduced_decode={})'
         s = s.format(
             self.resize,
             self.dtype,
@@ -254,9 +615,103 @@ class Preprocessing(_model.Model):
             self.channels_first,
             self.batch_dimension,
             self.bgr,
+            self.reduced_decode,
         )
         return s
 
     def __eq__(self, other):
         '''Compare two ``Preprocessing`` objects. Returns ``True`` only if all preprocessing parameters are the same.'''
         return str(self) == str(other)
+
+
+# Start Of Frame markers, which contain jpeg image size
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(data):
+    '''
+    Read size of jpeg image from its header.
+
+    :parameter data: np.ndarray of ``uint8``. Encoded image.
+    :return: ``(width, height)`` or ``None`` if data is not a jpeg image.
+    '''
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Padding
+            i += 1
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            height = (int(data[i + 5]) << 8) + int(data[i + 6])
+            width = (int(data[i + 7]) << 8) + int(data[i + 8])
+            return width, height
+        # Skip segment
+        i += 2 + (int(data[i + 2]) << 8) + int(data[i + 3])
+    return None
+
+
+class ResizeTransform:
+    '''
+    Maps coordinates on the preprocessed image back to the source image.
+    Returned by :meth:`nnio.Preprocessing.get_transform`
+    and by :meth:`nnio.Preprocessing.forward` with ``return_transform=True``.
+
+    Model pixel ``x`` corresponds to source pixel ``(x - offset_x) / scale_x``
+    (same for ``y``).
+    '''
+    def __init__(self, scale_x, scale_y, offset_x, offset_y, source_size, target_size):
+        '''
+        :parameter scale_x: ``float``. Ratio of resized width to source width.
+        :parameter scale_y: ``float``. Ratio of resized height to source height.
+        :parameter offset_x: ``int``. Left padding on the preprocessed image in pixels.
+        :parameter offset_y: ``int``. Top padding on the preprocessed image in pixels.
+        :parameter source_size: ``(width, height)`` of the source image.
+        :parameter target_size: ``(width, height)`` of the preprocessed image.
+        '''
+        self.scale_x = scale_x
+        self.scale_y = scale_y
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+        self.source_size = tuple(source_size)
+        self.target_size = tuple(target_size)
+
+    def to_source(self, coords, relative=True, clip=False):
+        '''
+        Map coordinates from the preprocessed image to the source image.
+
+        :parameter coords: array of shape ``[..., 2 * k]`` with interleaved ``x, y`` coordinates,
+            e.g. boxes ``[x_min, y_min, x_max, y_max]``,
+            relative to the preprocessed image (in range ``[0, 1]``).
+        :parameter relative: ``bool``.
+            If ``True``, return coordinates relative to the source image.
+            If ``False``, return source pixel coordinates.
+        :parameter clip: ``bool``. Clip coordinates to the source image.
+        :return: np.ndarray of the same shape.
+        '''
+        coords = np.asarray(coords)
+        if not np.issubdtype(coords.dtype, np.floating):
+            coords = coords.astype(np.float32)
+        result = np.empty_like(coords)
+        xs = (coords[..., 0::2] * self.target_size[0] - self.offset_x) / self.scale_x
+        ys = (coords[..., 1::2] * self.target_size[1] - self.offset_y) / self.scale_y
+        if relative:
+            xs /= self.source_size[0]
+            ys /= self.source_size[1]
+            max_x, max_y = 1, 1
+        else:
+            max_x, max_y = self.source_size
+        if clip:
+            np.clip(xs, 0, max_x, out=xs)
+            np.clip(ys, 0, max_y, out=ys)
+        result[..., 0::2] = xs
+        result[..., 1::2] = ys
+        return result
+
+    def __str__(self):
+        return 'nnio.preprocessing.ResizeTransform(scale_x={}, scale_y={}, offset_x={}, offset_y={}, source_size={}, target_size={})'.format(
+            self.scale_x, self.scale_y, self.offset_x, self.offset_y, self.source_size, self.target_size)
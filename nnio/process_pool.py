@@ -0,0 +1,528 @@
+import collections
+import concurrent.futures
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+import time
+import numpy as np
+
+from . import model as _model
+
+# Offsets of arrays in shared memory are aligned to this number of bytes
+ALIGNMENT = 64
+
+
+def _pack_arrays(buf, start, size, arrays):
+    '''
+    Copy arrays into ``buf[start:start + size]``.
+
+    :return: list of ``(shape, dtype, offset)`` or ``None`` if the arrays do not fit.
+    '''
+    specs = []
+    offset = start
+    for array in arrays:
+        if not isinstance(array, np.ndarray) or array.dtype.hasobject:
+            return None
+        offset = (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        if offset + array.nbytes > start + size:
+            return None
+        specs.append((array.shape, array.dtype.str, offset))
+        offset += array.nbytes
+    for array, (shape, dtype, offset) in zip(arrays, specs):
+        np.ndarray(shape, dtype, buffer=buf, offset=offset)[...] = array
+    return specs
+
+
+def _unpack_arrays(buf, specs, copy=False):
+    '''
+    :return: list of arrays stored in ``buf``. Views of ``buf`` unless ``copy`` is ``True``.
+    '''
+    arrays = [np.ndarray(shape, dtype, buffer=buf, offset=offset) for shape, dtype, offset in specs]
+    if copy:
+        arrays = [array.copy() for array in arrays]
+    return arrays
+
+
+def _pack_result(buf, start, size, result):
+    '''
+    Copy model output into ``buf[start:start + size]``.
+
+    :return: message describing the output. If the output does not fit, it is sent pickled.
+    '''
+    if isinstance(result, np.ndarray):
+        kind, keys, arrays = 'array', None, [result]
+    elif type(result) in (list, tuple):
+        kind, keys, arrays = type(result).__name__, None, list(result)
+    elif type(result) is dict:
+        kind, keys, arrays = 'dict', list(result), list(result.values())
+    else:
+        return ('pickle', result)
+    specs = _pack_arrays(buf, start, size, arrays)
+    if specs is None:
+        return ('pickle', result)
+    return (kind, keys, specs)
+
+
+def _unpack_result(buf, message):
+    if message[0] == 'pickle':
+        return message[1]
+    kind, keys, specs = message
+    arrays = _unpack_arrays(buf, specs, copy=True)
+    if kind == 'array':
+        return arrays[0]
+    if kind == 'list':
+        return arrays
+    if kind == 'tuple':
+        return tuple(arrays)
+    return dict(zip(keys, arrays))
+
+
+def _model_details(model):
+    details = []
+    for method in [model.get_preprocessing, model.get_input_details, model.get_output_details]:
+        try:
+            details.append(method())
+        except BaseException:
+            details.append(None)
+    return details
+
+
+def _worker_main(model_factory, device, slot_names, slot_bytes, tasks, results):
+    '''
+    Main function of a worker process.
+    Runs the model on inputs from shared memory slots and writes outputs to the same slots.
+    '''
+    from multiprocessing import shared_memory
+    try:
+        model = model_factory(device)
+        details = _model_details(model)
+    except BaseException as e:
+        results.send(('error', e))
+        return
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    results.send(('ready', (os.getpid(), details)))
+    buf = None
+    while True:
+        task = tasks.recv()
+        if task is None:
+            break
+        request_id, slot, inputs = task
+        buf = slots[slot].buf
+        try:
+            if inputs[0] == 'shared':
+                inputs = _unpack_arrays(buf, inputs[1])
+            else:
+                inputs = inputs[1]
+            start = time.perf_counter()
+            result, info = model(*inputs, return_info=True)
+            busy_time = time.perf_counter() - start
+            del inputs
+            message = ('result', request_id, _pack_result(buf, slot_bytes, slot_bytes, result), info, busy_time)
+            del result
+        except BaseException as e:
+            message = ('exception', request_id, e)
+        try:
+            results.send(message)
+        except BaseException as e:
+            # Output or exception cannot be pickled
+            results.send(('exception', request_id, BaseException(repr(e))))
+    del buf
+    for shm in slots:
+        shm.close()
+
+
+class _Worker:
+    '''
+    Worker process with pipes for tasks and results.
+    '''
+    def __init__(self, index, device, context, model_factory, slot_names, slot_bytes):
+        self.index = index
+        self.device = device
+        worker_tasks, self.tasks = context.Pipe(duplex=False)
+        self.results, worker_results = context.Pipe(duplex=False)
+        self.process = context.Process(
+            target=_worker_main,
+            args=(model_factory, device, slot_names, slot_bytes, worker_tasks, worker_results),
+            daemon=True,
+        )
+        self.process.start()
+        worker_tasks.close()
+        worker_results.close()
+        self.send_lock = threading.Lock()
+        self.pid = None
+        # Whether the model is created
+        self.ready = False
+        # Whether the process has exited
+        self.exited = False
+        # Futures and slots of unfinished calls by request id
+        self.pending = {}
+        self.n_calls = 0
+        self.busy_time = 0.0
+
+
+class ProcessPoolModel(_model.Model):
+    '''
+    Runs copies of one model in separate processes and spreads calls between them.
+    Every call goes to the process with the fewest unfinished calls.
+
+    Unlike :class:`nnio.ModelPool`, python code of the model
+    (e.g. :class:`nnio.Preprocessing` or parsing of outputs)
+    is not limited by the GIL, so CPU-bound models scale with the number of cores.
+    Inputs and outputs are passed through shared memory slots without pickling.
+    Arrays which do not fit into a slot, and outputs which are not arrays, are pickled.
+
+    If a worker process crashes, its unfinished calls fail and a new process is started.
+
+    ``model_factory`` is called in the worker processes, so it must be picklable,
+    e.g. a function defined at the top level of a module.
+
+    Usage example::
+
+        def make_model(device):
+            return nnio.ONNXModel('path/to/model.onnx', intra_op_num_threads=1)
+
+        if __name__ == '__main__':
+            pool = nnio.ProcessPoolModel(make_model, n_workers=4)
+
+            # Process a stream of images. Results come in the same order
+            for class_scores in pool.map(preproc(frame) for frame in frames):
+                ...
+
+            print(pool.utilization())
+            pool.close()
+    '''
+    def __init__(
+        self,
+        model_factory,
+        devices=None,
+        n_workers=None,
+        n_slots=None,
+        slot_bytes=8 * 2**20,
+        start_method='spawn',
+    ):
+        '''
+        :parameter model_factory: function which takes a device name and returns :class:`nnio.Model`.
+        :parameter devices: list of ``str``.
+            Devices to put models on, one process per device, e.g. ``['TPU:0', 'TPU:1']``.
+            The same device may be listed several times.
+        :parameter n_workers: ``int``.
+            If ``devices`` is not specified, create this number of processes with models on ``CPU``.
+            By default the number of cores.
+        :parameter n_slots: ``int``.
+            Number of shared memory slots, i.e. maximum number of unfinished calls.
+            When all slots are used, new calls wait. By default twice the number of processes.
+        :parameter slot_bytes: ``int``. Size of memory for inputs of one call and for its outputs.
+        :parameter start_method: ``str``. Start method of :mod:`multiprocessing`.
+            ``'fork'`` is not safe if a backend has already started threads in this process.
+        '''
+        super().__init__()
+        from multiprocessing import shared_memory
+        if devices is None:
+            devices = ['CPU'] * (n_workers or os.cpu_count())
+        if len(devices) == 0:
+            raise BaseException('ProcessPoolModel needs at least one device')
+        self.slot_bytes = slot_bytes
+        self._model_factory = model_factory
+        self._context = multiprocessing.get_context(start_method)
+        self._lock = threading.Lock()
+        self._start_time = time.perf_counter()
+        self._request_ids = itertools.count()
+        self._closing = False
+        self._details = [None, None, None]
+        self._n_restarts = 0
+        # Number of worker processes being started in place of exited ones
+        self._n_starting = 0
+
+        # Every slot holds inputs in the first half and outputs in the second half
+        self._slots = [
+            shared_memory.SharedMemory(create=True, size=2 * slot_bytes)
+            for _ in range(n_slots or 2 * len(devices))
+        ]
+        self._free_slots = collections.deque(range(len(self._slots)))
+        self._slot_available = threading.Condition(self._lock)
+        self._workers_changed = threading.Condition(self._lock)
+
+        self._workers = [self._start_worker(i, device) for i, device in enumerate(devices)]
+        try:
+            for worker in self._workers:
+                self._wait_ready(worker)
+        except BaseException:
+            for worker in self._workers:
+                worker.process.kill()
+            self._release_slots()
+            raise
+        self._thread = threading.Thread(target=self._collect, daemon=True)
+        self._thread.start()
+
+    def forward(self, *inputs, return_info=False):
+        r'''
+        Run the model in the least busy process and wait for the result.
+
+        :parameter \*inputs: numpy arrays, Inputs to the model
+        :parameter return_info: bool, If True, will also return inference info of the model
+            and ``worker`` (index of the process).
+        :return: output of the model.
+        '''
+        return self.forward_async(*inputs, return_info=return_info).result()
+
+    def forward_async(self, *inputs, return_info=False):
+        r'''
+        Send the inputs to the least busy process and return without waiting.
+        Waits only if all shared memory slots are used.
+
+        :parameter \*inputs: numpy arrays, Inputs to the model
+        :parameter return_info: bool, If True, the future will also have inference info.
+        :return: :class:`concurrent.futures.Future` with output of the model.
+        '''
+        with self._lock:
+            while not self._free_slots:
+                self._slot_available.wait()
+            slot = self._free_slots.popleft()
+        # Slot belongs to this call now, so it is filled without the lock
+        specs = _pack_arrays(self._slots[slot].buf, 0, self.slot_bytes, inputs)
+        message = ('shared', specs) if specs is not None else ('pickle', inputs)
+        future = concurrent.futures.Future()
+        with self._lock:
+            while True:
+                workers = [worker for worker in self._workers if not worker.exited]
+                if workers or self._closing or not self._n_starting:
+                    break
+                # Every process has exited and new ones are being started
+                self._workers_changed.wait()
+            if self._closing or not workers:
+                self._free_slot(slot)
+                raise BaseException('ProcessPoolModel is closed' if self._closing else 'All worker processes have failed')
+            worker = min(workers, key=lambda w: len(w.pending))
+            request_id = next(self._request_ids)
+            worker.pending[request_id] = (future, slot, return_info)
+        # Sending may wait for the worker if inputs are pickled, so it is done without the lock
+        try:
+            with worker.send_lock:
+                worker.tasks.send((request_id, slot, message))
+        except BaseException as e:
+            with self._lock:
+                lost = worker.pending.pop(request_id, None)
+                if lost is not None:
+                    self._free_slot(slot)
+            # Otherwise the call is failed by the collecting thread
+            if lost is not None:
+                future.set_exception(e)
+        return future
+
+    def map(self, inputs, max_in_flight=None):
+        '''
+        Run the model on a stream of inputs using all processes.
+        Results are yielded in the order of inputs.
+
+        :parameter inputs: iterable of numpy arrays or of tuples of numpy arrays (for models with several inputs).
+        :parameter max_in_flight: ``int``.
+            Maximum number of inputs sent to processes and not yet yielded.
+            By default the number of slots.
+        :return: generator of model outputs.
+        '''
+        max_in_flight = max_in_flight or len(self._slots)
+        in_flight = collections.deque()
+        for inp in inputs:
+            if not isinstance(inp, tuple):
+                inp = (inp,)
+            in_flight.append(self.forward_async(*inp))
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+    def utilization(self):
+        '''
+        :return: list of ``dict`` with statistics for every process:
+            ``device``, ``pid``, ``n_calls``, ``pending`` (calls in queue or running),
+            ``busy_time`` (seconds spent in the model)
+            and ``utilization`` (fraction of time spent in the model since the pool was created).
+        '''
+        elapsed = time.perf_counter() - self._start_time
+        with self._lock:
+            return [
+                {
+                    'device': worker.device,
+                    'pid': worker.pid,
+                    'n_calls': worker.n_calls,
+                    'pending': len(worker.pending),
+                    'busy_time': worker.busy_time,
+                    'utilization': worker.busy_time / elapsed,
+                }
+                for worker in self._workers
+            ]
+
+    @property
+    def n_restarts(self):
+        ''' number of worker processes started again after a crash '''
+        return self._n_restarts
+
+    def close(self):
+        '''
+        Stop worker processes after they finish queued calls and free shared memory.
+        '''
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            workers = list(self._workers)
+        for worker in workers:
+            try:
+                with worker.send_lock:
+                    worker.tasks.send(None)
+            except BaseException:
+                pass
+        self._thread.join()
+        for worker in self._workers:
+            worker.process.join()
+        self._release_slots()
+
+    def get_preprocessing(self):
+        return self._details[0]
+
+    def get_input_details(self):
+        return self._details[1]
+
+    def get_output_details(self):
+        return self._details[2]
+
+    def _start_worker(self, index, device):
+        return _Worker(
+            index, device, self._context,
+            self._model_factory, [shm.name for shm in self._slots], self.slot_bytes,
+        )
+
+    def _wait_ready(self, worker):
+        '''
+        Wait until the model is created in the worker process.
+        '''
+        try:
+            status, value = worker.results.recv()
+        except EOFError:
+            raise BaseException('Worker process on {} exited with code {} before creating the model'.format(
+                worker.device, worker.process.exitcode))
+        if status == 'error':
+            raise value
+        worker.pid, self._details = value
+        worker.ready = True
+
+    def _collect(self):
+        '''
+        Receive results from worker processes and restart crashed processes.
+        '''
+        while True:
+            with self._lock:
+                workers = [worker for worker in self._workers if worker.process.exitcode is None or worker.pending]
+            if not workers:
+                return
+            objects = [worker.results for worker in workers] + [worker.process.sentinel for worker in workers]
+            ready = multiprocessing.connection.wait(objects)
+            for worker in workers:
+                if worker.results in ready:
+                    try:
+                        self._receive(worker)
+                        continue
+                    except (EOFError, OSError):
+                        pass
+                elif worker.process.sentinel not in ready:
+                    continue
+                # Results sent before the process exited are still in the pipe
+                try:
+                    while worker.results.poll():
+                        self._receive(worker)
+                except (EOFError, OSError):
+                    pass
+                worker.process.join()
+                self._on_exit(worker)
+
+    def _receive(self, worker):
+        message = worker.results.recv()
+        status = message[0]
+        if status == 'ready':
+            # Restarted worker
+            worker.pid, _ = message[1]
+            with self._lock:
+                worker.ready = True
+            return
+        if status == 'error':
+            print('Cannot restart worker process on {}: {}'.format(worker.device, message[1]))
+            return
+        request_id = message[1]
+        with self._lock:
+            future, slot, return_info = worker.pending.pop(request_id)
+        if status == 'result':
+            _, _, output, info, busy_time = message
+            try:
+                result = _unpack_result(self._slots[slot].buf, output)
+            except BaseException as e:
+                status, error = 'exception', e
+            with self._lock:
+                worker.n_calls += 1
+                worker.busy_time += busy_time
+                self._free_slot(slot)
+            if status == 'result':
+                if return_info:
+                    info = dict(info)
+                    info['worker'] = worker.index
+                    future.set_result((result, info))
+                else:
+                    future.set_result(result)
+                return
+        else:
+            error = message[2]
+            with self._lock:
+                self._free_slot(slot)
+        future.set_exception(error)
+
+    def _on_exit(self, worker):
+        '''
+        Fail unfinished calls of an exited worker and start a new process in its place.
+        '''
+        with self._lock:
+            pending = worker.pending
+            worker.pending = {}
+            for _, slot, _ in pending.values():
+                self._free_slot(slot)
+            worker.exited = True
+            # A worker which failed to create the model is not restarted
+            restart = worker.ready and not self._closing
+            if restart:
+                self._n_starting += 1
+        for future, _, _ in pending.values():
+            future.set_exception(BaseException('Worker process on {} exited with code {}'.format(
+                worker.device, worker.process.exitcode)))
+        worker.tasks.close()
+        worker.results.close()
+        if not restart:
+            return
+        # Starting a process takes time, so calls to other workers are not blocked meanwhile
+        try:
+            new_worker = self._start_worker(worker.index, worker.device)
+        except BaseException as e:
+            print('Cannot restart worker process on {}: {}'.format(worker.device, e))
+            new_worker = None
+        with self._lock:
+            self._n_starting -= 1
+            if new_worker is not None:
+                new_worker.n_calls = worker.n_calls
+                new_worker.busy_time = worker.busy_time
+                self._workers[worker.index] = new_worker
+                self._n_restarts += 1
+            closing = self._closing
+            self._workers_changed.notify_all()
+        if new_worker is not None and closing:
+            # close() did not see the new worker
+            with new_worker.send_lock:
+                new_worker.tasks.send(None)
+
+    def _free_slot(self, slot):
+        # Must be called with the lock held
+        self._free_slots.append(slot)
+        self._slot_available.notify()
+
+    def _release_slots(self):
+        for shm in self._slots:
+            shm.close()
+            shm.unlink()
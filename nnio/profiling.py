@@ -0,0 +1,216 @@
+'''
+Profiling of nnio models.
+
+Every model records durations of its processing stages
+(``read``, ``download``, ``preprocessing``, ``input``, ``invoke``, ``output``)
+measured with ``time.perf_counter_ns``.
+Durations are sent to sinks, which are attached with :meth:`nnio.Model.enable_profiling`.
+When profiling is not enabled, models only check one attribute per call.
+
+Example::
+
+    histogram = nnio.profiling.HistogramSink()
+    model.enable_profiling(
+        histogram,
+        nnio.profiling.PrometheusSink('/var/lib/node_exporter/nnio.prom'),
+    )
+    ...
+    print(histogram.summary())
+'''
+import math
+import os
+import tempfile
+import threading
+import time
+
+
+def spans_to_info(spans):
+    '''
+    Convert stage durations to the ``info`` dict returned with ``return_info=True``.
+
+    :parameter spans: ``dict``. Durations in nanoseconds by stage name.
+    :return: ``dict`` with ``<stage>_time`` keys in seconds.
+    '''
+    return {
+        stage + '_time': duration / 1e9
+        for stage, duration in spans.items()
+    }
+
+
+class Profiler:
+    '''
+    Sends stage durations of one model to sinks.
+    '''
+    def __init__(self, name, sinks):
+        '''
+        :parameter name: ``str``. Name of the profiled model.
+        :parameter sinks: list of sinks. Each sink has method ``add(name, stage, duration_ns)``.
+        '''
+        self.name = name
+        self.sinks = list(sinks)
+
+    def record(self, spans):
+        '''
+        :parameter spans: ``dict``. Durations in nanoseconds by stage name.
+        '''
+        for stage, duration in spans.items():
+            for sink in self.sinks:
+                sink.add(self.name, stage, duration)
+
+
+class HistogramSink:
+    '''
+    Keeps histograms of stage durations in memory.
+    Buckets grow geometrically, so percentiles are precise up to about 10%.
+    '''
+    # Number of buckets per doubling of duration
+    BUCKETS_PER_OCTAVE = 8
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def add(self, name, stage, duration_ns):
+        bucket = self._bucket(duration_ns)
+        with self._lock:
+            hist = self._histograms.get((name, stage))
+            if hist is None:
+                hist = self._histograms[(name, stage)] = {
+                    'buckets': {},
+                    'count': 0,
+                    'sum': 0,
+                    'max': 0,
+                }
+            hist['buckets'][bucket] = hist['buckets'].get(bucket, 0) + 1
+            hist['count'] += 1
+            hist['sum'] += duration_ns
+            hist['max'] = max(hist['max'], duration_ns)
+
+    def summary(self):
+        '''
+        :return: ``dict`` with statistics for every ``(model name, stage)`` pair:
+            ``count``, ``mean``, ``p50``, ``p90``, ``p99``, ``max``. Durations are in seconds.
+        '''
+        with self._lock:
+            summary = {}
+            for key, hist in self._histograms.items():
+                summary[key] = {
+                    'count': hist['count'],
+                    'mean': hist['sum'] / hist['count'] / 1e9,
+                    'p50': self._percentile(hist, 0.5) / 1e9,
+                    'p90': self._percentile(hist, 0.9) / 1e9,
+                    'p99': self._percentile(hist, 0.99) / 1e9,
+                    'max': hist['max'] / 1e9,
+                }
+            return summary
+
+    def reset(self):
+        ''' Remove all recorded durations '''
+        with self._lock:
+            self._histograms = {}
+
+    @classmethod
+    def _bucket(cls, duration_ns):
+        return int(math.log2(max(duration_ns, 1)) * cls.BUCKETS_PER_OCTAVE)
+
+    @classmethod
+    def _percentile(cls, hist, q):
+        ''' Upper bound of the bucket which contains the ``q`` quantile '''
+        rank = q * hist['count']
+        seen = 0
+        for bucket in sorted(hist['buckets']):
+            seen += hist['buckets'][bucket]
+            if seen >= rank:
+                upper = 2 ** ((bucket + 1) / cls.BUCKETS_PER_OCTAVE)
+                return min(upper, hist['max'])
+        return hist['max']
+
+
+class CallbackSink:
+    '''
+    Calls a function for every recorded duration.
+    '''
+    def __init__(self, callback):
+        '''
+        :parameter callback: function ``callback(name, stage, duration_ns)``.
+        '''
+        self.callback = callback
+
+    def add(self, name, stage, duration_ns):
+        self.callback(name, stage, duration_ns)
+
+
+class PrometheusSink:
+    '''
+    Writes stage durations as Prometheus histograms to a text file,
+    which can be exported by node_exporter's textfile collector.
+    The file is replaced atomically.
+    '''
+    # Bucket upper bounds in seconds
+    BUCKETS = [0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+    def __init__(self, path, write_interval=10.0, metric_name='nnio_stage_duration_seconds'):
+        '''
+        :parameter path: ``str``. Path to the ``.prom`` file.
+        :parameter write_interval: ``float``.
+            The file is rewritten at most once in this number of seconds.
+            Call :meth:`write` to write it immediately.
+        :parameter metric_name: ``str``. Name of the histogram metric.
+        '''
+        self.path = path
+        self.write_interval = write_interval
+        self.metric_name = metric_name
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._last_write = time.monotonic()
+
+    def add(self, name, stage, duration_ns):
+        duration = duration_ns / 1e9
+        with self._lock:
+            hist = self._histograms.get((name, stage))
+            if hist is None:
+                hist = self._histograms[(name, stage)] = {
+                    'buckets': [0] * len(self.BUCKETS),
+                    'count': 0,
+                    'sum': 0.0,
+                }
+            for i, upper in enumerate(self.BUCKETS):
+                if duration <= upper:
+                    hist['buckets'][i] += 1
+                    break
+            hist['count'] += 1
+            hist['sum'] += duration
+            write = time.monotonic() - self._last_write >= self.write_interval
+        if write:
+            self.write()
+
+    def write(self):
+        ''' Write the file now '''
+        with self._lock:
+            text = self._format()
+            self._last_write = time.monotonic()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.nnio_', suffix='.prom.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _format(self):
+        lines = [
+            '# HELP {} Duration of nnio processing stages'.format(self.metric_name),
+            '# TYPE {} histogram'.format(self.metric_name),
+        ]
+        for (name, stage), hist in sorted(self._histograms.items()):
+            labels = 'model="{}",stage="{}"'.format(name, stage)
+            cumulative = 0
+            for upper, count in zip(self.BUCKETS, hist['buckets']):
+                cumulative += count
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(self.metric_name, labels, upper, cumulative))
+            lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(self.metric_name, labels, hist['count']))
+            lines.append('{}_sum{{{}}} {}'.format(self.metric_name, labels, hist['sum']))
+            lines.append('{}_count{{{}}} {}'.format(self.metric_name, labels, hist['count']))
+        return '\n'.join(lines) + '\n'
@@ -1,20 +1,62 @@
-import urllib.request
+import urllib.parse
+import collections.abc
 import os
+import importlib
 import pathlib
 import getpass
 import datetime
+import hashlib
+import tempfile
+import threading
 import numpy as np
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
 from . import __version__
+from . import index as _index
 
 PACKAGE_NAME = 'nnio'
 
+# Cache of downloaded files
+CACHE_DIR = os.environ.get('NNIO_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', PACKAGE_NAME)
+CACHE_MAX_SIZE = int(os.environ['NNIO_CACHE_MAX_SIZE']) if os.environ.get('NNIO_CACHE_MAX_SIZE') else None
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+LOCK_SUFFIX = '.lock'
+SHA256_SUFFIX = '.sha256'
+TEMP_PREFIX = '.download_'
+# Subdirectories of the cache with files written by nnio.
+# Files downloaded to other categories are recognized by their ``SHA256_SUFFIX`` files
+CACHE_CATEGORIES = ('models', 'onnx_optimized', 'openvino_compiled')
+
 # Temperature logging flag
 LOG_TEMPERATURE = False
 temperature_files = {}
 
 URL_MARKERS = ['http://', 'https://']
 
+
+class LazyModule:
+    '''
+    Module which is imported when its attribute is used for the first time.
+    Keeps heavy modules like ``cv2`` out of ``import nnio``.
+    '''
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        value = getattr(self._module, attr)
+        # Next time the attribute is found without calling __getattr__
+        setattr(self, attr, value)
+        return value
+
+
 def is_url(s):
     '''
     Check if input string is url or not
@@ -28,10 +70,24 @@ def is_url(s):
             return True
     return False
 
-def file_from_url(url, category='other', file_name=None, use_cached=True):
+def file_from_url(url, category='other', file_name=None, use_cached=True, sha256=None):
     '''
-    Downloads file to "/home/$USER/.cache/nnio/" if it does not exist already.
+    Downloads file to the cache directory if it does not exist already.
     Returns path to the file
+
+    Cache directory is ``$NNIO_CACHE_DIR`` or ``~/.cache/nnio`` and can be changed with :func:`set_cache_dir`.
+    File is downloaded to a temporary file and renamed when complete,
+    so interrupted downloads are never used.
+    Processes downloading the same file at the same time wait for each other
+    and only one of them downloads it.
+
+    :parameter url: ``str``. URL of the file.
+    :parameter category: ``str``. Subdirectory of the cache.
+    :parameter file_name: ``str``. Name of the file. By default taken from the url.
+    :parameter use_cached: ``bool``. If ``False``, download the file even if it is cached.
+    :parameter sha256: ``str`` or ``None``.
+        Expected sha256 hex digest of the file.
+        If specified, the downloaded file is verified and cached file with another digest is downloaded again.
     '''
     # Remove prefix from url
     url_path = url
@@ -40,10 +96,7 @@ def file_from_url(url, category='other', file_name=None, use_cached=True):
     url_path = '/'.join(url_path.split('/')[:-1])
     # Get base path for file
     base_path = os.path.join(
-        '/home',
-        getpass.getuser(),
-        '.cache',
-        PACKAGE_NAME,
+        CACHE_DIR,
         '.'.join(__version__.split('.')[:2]),
         category,
         url_path,
@@ -57,17 +110,335 @@ def file_from_url(url, category='other', file_name=None, use_cached=True):
         base_path,
         file_name
     )
-    # Download file from the url
-    if not os.path.exists(file_path) or not use_cached:
-        print('Downloading file from: {}'.format(url))
-        urllib.request.urlretrieve(url, file_path)
-        print('Downloaded to: {}'.format(file_path))
-    else:
-        print('Using cached file: {}'.format(file_path))
+    # Only one process downloads the file
+    with _FileLock(file_path + LOCK_SUFFIX) as lock:
+        if use_cached and os.path.exists(file_path) and _check_sha256(file_path, sha256):
+            print('Using cached file: {}'.format(file_path))
+            # Mark file as recently used
+            os.utime(file_path)
+        else:
+            print('Downloading file from: {}'.format(url))
+            try:
+                _download(url, file_path, sha256)
+            except BaseException:
+                # Do not leave a lock without a file
+                if not os.path.exists(file_path):
+                    lock.remove()
+                raise
+            print('Downloaded to: {}'.format(file_path))
+    # Remove old files if the cache is too big
+    if CACHE_MAX_SIZE is not None:
+        evict_cache(CACHE_MAX_SIZE, keep=[file_path])
 
     return file_path
 
 
+def set_cache_dir(path):
+    '''
+    Set directory where downloaded files are cached.
+    '''
+    global CACHE_DIR
+    CACHE_DIR = path
+
+
+def set_cache_max_size(max_size):
+    '''
+    Set maximum total size of cached files in bytes.
+    When it is exceeded, least recently used files are removed.
+    ``None`` means no limit.
+    '''
+    global CACHE_MAX_SIZE
+    CACHE_MAX_SIZE = max_size
+
+
+def evict_cache(max_size, keep=()):
+    '''
+    Remove least recently used files from the cache directory
+    until their total size is not greater than ``max_size`` bytes.
+    Only files downloaded or created by nnio are counted and removed.
+
+    :parameter max_size: ``int``. Maximum total size in bytes.
+    :parameter keep: list of paths which must not be removed.
+    '''
+    keep = set(os.path.abspath(path) for path in keep)
+    files = []
+    total_size = 0
+    for root, _, names in os.walk(CACHE_DIR):
+        # Layout of the cache is <version>/<category>/...
+        parts = os.path.relpath(root, CACHE_DIR).split(os.sep)
+        if len(parts) < 2:
+            continue
+        for name in names:
+            if name.endswith(LOCK_SUFFIX):
+                _remove_orphaned_lock(os.path.join(root, name))
+                continue
+            if name.endswith(SHA256_SUFFIX) or name.startswith(TEMP_PREFIX):
+                continue
+            path = os.path.join(root, name)
+            if parts[1] not in CACHE_CATEGORIES and not os.path.exists(path + SHA256_SUFFIX):
+                # Not written by nnio
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            total_size += stat.st_size
+            if os.path.abspath(path) not in keep:
+                files.append((stat.st_mtime, stat.st_size, path))
+    # Least recently used first
+    for _, size, path in sorted(files):
+        if total_size <= max_size:
+            break
+        with _FileLock(path + LOCK_SUFFIX) as lock:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            if os.path.exists(path + SHA256_SUFFIX):
+                os.remove(path + SHA256_SUFFIX)
+            lock.remove()
+        print('Removed from cache: {}'.format(path))
+        total_size -= size
+
+
+def _remove_orphaned_lock(lock_path):
+    '''
+    Remove lock file whose cached file does not exist, unless someone holds the lock.
+    '''
+    if os.path.exists(lock_path[:-len(LOCK_SUFFIX)]):
+        return
+    lock = _FileLock(lock_path)
+    if not lock.acquire(blocking=False):
+        # The file is being downloaded
+        return
+    try:
+        if not os.path.exists(lock_path[:-len(LOCK_SUFFIX)]):
+            lock.remove()
+    finally:
+        lock.release()
+
+
+def _download(url, file_path, sha256=None):
+    '''
+    Stream file from the url into a temporary file and move it to ``file_path``.
+    '''
+    import urllib.request
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=TEMP_PREFIX)
+    try:
+        with os.fdopen(fd, 'wb') as f, urllib.request.urlopen(url) as response:
+            expected_size = response.headers.get('Content-Length')
+            size = 0
+            while True:
+                chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if expected_size is not None and size != int(expected_size):
+            raise BaseException('Download of {} is incomplete: got {} of {} bytes'.format(url, size, expected_size))
+        if sha256 is not None and digest.hexdigest() != sha256.lower():
+            raise BaseException('Checksum mismatch for {}: expected {}, got {}'.format(url, sha256, digest.hexdigest()))
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    # Remember digest to verify cached file without reading it
+    with open(file_path + SHA256_SUFFIX, 'w') as f:
+        f.write(digest.hexdigest())
+
+
+def _check_sha256(file_path, sha256):
+    '''
+    Check digest of the cached file.
+    '''
+    if sha256 is None:
+        return True
+    sha256 = sha256.lower()
+    if os.path.exists(file_path + SHA256_SUFFIX):
+        with open(file_path + SHA256_SUFFIX) as f:
+            if f.read().strip() == sha256:
+                return True
+    return file_sha256(file_path) == sha256
+
+
+def file_sha256(file_path):
+    '''
+    :return: ``str``. sha256 hex digest of the file.
+    '''
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_file_path(category, key, suffix=''):
+    '''
+    Path of a file derived from a model (e.g. optimized or compiled model) in the cache directory.
+    The file is removed together with downloaded files when the cache is too big.
+
+    :parameter category: ``str``. Subdirectory of the cache.
+    :parameter key: ``dict``. Everything the file depends on, e.g. digest of the model and options.
+    :parameter suffix: ``str``. Extension of the file.
+    :return: ``str``. Path to the file. Its directory exists.
+    '''
+    base_path = os.path.join(CACHE_DIR, '.'.join(__version__.split('.')[:2]), category)
+    pathlib.Path(base_path).mkdir(parents=True, exist_ok=True)
+    key_digest = hashlib.sha256(repr(sorted(key.items())).encode()).hexdigest()
+    return os.path.join(base_path, key_digest[:32] + suffix)
+
+
+class _FileLock:
+    '''
+    Inter-process lock on a file.
+    The lock file may be removed by its holder with :meth:`remove`.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self, blocking=True):
+        '''
+        :return: ``True`` if the lock is acquired. May be ``False`` only if ``blocking`` is ``False``.
+        '''
+        while True:
+            self._file = open(self.path, 'a+b')
+            if not self._lock(blocking):
+                self._file.close()
+                self._file = None
+                return False
+            # Holder of the lock could remove the file while we were waiting for it
+            try:
+                if os.path.samestat(os.fstat(self._file.fileno()), os.stat(self.path)):
+                    return True
+            except FileNotFoundError:
+                pass
+            self.release()
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+
+    def remove(self):
+        '''
+        Remove the lock file. Must be called while the lock is held.
+        '''
+        try:
+            os.remove(self.path)
+        except OSError:
+            # Windows does not remove open files
+            pass
+
+    def _lock(self, blocking):
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                return False
+        # Windows. Lock the first byte, retrying while it is locked
+        while True:
+            try:
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class _ConnectionPool:
+    '''
+    Keeps HTTP connections open to reuse them for the next requests to the same host.
+    '''
+    # Maximum number of idle connections per host
+    MAX_IDLE = 8
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def get(self, scheme, netloc, timeout):
+        ''' Get an idle connection or open a new one '''
+        import http.client
+        with self._lock:
+            connections = self._idle.get((scheme, netloc))
+            if connections:
+                return connections.pop(), True
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=timeout), False
+        return http.client.HTTPConnection(netloc, timeout=timeout), False
+
+    def put(self, scheme, netloc, connection):
+        ''' Return connection to the pool '''
+        with self._lock:
+            connections = self._idle.setdefault((scheme, netloc), [])
+            if len(connections) < self.MAX_IDLE:
+                connections.append(connection)
+                return
+        connection.close()
+
+
+_connection_pool = _ConnectionPool()
+
+
+def fetch_bytes(url, timeout=30, max_redirects=5):
+    '''
+    Download contents of the url into memory.
+    HTTP keep-alive connections are reused between calls.
+
+    :parameter url: ``str``. ``http://`` or ``https://`` url.
+    :parameter timeout: ``float``. Socket timeout in seconds.
+    :parameter max_redirects: ``int``. Maximum number of redirects to follow.
+    :return: ``bytes``.
+    '''
+    import http.client
+    for _ in range(max_redirects + 1):
+        parsed = urllib.parse.urlsplit(url)
+        target = parsed.path or '/'
+        if parsed.query:
+            target += '?' + parsed.query
+        # Idle connection may be closed by server. Then retry with a new one
+        for attempt in range(2):
+            connection, reused = _connection_pool.get(parsed.scheme, parsed.netloc, timeout)
+            try:
+                connection.request('GET', target, headers={'Connection': 'keep-alive'})
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                if not reused or attempt > 0:
+                    raise
+        if response.will_close:
+            connection.close()
+        else:
+            _connection_pool.put(parsed.scheme, parsed.netloc, connection)
+        if response.status in (301, 302, 303, 307, 308):
+            url = urllib.parse.urljoin(url, response.getheader('Location'))
+            continue
+        if response.status != 200:
+            raise BaseException('Cannot download {}: HTTP {} {}'.format(url, response.status, response.reason))
+        return data
+    raise BaseException('Too many redirects: {}'.format(url))
+
+
 # Flag setter
 def enable_logging_temperature(enable=True):
     global LOG_TEMPERATURE
@@ -106,69 +477,350 @@ def log_temperature(device, temperature):
         f.flush()
 
 
+class _VectorsView(collections.abc.MutableMapping):
+    '''
+    Vectors of :class:`HumanDataBase` by key. Changes go to the index of the database.
+    '''
+    def __init__(self, db):
+        self._db = db
+
+    def __getitem__(self, key):
+        return self._db.index.get(self._db._ids[key])
+
+    def __setitem__(self, key, vec):
+        vec = np.asarray(vec, dtype=np.float32)
+        vec_id = self._db._ids.get(key)
+        if vec_id is None:
+            self._db._set_vector(key, vec)
+        else:
+            # Count of the key is kept
+            self._db.index.update(vec_id, vec)
+
+    def __delitem__(self, key):
+        self._db._remove_key(key)
+
+    def __iter__(self):
+        return iter(list(self._db._ids))
+
+    def __len__(self):
+        return len(self._db._ids)
+
+
+class _CountsView(collections.abc.MutableMapping):
+    '''
+    Counts of :class:`HumanDataBase` by key. Only counts of existing keys can be set.
+    '''
+    def __init__(self, db):
+        self._db = db
+
+    def __getitem__(self, key):
+        return int(self._db._counts[self._db._ids[key]])
+
+    def __setitem__(self, key, count):
+        self._db._set_count(self._db._ids[key], count)
+
+    def __delitem__(self, key):
+        self._db._remove_key(key)
+
+    def __iter__(self):
+        return iter(list(self._db._ids))
+
+    def __len__(self):
+        return len(self._db._ids)
+
+
 class HumanDataBase:
+    '''
+    Database of people embedding vectors for re-identification.
+    Vectors are kept in a nearest neighbour index from :mod:`nnio.index`.
+    The default :class:`nnio.index.BruteForceIndex` compares queries with all people
+    using one matrix multiplication.
+
+    With ``path``, the database is kept in memory-mapped files of a directory and every change is written there.
+    New people are appended to the files, so the database is never rewritten.
+    Other processes may open the same directory with ``read_only=True``::
+
+        # Writer process
+        db = nnio.utils.HumanDataBase(path='/var/lib/reid/gallery')
+        key = db.find_closest(embedding)
+
+        # Reader process
+        db = nnio.utils.HumanDataBase(path='/var/lib/reid/gallery', read_only=True)
+        db.refresh()  # See people added by the writer
+        keys = db.query(embeddings)
+    '''
+    KEYS_FILE = 'keys.txt'
+
     def __init__(
         self,
         new_entity_threshold=0.25,
-        merging_threshold=0.2
+        merging_threshold=0.2,
+        index=None,
+        path=None,
+        read_only=False,
     ):
-        self.vectors = {}
-        self.counts = {}
+        '''
+        :parameter new_entity_threshold: ``float``.
+            A new person is added if the closest one is farther than this.
+        :parameter merging_threshold: ``float``. People closer than this are merged by :meth:`optimize`.
+        :parameter index: index from :mod:`nnio.index`. By default :class:`nnio.index.BruteForceIndex`.
+            Use :class:`nnio.index.IVFIndex` for large databases.
+        :parameter path: ``str`` or ``None``. Directory to keep the database in.
+            If it already has a database, it is opened.
+        :parameter read_only: ``bool``. Open the database in ``path`` without changing it.
+        '''
         self.new_entity_threshold = new_entity_threshold
         self.merging_threshold = merging_threshold
+        self.index = index if index is not None else _index.BruteForceIndex()
+        self.path = path
+        self.read_only = read_only
+        # Keys by id in the index, in order of insertion
+        self._keys = {}
+        self._ids = {}
+        # Keys of all ids, including removed ones
+        self._all_keys = []
+        # Counts by id
+        self._counts = None
+        self._keys_file = None
+        self._keys_offset = 0
+        if path is None:
+            self._storage = _index.ArrayStorage()
+            self.index.attach(self._storage)
+        else:
+            self._storage = _index.FileStorage(path, read_only=read_only)
+            self.index.attach(self._storage)
+            self.refresh()
+            if not read_only:
+                self._keys_file = open(os.path.join(path, self.KEYS_FILE), 'a')
+                # Drop an incomplete key written before a crash
+                self._keys_file.truncate(self._keys_offset)
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def vectors(self):
+        '''
+        Dict-like view of normalized vectors by key.
+        Setting a vector of a new key adds a person with count 1.
+        Assigning a ``dict`` replaces all people.
+        '''
+        return _VectorsView(self)
+
+    @vectors.setter
+    def vectors(self, vectors):
+        vectors = dict(vectors)
+        for key in list(self._ids):
+            if key not in vectors:
+                self._remove_key(key)
+        for key, vec in vectors.items():
+            self._set_vector(key, np.asarray(vec, dtype=np.float32))
+
+    @property
+    def counts(self):
+        '''
+        Dict-like view of numbers of vectors averaged for every key.
+        Assigning a ``dict`` sets counts of its keys.
+        '''
+        return _CountsView(self)
+
+    @counts.setter
+    def counts(self, counts):
+        for key, count in dict(counts).items():
+            self._set_count(self._ids[key], count)
+
+    def refresh(self):
+        '''
+        Read people which were added to ``path`` by another process since the database was opened.
+        '''
+        if self.path is None:
+            return
+        keys_path = os.path.join(self.path, self.KEYS_FILE)
+        if not os.path.exists(keys_path):
+            return
+        with open(keys_path, 'rb') as f:
+            f.seek(self._keys_offset)
+            data = f.read()
+        # The last key may be incomplete
+        data = data[:data.rfind(b'\n') + 1]
+        if not data:
+            return
+        self._keys_offset += len(data)
+        self._all_keys += data.decode().split('\n')[:-1]
+        size = len(self._all_keys)
+        self.index.extend(size)
+        if self._counts is None or len(self._counts) < size:
+            self._counts = self._storage.open('counts')
+        ids = self.index.ids().tolist()
+        self._keys = {vec_id: self._all_keys[vec_id] for vec_id in ids}
+        self._ids = {key: vec_id for vec_id, key in self._keys.items()}
+
+    def flush(self):
+        '''
+        Write all changes to disk. Changes are visible to other processes even without it.
+        '''
+        self.index.flush()
+        self._storage.flush(self._counts)
+        if self._keys_file is not None:
+            self._keys_file.flush()
+            os.fsync(self._keys_file.fileno())
+
+    def close(self):
+        ''' Flush and close files of the database '''
+        self.flush()
+        if self._keys_file is not None:
+            self._keys_file.close()
+            self._keys_file = None
+
+    def save(self, path):
+        '''
+        Write the database to a new directory. Removed people are left out.
+        It can be opened with ``HumanDataBase(path=path)``.
+
+        :parameter path: ``str``. Directory to write to.
+        '''
+        keys_path = os.path.join(path, self.KEYS_FILE)
+        if os.path.exists(keys_path):
+            raise BaseException('{} already has a database'.format(path))
+        storage = _index.FileStorage(path)
+        ids = self.index.ids()
+        if len(ids) > 0:
+            vectors = self.index.get(ids)
+            capacity = max(len(ids), _index.BruteForceIndex.INITIAL_CAPACITY)
+            arrays = [
+                storage.create('vectors', [capacity, vectors.shape[1]], np.float32),
+                storage.create('state', [capacity], np.uint8),
+                storage.create('counts', [capacity], np.int64),
+            ]
+            for array, values in zip(arrays, [vectors, _index.ALIVE, self._counts[ids]]):
+                array[:len(ids)] = values
+            storage.flush(*arrays)
+        with open(keys_path, 'w') as f:
+            f.write(''.join(self._keys[vec_id] + '\n' for vec_id in ids.tolist()))
+
+    def query(self, vec):
+        '''
+        Find the closest person without changing the database.
+        Works with read-only databases.
+
+        :parameter vec: numpy array of shape ``[D]`` or a batch of shape ``[N, D]``.
+        :return: ``str`` key of the person or ``None`` if nobody is closer than ``new_entity_threshold``.
+            List of keys for a batch.
+        '''
+        vec = np.asarray(vec, dtype=np.float32)
+        queries = vec.reshape(-1, vec.shape[-1])
+        queries = queries / np.sqrt((queries**2).sum(axis=1, keepdims=True))
+        keys = [None] * len(queries)
+        if len(self._keys) > 0:
+            distances, ids = self.index.search(queries)
+            for i, (distance, vec_id) in enumerate(zip(distances[:, 0], ids[:, 0].tolist())):
+                if vec_id >= 0 and distance <= self.new_entity_threshold:
+                    keys[i] = self._all_keys[vec_id]
+        return keys[0] if vec.ndim == 1 else keys
 
     def find_closest(self, vec):
-        keys = list(self.vectors.keys())
-        vec = self.normalize(vec)
-        distances = [
-            self.distance(vec, self.vectors[key])
-            for key in keys
-        ]
-        if len(distances) == 0:
-            id_min = None
+        '''
+        Find the person closest to the vector and update their vector with the running mean.
+        If nobody is closer than ``new_entity_threshold``, a new person is added.
+
+        :parameter vec: numpy array of shape ``[D]`` or a batch of shape ``[N, D]``.
+            Vectors of a batch are processed in order, with the same result as separate calls.
+        :return: ``str`` key of the person, or list of keys for a batch.
+        '''
+        vec = np.asarray(vec, dtype=np.float32)
+        if vec.ndim == 1:
+            return self._find_closest_batch(vec[None])[0]
+        return self._find_closest_batch(vec)
+
+    def _find_closest_batch(self, vecs):
+        queries = vecs / np.sqrt((vecs**2).sum(axis=1, keepdims=True))
+        # Every query may change one vector, so one of len(queries) candidates is still up to date
+        if len(self._keys) > 0:
+            candidates = zip(*self.index.search(queries, k=len(queries)))
         else:
-            id_min = np.argmin(distances)
-        if id_min is None or distances[id_min] > self.new_entity_threshold:
-            new_key = str(len(self.vectors))
-            print('adding', new_key)
-            if id_min is not None:
-                print(distances[id_min])
-            self.vectors[new_key] = vec
-            self.counts[new_key] = 1
-            return new_key
+            candidates = [([], [])] * len(queries)
+        # Ids changed after the search
+        changed = set()
+        keys = []
+        for query, (distances, ids) in zip(queries, candidates):
+            ids = np.asarray(ids, dtype=np.int64)
+            fresh = ids >= 0
+            if changed:
+                stale = np.array(sorted(changed), dtype=np.int64)
+                fresh &= ~np.isin(ids, stale)
+            distances = np.asarray(distances, dtype=np.float32)[fresh]
+            ids = ids[fresh]
+            if changed:
+                distances = np.concatenate([distances, 1 - self.index.get(stale) @ query])
+                ids = np.concatenate([ids, stale])
+            if len(ids) == 0:
+                id_min = None
+            else:
+                id_min = np.lexsort((ids, distances))[0]
+            if id_min is None or distances[id_min] > self.new_entity_threshold:
+                new_key = str(len(self._keys))
+                print('adding', new_key)
+                if id_min is not None:
+                    print(float(distances[id_min]))
+                changed.add(self._set_vector(new_key, query))
+                keys.append(new_key)
+            else:
+                vec_id = int(ids[id_min])
+                vector = self.index.get(vec_id) * self._counts[vec_id] + query
+                self.index.update(vec_id, self.normalize(vector))
+                self._set_count(vec_id, self._counts[vec_id] + 1)
+                changed.add(vec_id)
+                keys.append(self._keys[vec_id])
+        return keys
+
+    def _set_vector(self, key, vec):
+        '''
+        Set vector of the key with count 1, adding the key if needed.
+
+        :return: id of the vector in the index.
+        '''
+        vec_id = self._ids.get(key)
+        if vec_id is None:
+            vec_id = self.index.add(vec)
+            self._set_count(vec_id, 1)
+            self._keys[vec_id] = key
+            self._ids[key] = vec_id
+            self._all_keys.append(key)
+            if self._keys_file is not None:
+                # The key is written last, so that readers see only complete people
+                self._keys_file.write(key + '\n')
+                self._keys_file.flush()
         else:
-            key = keys[id_min]
-            self.vectors[key] = self.vectors[key] * self.counts[key] + vec
-            self.vectors[key] = self.normalize(self.vectors[key])
-            self.counts[key] = self.counts[key] + 1
+            self.index.update(vec_id, vec)
+            self._set_count(vec_id, 1)
+        return vec_id
 
-        return keys[id_min]
+    def _set_count(self, vec_id, count):
+        if self._counts is None:
+            self._counts = self._storage.create('counts', [_index.BruteForceIndex.INITIAL_CAPACITY], np.int64)
+        elif vec_id >= len(self._counts):
+            self._counts = self._storage.resize('counts', self._counts, max(2 * len(self._counts), vec_id + 1))
+        self._counts[vec_id] = count
 
     def optimize(self):
-        keys = list(self.vectors.keys())
-        if len(keys) < 2:
+        '''
+        Merge two closest people if they are closer than ``merging_threshold``.
+        '''
+        pair = self.index.closest_pair()
+        if pair is None:
             return
-        # Find vectors which are too close
-        distances = []
-        for i in range(len(keys) - 1):
-            for j in range(i + 1, len(keys)):
-                dst = self.distance(
-                    self.vectors[keys[i]],
-                    self.vectors[keys[j]],
-                )
-                if dst < self.merging_threshold:
-                    distances.append([i, j, dst])
-        # Merge two clusters which are the closest
-        if len(distances) > 0:
-            idx = np.argmin(np.array(distances)[:, 2])
-            i, j, dst = distances[idx]
-            print('Merging {} with {}'.format(i, j))
-            self.vectors[keys[i]] = self.vectors[keys[i]] + self.vectors[keys[j]]
-            self.vectors[keys[i]] = self.normalize(self.vectors[keys[i]])
-            self.counts[keys[i]] = 1
-            del self.vectors[keys[j]]
-            del self.counts[keys[j]]
+        dst, id_i, id_j = pair
+        if dst < self.merging_threshold:
+            positions = {vec_id: pos for pos, vec_id in enumerate(self._keys)}
+            print('Merging {} with {}'.format(positions[id_i], positions[id_j]))
+            self.index.update(id_i, self.normalize(self.index.get(id_i) + self.index.get(id_j)))
+            self._set_count(id_i, 1)
+            self._remove_key(self._keys[id_j])
 
+    def _remove_key(self, key):
+        vec_id = self._ids.pop(key)
+        del self._keys[vec_id]
+        self.index.remove(vec_id)
 
     @staticmethod
     def normalize(vec):
@@ -0,0 +1,87 @@
+import threading
+
+import numpy as np
+import pytest
+
+import nnio
+
+
+class _TupleModel(nnio.Model):
+    ''' Returns a tuple of two outputs, like detectors '''
+    def __init__(self, output_fn=None, info=None):
+        super().__init__()
+        self.output_fn = output_fn or (lambda x: (x * 2, x.sum(axis=1)))
+        self.info = {} if info is None else info
+        self.batch_sizes = []
+
+    def forward(self, x, return_info=False):
+        self.batch_sizes.append(len(x))
+        results = self.output_fn(x)
+        if return_info:
+            return results, self.info
+        return results
+
+
+def _call_together(model, inputs):
+    ''' Call the model from several threads at once, so that calls are batched '''
+    results = [None] * len(inputs)
+    errors = [None] * len(inputs)
+    barrier = threading.Barrier(len(inputs))
+
+    def call(i):
+        barrier.wait()
+        try:
+            results[i] = model(inputs[i])
+        except BaseException as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(inputs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_batches_keep_output_type():
+    model = nnio.BatchingModel(_TupleModel(), max_batch_size=4, max_wait_ms=200)
+    inputs = [np.full([1, 3], i, dtype=np.float32) for i in range(4)]
+    results, errors = _call_together(model, inputs)
+    model.close()
+    assert errors == [None] * 4
+    assert max(model.model.batch_sizes) > 1
+    for x, result in zip(inputs, results):
+        assert type(result) is tuple
+        np.testing.assert_array_equal(result[0], x * 2)
+        np.testing.assert_array_equal(result[1], x.sum(axis=1))
+
+
+def test_split_error_fails_every_call():
+    # Output without batch dimension can not be split
+    model = nnio.BatchingModel(
+        _TupleModel(lambda x: np.float32(x.sum())), max_batch_size=4, max_wait_ms=200)
+    inputs = [np.ones([1, 3], dtype=np.float32) for _ in range(4)]
+    _, errors = _call_together(model, inputs)
+    assert all(error is not None for error in errors)
+    # The worker is still running
+    model.model.output_fn = lambda x: x
+    np.testing.assert_array_equal(model(inputs[0]), inputs[0])
+    model.close()
+
+
+def test_forward_async_after_close():
+    model = nnio.BatchingModel(_TupleModel())
+    model.close()
+    with pytest.raises(RuntimeError):
+        model.forward_async(np.ones([1, 3], dtype=np.float32))
+
+
+def test_forward_async_after_worker_died():
+    # Info which is not a dict breaks the worker thread
+    model = nnio.BatchingModel(_TupleModel(info=object()), max_wait_ms=0)
+    future = model.forward_async(np.ones([1, 3], dtype=np.float32))
+    with pytest.raises(BaseException):
+        future.result(timeout=10)
+    model._thread.join(timeout=10)
+    with pytest.raises(RuntimeError):
+        model.forward_async(np.ones([1, 3], dtype=np.float32))
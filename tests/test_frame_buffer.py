@@ -0,0 +1,51 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import nnio
+
+
+def _read_frames(buffer, results):
+    frames = [(frame.seq, int(frame.image[0, 0])) for frame in buffer.reader(start=0, timeout=30)]
+    results.send(frames)
+    buffer.close()
+
+
+@pytest.fixture
+def buffer():
+    buffer = nnio.SharedFrameBuffer(shape=(4, 6), n_slots=4)
+    yield buffer
+    buffer.close()
+    buffer.unlink()
+
+
+def test_read_write(buffer):
+    assert buffer.read() is None
+    for i in range(6):
+        assert buffer.write(np.full((4, 6), i, dtype=np.uint8)) == i
+    frame = buffer.read()
+    assert frame.seq == 5
+    assert not frame.image.flags.writeable
+    np.testing.assert_array_equal(frame.image, np.full((4, 6), 5))
+    # Oldest frames are overwritten
+    assert buffer.read(1) is None
+    assert not buffer.is_valid(1)
+    assert buffer.read(2).seq == 2
+
+
+def test_reader_in_other_process(buffer):
+    context = multiprocessing.get_context('spawn')
+    results, child_results = context.Pipe(duplex=False)
+    process = context.Process(target=_read_frames, args=(buffer, child_results))
+    process.start()
+    for i in range(3):
+        buffer.write(np.full((4, 6), i, dtype=np.uint8))
+    buffer.finish()
+    assert results.recv() == [(0, 0), (1, 1), (2, 2)]
+    process.join()
+    assert process.exitcode == 0
+    # The memory is not removed when the reader exits
+    attached = nnio.SharedFrameBuffer(buffer.name)
+    assert attached.read().seq == 2
+    attached.close()
@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ['cv2', 'onnxruntime', 'torch', 'openvino']
+
+
+def test_import_is_lazy():
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import nnio'],
+        capture_output=True, text=True, check=True,
+        # Import nnio from this repository
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    # Lines look like "import time:       123 |        456 |   package.module"
+    imported = set()
+    for line in proc.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            imported.add(line.rsplit('|', 1)[1].strip().split('.')[0])
+    assert 'nnio' in imported
+    assert not imported & set(HEAVY_MODULES)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('onnx')
+pytest.importorskip('onnxruntime')
+
+import nnio
+from nnio import benchmark
+from nnio import utils
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    return benchmark.make_onnx_model(str(tmp_path / 'model.onnx'), (1, 3, 16, 16), n_filters=8)
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    old_cache_dir = utils.CACHE_DIR
+    utils.set_cache_dir(str(tmp_path / 'cache'))
+    yield tmp_path / 'cache'
+    utils.set_cache_dir(old_cache_dir)
+
+
+@pytest.fixture
+def checks(monkeypatch):
+    checked = []
+    check_session = nnio.ONNXModel._check_session
+
+    def counting_check(sess):
+        checked.append(sess)
+        return check_session(sess)
+
+    monkeypatch.setattr(nnio.ONNXModel, '_check_session', counting_check)
+    return checked
+
+
+def _optimized_files(cache_dir):
+    return sorted(cache_dir.rglob('*.onnx'))
+
+
+def test_cache_optimized(model_path, cache_dir, checks):
+    inputs = np.random.default_rng(0).random((1, 3, 16, 16), dtype=np.float32)
+    expected = nnio.ONNXModel(model_path)(inputs)
+    model = nnio.ONNXModel(model_path, cache_optimized=True)
+    assert len(_optimized_files(cache_dir)) == 1
+    assert len(checks) == 1
+    np.testing.assert_allclose(model(inputs), expected, rtol=1e-5, atol=1e-6)
+    # The saved file is not checked again
+    model = nnio.ONNXModel(model_path, cache_optimized=True)
+    assert len(checks) == 1
+    np.testing.assert_allclose(model(inputs), expected, rtol=1e-5, atol=1e-6)
+
+
+def test_cache_optimized_corrupted(model_path, cache_dir, checks):
+    nnio.ONNXModel(model_path, cache_optimized=True)
+    cached_path, = _optimized_files(cache_dir)
+    cached_path.write_bytes(b'corrupted')
+    with pytest.warns(UserWarning, match='Cannot load optimized model'):
+        nnio.ONNXModel(model_path, cache_optimized=True)
+    # The file is saved again
+    assert cached_path.stat().st_size > len(b'corrupted')
+    assert len(checks) == 2
@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('onnx')
+pytest.importorskip('openvino.inference_engine')
+
+import nnio
+from nnio import benchmark
+from nnio import utils
+
+
+@pytest.fixture(scope='module')
+def model_path(tmp_path_factory):
+    # Compute-bound model: the device is busy much longer than python overhead of a call
+    path = tmp_path_factory.mktemp('openvino') / 'model.onnx'
+    return benchmark.make_onnx_model(str(path), (1, 3, 128, 128), n_filters=64)
+
+
+@pytest.fixture
+def inputs():
+    return np.random.default_rng(0).random((1, 3, 128, 128), dtype=np.float32)
+
+
+def test_forward_after_forward_async(model_path, inputs):
+    model = nnio.OpenVINOModel('', model_path, num_requests=1)
+    expected = model(inputs)
+    for _ in range(5):
+        future = model.forward_async(inputs)
+        outputs = model(inputs)
+        np.testing.assert_array_equal(future.result(), expected)
+        np.testing.assert_array_equal(outputs, expected)
+    # Every call has returned its infer request
+    assert model._idle_requests.qsize() == 1
+    np.testing.assert_array_equal(model.forward_async(inputs).result(), expected)
+
+
+@pytest.mark.skipif(os.cpu_count() < 2, reason='Inferences overlap only on several cores')
+def test_async_throughput(model_path, inputs):
+    model = nnio.OpenVINOModel('', model_path, num_requests=2)
+    # Best of several runs, so that other processes on the machine do not fail the test
+    runs = [benchmark.benchmark_async_throughput(model, inputs, n_calls=50) for _ in range(3)]
+    assert max(run['async_throughput'] for run in runs) >= max(run['sync_throughput'] for run in runs)
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    old_cache_dir = utils.CACHE_DIR
+    utils.set_cache_dir(str(tmp_path / 'cache'))
+    yield tmp_path / 'cache'
+    utils.set_cache_dir(old_cache_dir)
+
+
+def _blobs(cache_dir):
+    return sorted(cache_dir.rglob('*.blob'))
+
+
+def test_cache_compiled(model_path, inputs, cache_dir, capsys):
+    expected = nnio.OpenVINOModel('', model_path)(inputs)
+    nnio.OpenVINOModel('', model_path, cache_compiled=True)
+    blobs = _blobs(cache_dir)
+    assert len(blobs) == 1
+    capsys.readouterr()
+    model = nnio.OpenVINOModel('', model_path, cache_compiled=True)
+    assert 'Importing compiled model' in capsys.readouterr().out
+    np.testing.assert_allclose(model(inputs), expected, rtol=1e-4, atol=1e-5)
+
+
+def test_cache_compiled_corrupted(model_path, inputs, cache_dir, capsys):
+    expected = nnio.OpenVINOModel('', model_path)(inputs)
+    nnio.OpenVINOModel('', model_path, cache_compiled=True)
+    blob, = _blobs(cache_dir)
+    blob.write_bytes(b'corrupted')
+    capsys.readouterr()
+    model = nnio.OpenVINOModel('', model_path, cache_compiled=True)
+    out = capsys.readouterr().out
+    assert 'Cannot import compiled model' in out
+    assert 'Loading model to' in out
+    np.testing.assert_allclose(model(inputs), expected, rtol=1e-4, atol=1e-5)
+    # The blob is exported again and can be imported
+    assert blob.stat().st_size > len(b'corrupted')
+    model = nnio.OpenVINOModel('', model_path, cache_compiled=True)
+    assert 'Loading model to' not in capsys.readouterr().out
+    np.testing.assert_allclose(model(inputs), expected, rtol=1e-4, atol=1e-5)
+
+
+def test_cache_compiled_other_build(model_path, inputs, cache_dir, capsys, monkeypatch):
+    nnio.OpenVINOModel('', model_path, cache_compiled=True)
+    old_blob, = _blobs(cache_dir)
+
+    # Blob of another openvino build is not imported
+    cache_file_path = utils.cache_file_path
+
+    def other_build_path(category, key, suffix=''):
+        key = dict(key, openvino=key['openvino'] + '-other')
+        return cache_file_path(category, key, suffix)
+
+    monkeypatch.setattr(utils, 'cache_file_path', other_build_path)
+    capsys.readouterr()
+    nnio.OpenVINOModel('', model_path, cache_compiled=True)
+    out = capsys.readouterr().out
+    assert 'Importing compiled model' not in out
+    assert 'Loading model to' in out
+    assert len(_blobs(cache_dir)) == 2
+    assert old_blob in _blobs(cache_dir)
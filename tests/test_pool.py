@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+import nnio
+
+
+class _DoubleModel(nnio.Model):
+    def forward(self, x, return_info=False):
+        return x * 2
+
+
+def test_map():
+    pool = nnio.ModelPool(lambda device: _DoubleModel(), n_replicas=3)
+    inputs = [np.full([2], i) for i in range(20)]
+    for x, result in zip(inputs, pool.map(inputs)):
+        np.testing.assert_array_equal(result, x * 2)
+    assert sum(stats['n_calls'] for stats in pool.utilization()) == 20
+    pool.close()
+
+
+def test_forward_async_after_close():
+    pool = nnio.ModelPool(lambda device: _DoubleModel(), n_replicas=2)
+    future = pool.forward_async(np.ones([2]))
+    pool.close()
+    # Calls made before close are finished
+    np.testing.assert_array_equal(future.result(), np.full([2], 2))
+    with pytest.raises(RuntimeError):
+        pool.forward_async(np.ones([2]))
+    # Closing twice is fine
+    pool.close()
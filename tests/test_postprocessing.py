@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from nnio import postprocessing
+
+ANCHORS = [[10, 13], [16, 30]]
+INPUT_SIZE = (64, 32)
+
+
+def _raw_output():
+    # Batch 1, grid 4x8 (height x width), 2 anchors, 3 classes
+    return np.random.default_rng(0).normal(0, 1, [1, 4, 8, 2 * 8]).astype(np.float32)
+
+
+def _expected_box(output, version, y=2, x=5, anchor=1):
+    values = output[0, y, x].reshape(2, 8)[anchor]
+    sigmoid = 1 / (1 + np.exp(-values))
+    if version == 5:
+        center = 2 * sigmoid[0:2] - 0.5 + [x, y]
+        size = np.square(2 * sigmoid[2:4]) * ANCHORS[anchor]
+    else:
+        center = sigmoid[0:2] + [x, y]
+        size = np.exp(values[2:4]) * ANCHORS[anchor]
+    center = center / [8, 4]
+    size = size / INPUT_SIZE
+    scores = sigmoid[4] * sigmoid[5:]
+    return np.concatenate([center - size / 2, center + size / 2]), scores
+
+
+@pytest.mark.parametrize('version', [3, 5])
+def test_decode_yolo(version):
+    output = _raw_output()
+    boxes, scores = postprocessing.decode_yolo(output, ANCHORS, INPUT_SIZE, version=version)
+    assert boxes.shape == (1, 4 * 8 * 2, 4)
+    assert scores.shape == (1, 4 * 8 * 2, 3)
+    expected_box, expected_scores = _expected_box(output, version)
+    index = (2 * 8 + 5) * 2 + 1
+    np.testing.assert_allclose(boxes[0, index], expected_box, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(scores[0, index], expected_scores, rtol=1e-5, atol=1e-6)
+
+    # Same result for channels first output and for the model which applies sigmoid itself
+    channels_first = postprocessing.decode_yolo(
+        output.transpose(0, 3, 1, 2), ANCHORS, INPUT_SIZE, channels_first=True, version=version)
+    np.testing.assert_allclose(channels_first[0], boxes, rtol=1e-5, atol=1e-6)
+    if version == 5:
+        activated = postprocessing.sigmoid(output)
+        no_sigmoid = postprocessing.decode_yolo(activated, ANCHORS, INPUT_SIZE, apply_sigmoid=False, version=5)
+        np.testing.assert_allclose(no_sigmoid[0], boxes, rtol=1e-5, atol=1e-6)
+
+
+def test_decode_yolo_unknown_version():
+    with pytest.raises(BaseException):
+        postprocessing.decode_yolo(_raw_output(), ANCHORS, INPUT_SIZE, version=4)
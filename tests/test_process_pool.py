@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pytest
+
+import nnio
+
+
+class _CrashingModel(nnio.Model):
+    ''' Doubles inputs. Exits the process on negative inputs '''
+    def forward(self, x, return_info=False):
+        if x.flat[0] < 0:
+            os._exit(3)
+        result = x * 2
+        if return_info:
+            return result, {}
+        return result
+
+
+def _make_model(device):
+    return _CrashingModel()
+
+
+@pytest.fixture(params=[1, 2])
+def pool(request):
+    pool = nnio.ProcessPoolModel(_make_model, n_workers=request.param, slot_bytes=2**16)
+    yield pool
+    pool.close()
+
+
+def test_map(pool):
+    inputs = [np.full([1, 8], i, dtype=np.float32) for i in range(20)]
+    for x, result in zip(inputs, pool.map(inputs)):
+        np.testing.assert_array_equal(result, x * 2)
+
+
+def test_restart_after_crash(pool):
+    with pytest.raises(BaseException, match='exited'):
+        pool(np.full([1, 8], -1, dtype=np.float32))
+    # Calls made while the worker is restarted wait for it or go to the other worker
+    inputs = [np.full([1, 8], i, dtype=np.float32) for i in range(20)]
+    futures = [pool.forward_async(x) for x in inputs]
+    for x, future in zip(inputs, futures):
+        np.testing.assert_array_equal(future.result(timeout=60), x * 2)
+    assert pool.n_restarts == 1
+    assert sum(stats['n_calls'] for stats in pool.utilization()) == 20
+
+
+def test_forward_after_close():
+    pool = nnio.ProcessPoolModel(_make_model, n_workers=1)
+    pool.close()
+    with pytest.raises(BaseException, match='closed'):
+        pool(np.ones([1, 8], dtype=np.float32))
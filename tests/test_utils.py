@@ -0,0 +1,165 @@
+import functools
+import hashlib
+import http.server
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from nnio import utils
+
+FILES = {
+    'a.bin': os.urandom(1000),
+    'b.bin': os.urandom(1000),
+    'c.bin': os.urandom(1000),
+}
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        name = self.path.lstrip('/')
+        if name == 'truncated.bin':
+            # Connection is closed before the promised number of bytes is sent
+            self.send_response(200)
+            self.send_header('Content-Length', '2000')
+            self.end_headers()
+            self.wfile.write(FILES['a.bin'])
+            return
+        if name not in FILES:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(FILES[name])))
+        self.end_headers()
+        self.wfile.write(FILES[name])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    old_cache_dir = utils.CACHE_DIR
+    utils.set_cache_dir(str(tmp_path / 'cache'))
+    yield tmp_path / 'cache'
+    utils.set_cache_dir(old_cache_dir)
+
+
+def _cached_files(cache_dir):
+    return sorted(name for _, _, names in os.walk(cache_dir) for name in names)
+
+
+def test_concurrent_downloads(server, cache_dir):
+    paths = []
+    threads = [
+        threading.Thread(target=lambda: paths.append(utils.file_from_url(server.url + 'a.bin')))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert server.requests == ['/a.bin']
+    assert len(set(paths)) == 1
+    with open(paths[0], 'rb') as f:
+        assert f.read() == FILES['a.bin']
+
+
+def test_truncated_download(server, cache_dir):
+    with pytest.raises(BaseException):
+        utils.file_from_url(server.url + 'truncated.bin')
+    # No partial file, temporary file or lock is left
+    assert _cached_files(cache_dir) == []
+
+
+def test_sha256_mismatch(server, cache_dir):
+    with pytest.raises(BaseException, match='Checksum mismatch'):
+        utils.file_from_url(server.url + 'a.bin', sha256='0' * 64)
+    assert _cached_files(cache_dir) == []
+    sha256 = hashlib.sha256(FILES['a.bin']).hexdigest()
+    path = utils.file_from_url(server.url + 'a.bin', sha256=sha256)
+    # Cached file with another digest is downloaded again
+    with open(path, 'wb') as f:
+        f.write(b'corrupted')
+    os.remove(path + utils.SHA256_SUFFIX)
+    utils.file_from_url(server.url + 'a.bin', sha256=sha256)
+    assert server.requests == ['/a.bin'] * 3
+    with open(path, 'rb') as f:
+        assert f.read() == FILES['a.bin']
+
+
+def test_evict_cache(server, cache_dir):
+    paths = {}
+    for i, name in enumerate(['a.bin', 'b.bin', 'c.bin']):
+        paths[name] = utils.file_from_url(server.url + name, 'other')
+        os.utime(paths[name], (i, i))
+    derived_path = utils.cache_file_path('onnx_optimized', {'model': 'a'}, '.onnx')
+    with open(derived_path, 'wb') as f:
+        f.write(bytes(1000))
+    # Files which nnio has not written
+    user_paths = [cache_dir / 'notes.txt', cache_dir / 'data' / 'other' / 'user.bin']
+    for path in user_paths:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(bytes(5000))
+
+    utils.evict_cache(2000, keep=[paths['a.bin']])
+    # The oldest file is kept, the next ones are removed
+    assert os.path.exists(paths['a.bin'])
+    assert not os.path.exists(paths['b.bin'])
+    assert not os.path.exists(paths['b.bin'] + utils.SHA256_SUFFIX)
+    assert not os.path.exists(paths['b.bin'] + utils.LOCK_SUFFIX)
+    assert not os.path.exists(paths['c.bin'])
+    assert os.path.exists(derived_path)
+    for path in user_paths:
+        assert path.exists()
+
+
+def _unit(vec):
+    vec = np.asarray(vec, dtype=np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def test_human_database_vectors_and_counts():
+    db = utils.HumanDataBase()
+    first = db.find_closest(_unit([1, 0, 0]))
+    assert db.find_closest(_unit([1, 0.01, 0])) == first
+    assert db.counts == {first: 2}
+    assert list(db.vectors) == [first]
+
+    # Setting a vector of a new key adds a person with count 1
+    db.vectors['other'] = _unit([0, 1, 0])
+    assert len(db) == 2
+    assert db.counts['other'] == 1
+    assert db.query(_unit([0, 1, 0])) == 'other'
+    # Setting a vector of an existing key keeps its count
+    db.vectors[first] = _unit([0, 0, 1])
+    assert db.query(_unit([0, 0, 1])) == first
+    assert db.counts[first] == 2
+    db.counts[first] = 5
+    assert db.counts == {first: 5, 'other': 1}
+
+    del db.vectors['other']
+    assert len(db) == 1
+    assert db.query(_unit([0, 1, 0])) is None
+
+    # Assigning dicts replaces all people
+    db.vectors = {'a': _unit([1, 1, 0]), 'b': _unit([0, 1, 1])}
+    db.counts = {'a': 3}
+    assert sorted(db.vectors) == ['a', 'b']
+    assert db.counts == {'a': 3, 'b': 1}
+    np.testing.assert_allclose(db.vectors['b'], _unit([0, 1, 1]))
+    assert db.query(_unit([1, 1, 0])) == 'a'